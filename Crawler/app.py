@@ -1,16 +1,19 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, send_file
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, send_file, Response, g
 import threading
-import asyncio
 import traceback
 from datetime import datetime
 import logging
 import json
 import tempfile
 import os
+import time
 
 from database import db_manager
-from crawler import WebCrawler
 from config import Config
+from metrics import COUNT_BUCKETS, PROMETHEUS_CONTENT_TYPE, REGISTRY, metrics_authorized, summarize_timings
+from page_archive import archive_exists, remove_archive
+from progress import create_progress_store, stopped_snapshot
+from worker import CrawlWorker, create_crawl_executor
 
 # Настройка логирования
 logging.basicConfig(
@@ -27,17 +30,121 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 app.secret_key = Config.SECRET_KEY
 
-# Глобальный словарь для отслеживания прогресса заданий
-job_progress = {}
+# Последние снимки прогресса заданий, доступные всем процессам сервера
+job_progress = create_progress_store(
+    Config.PROGRESS_BACKEND, db_manager,
+    write_interval=Config.PROGRESS_WRITE_INTERVAL,
+    poll_interval=Config.PROGRESS_POLL_INTERVAL
+)
+
+# Свободные места для потоков прогресса в этом процессе (см. stream_job_progress)
+_progress_stream_slots = threading.BoundedSemaphore(max(1, Config.PROGRESS_STREAM_MAX_CLIENTS))
+
+REGISTRY.describe('crawler_http_request_db_queries', 'histogram', 'SQL-запросов на веб-запрос по маршрутам',
+                  buckets=COUNT_BUCKETS)
+REGISTRY.describe('crawler_http_request_db_seconds', 'histogram', 'Время в БД на веб-запрос по маршрутам')
+
+
+@app.before_request
+def begin_query_stats():
+    """Подсчет SQL-запросов веб-запроса (маршрут - имя обработчика)"""
+    g.query_stats = db_manager.begin_query_stats(request.endpoint or 'unknown')
+
+
+@app.after_request
+def report_query_stats(response):
+    """Число запросов и время в БД: в метрики маршрута и, в режиме отладки, в заголовки ответа"""
+    stats = g.get('query_stats')
+    if stats is None:
+        return response
+    REGISTRY.observe('crawler_http_request_db_queries', stats.queries, endpoint=stats.label)
+    REGISTRY.observe('crawler_http_request_db_seconds', stats.db_seconds, endpoint=stats.label)
+    if app.debug or Config.SQL_DEBUG_HEADERS:
+        response.headers['X-DB-Queries'] = str(stats.queries)
+        response.headers['X-DB-Connections'] = str(stats.connections)
+        response.headers['X-DB-Time-Ms'] = f"{stats.db_seconds * 1000:.1f}"
+        response.headers['X-DB-Slow-Queries'] = str(len(stats.slow_queries))
+        response.headers['Server-Timing'] = f"db;dur={stats.db_seconds * 1000:.1f};desc=\"{stats.queries} queries\""
+    return response
+
+
+@app.teardown_request
+def end_query_stats(error=None):
+    stats = g.pop('query_stats', None)
+    if stats is not None:
+        db_manager.end_query_stats(stats)
+
+
+# Воркер краулинга внутри веб-процесса (CRAWL_EMBEDDED_WORKER, для разработки в одном процессе);
+# в рабочем развертывании задания выполняют отдельные процессы worker.py
+_embedded_worker_lock = threading.Lock()
+_embedded_worker_pid = None
+
+
+@app.before_request
+def ensure_embedded_worker():
+    """Запуск встроенного воркера в текущем процессе, если он включен"""
+    global _embedded_worker_pid
+    if not Config.CRAWL_EMBEDDED_WORKER or _embedded_worker_pid == os.getpid():
+        return
+    with _embedded_worker_lock:
+        if _embedded_worker_pid == os.getpid():
+            return
+        _embedded_worker_pid = os.getpid()
+        worker = CrawlWorker(
+            db_manager, create_crawl_executor(job_progress), job_progress,
+            lease_seconds=Config.CRAWL_WORKER_LEASE,
+            heartbeat_interval=Config.CRAWL_WORKER_HEARTBEAT,
+            poll_interval=Config.CRAWL_WORKER_POLL_INTERVAL,
+            memory_limit_mb=Config.CRAWL_PROCESS_MEMORY_MB
+        )
+        thread = threading.Thread(target=worker.run, name="EmbeddedCrawlWorker", daemon=True)
+        thread.start()
+
+
+# Фоновая очистка устаревших заданий: запускается лениво, по одному потоку на процесс
+# (при gunicorn --preload потоки, созданные до fork, в воркерах не живут)
+_retention_lock = threading.Lock()
+_retention_pid = None
+
+
+def run_retention_loop():
+    """Периодическое удаление заданий старше Config.JOB_RETENTION_DAYS"""
+    stop = threading.Event()
+    while not stop.wait(Config.RETENTION_CHECK_INTERVAL):
+        try:
+            for job_id in db_manager.expire_old_jobs(Config.JOB_RETENTION_DAYS):
+                remove_archive(job_id)
+        except Exception as e:
+            logger.error(f"Ошибка фоновой очистки заданий: {e}")
+
+
+@app.before_request
+def ensure_retention_worker():
+    """Запуск фоновой очистки в текущем процессе, если она включена"""
+    global _retention_pid
+    if Config.JOB_RETENTION_DAYS <= 0 or _retention_pid == os.getpid():
+        return
+    with _retention_lock:
+        if _retention_pid == os.getpid():
+            return
+        _retention_pid = os.getpid()
+        thread = threading.Thread(target=run_retention_loop, name="JobRetention", daemon=True)
+        thread.start()
+        logger.info(f"Запущена фоновая очистка заданий старше {Config.JOB_RETENTION_DAYS} дн.")
 
 
 def get_current_user():
-    """Получение текущего пользователя из сессии"""
+    """
+    Получение текущего пользователя из сессии.
+    Запись запоминается в g на время запроса, поэтому декораторы и обработчик читают ее один раз.
+    """
     if 'user_id' not in session:
         return None
 
-    user = db_manager.get_user_by_id(session['user_id'])
-    return user
+    if 'current_user' not in g:
+        g.current_user = db_manager.get_user_by_id(session['user_id'])
+    return g.current_user
 
 
 def login_required(f):
@@ -67,6 +174,19 @@ def admin_required(f):
     return decorated_function
 
 
+def get_job_list_filters():
+    """Параметры сортировки и фильтрации списка заданий из строки запроса"""
+    filters = {
+        'status': request.args.get('status') or None,
+        'sort': request.args.get('sort', 'created_at'),
+        'order': 'asc' if request.args.get('order') == 'asc' else 'desc',
+        'created_from': request.args.get('created_from') or None,
+        'created_to': request.args.get('created_to') or None,
+        'max_depth': request.args.get('max_depth', type=int),
+    }
+    return filters
+
+
 # Маршруты приложения
 
 @app.route('/')
@@ -153,22 +273,24 @@ def register():
 def dashboard():
     """Панель управления - список заданий"""
     user = get_current_user()
+    filters = get_job_list_filters()
+    cursor = request.args.get('cursor')
 
+    # Количество собранных страниц уже есть в счетчиках задания (pages_crawled)
     if user['role'] == 'admin':
-        jobs = db_manager.get_all_jobs()
+        jobs, next_cursor = db_manager.get_all_jobs(cursor=cursor, **filters)
+        job_counts = db_manager.get_job_status_counts()
     else:
-        jobs = db_manager.get_user_jobs(user['id'])
-
-    # Добавляем информацию о количестве собранных страниц
-    for job in jobs:
-        if job.get('pages_crawled') is None:
-            pages_count = db_manager.fetch_val(
-                "SELECT COUNT(*) FROM crawled_pages WHERE job_id = %s",
-                (job['id'],)
-            )
-            job['pages_crawled'] = pages_count or 0
+        jobs, next_cursor = db_manager.get_user_jobs(user['id'], cursor=cursor, **filters)
+        job_counts = db_manager.get_job_status_counts(user['id'])
+
+    return render_template('dashboard.html', jobs=jobs, user=user, job_counts=job_counts,
+                           filters=filters, cursor=cursor, next_cursor=next_cursor)
 
-    return render_template('dashboard.html', jobs=jobs, user=user)
+
+def render_create_job():
+    """Форма создания задания (флажок архива ответов - только если задан CRAWL_ARCHIVE_DIR)"""
+    return render_template('create_job.html', archive_enabled=bool(Config.CRAWL_ARCHIVE_DIR))
 
 
 @app.route('/create_job', methods=['GET', 'POST'])
@@ -191,113 +313,46 @@ def create_job():
         except (ValueError, TypeError) as e:
             logger.error(f"Ошибка преобразования параметров: {e}")
             flash('Ошибка в параметрах задания', 'error')
-            return render_template('create_job.html')
+            return render_create_job()
 
         if not job_name or not start_url:
             flash('Необходимо заполнить все поля', 'error')
-            return render_template('create_job.html')
+            return render_create_job()
 
         # Валидация URL
         if not start_url.startswith(('http://', 'https://')):
             flash('URL должен начинаться с http:// или https://', 'error')
-            return render_template('create_job.html')
+            return render_create_job()
 
         # Валидация параметров
         if max_pages < 1 or max_pages > 1000:
             flash('Количество страниц должно быть от 1 до 1000', 'error')
-            return render_template('create_job.html')
+            return render_create_job()
 
         if max_depth < 1 or max_depth > 10:
             flash('Глубина должна быть от 1 до 10', 'error')
-            return render_template('create_job.html')
+            return render_create_job()
 
         if delay < 0 or delay > 10:
             flash('Задержка должна быть от 0 до 10 секунд', 'error')
-            return render_template('create_job.html')
+            return render_create_job()
 
         try:
-            # Создаем запись в БД
+            # Создаем запись в БД: задание ждет в очереди, его заберет свободный воркер краулинга
+            archive = bool(Config.CRAWL_ARCHIVE_DIR) and request.form.get('archive') == '1'
             job_id = db_manager.create_job(
-                user['id'], job_name, start_url, max_pages, max_depth, delay
+                user['id'], job_name, start_url, max_pages, max_depth, delay, status='queued', archive=archive,
+                max_queued=Config.CRAWL_QUEUE_SIZE
             )
+            if job_id is None:
+                flash('Очередь заданий заполнена, попробуйте позже', 'error')
+                return render_create_job()
             logger.info(f"Создано задание с ID: {job_id}")
 
-            # Создаем краулер
-            logger.info("Создание краулера...")
-            crawler = WebCrawler(
-                job_name=job_name,
-                start_url=start_url,
-                user_id=user['id'],
-                max_pages=max_pages,
-                delay=delay,
-                max_depth=max_depth
-            )
-            crawler.job_id = job_id
-
-            # Устанавливаем db_manager для краулера
-            crawler.set_db_manager(db_manager)
-
-            logger.info("Краулер создан успешно")
-
-            # Запускаем краулер в отдельном потоке
-            logger.info("Создание потока для краулера...")
-
-            def run_crawler_thread():
-                logger.info("Запуск краулера в потоке...")
-                logger.info(f"Поток запущен: {threading.current_thread().name}")
-
-                # Устанавливаем callback для отслеживания прогресса
-                def progress_callback(**kwargs):
-                    job_progress[job_id] = {
-                        'active': True,
-                        'job_id': job_id,
-                        'updated_at': datetime.now().strftime('%H:%M:%S'),
-                        **kwargs
-                    }
-
-                crawler.progress_callback = progress_callback
-
-                # Создаем новый цикл событий для потока
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-
-                try:
-                    # Запускаем краулинг
-                    result = loop.run_until_complete(crawler.crawl())
-                    logger.info(f"Краулер завершен успешно, результат: {result}")
-
-                    # Помечаем задание как неактивное
-                    if job_id in job_progress:
-                        job_progress[job_id]['active'] = False
-
-                except Exception as e:
-                    logger.error(f"Ошибка в краулере: {e}")
-                    import traceback
-                    logger.error(f"Traceback: {traceback.format_exc()}")
-
-                    # Обновляем статус на failed
-                    try:
-                        db_manager.update_job_status(job_id, 'failed')
-                    except Exception as update_error:
-                        logger.error(f"Ошибка обновления статуса: {update_error}")
-
-                    # Помечаем задание как неактивное с ошибкой
-                    if job_id in job_progress:
-                        job_progress[job_id].update({
-                            'active': False,
-                            'status': 'failed',
-                            'message': f'Ошибка: {str(e)}'
-                        })
-                finally:
-                    logger.info("Закрытие цикла событий")
-                    loop.close()
-
-            # Запускаем поток
-            thread = threading.Thread(target=run_crawler_thread, name=f"Crawler-{job_id}")
-            thread.daemon = True
-            thread.start()
-
-            flash(f'Задание "{job_name}" запущено!', 'success')
+            # Снимок с позицией в очереди пишется сразу в БД, дальнейшие снимки воркера читаются оттуда же
+            db_manager.publish_queue_positions()
+
+            flash(f'Задание "{job_name}" поставлено в очередь', 'success')
             return redirect(url_for('job_details', job_id=job_id))
 
         except Exception as e:
@@ -305,9 +360,9 @@ def create_job():
             import traceback
             logger.error(f"Traceback: {traceback.format_exc()}")
             flash('Ошибка при создании задания', 'error')
-            return render_template('create_job.html')
+            return render_create_job()
 
-    return render_template('create_job.html')
+    return render_create_job()
 
 
 @app.route('/job/<int:job_id>')
@@ -324,9 +379,66 @@ def job_details(job_id):
         return redirect(url_for('dashboard'))
 
     # Получаем страницы задания
-    pages = db_manager.get_job_pages(job_id, user['id'] if user['role'] != 'admin' else None, user['role'] == 'admin')
+    pages_cursor = request.args.get('pages_cursor')
+    pages, next_pages_cursor = db_manager.get_job_pages(
+        job_id, user['id'] if user['role'] != 'admin' else None, user['role'] == 'admin',
+        cursor=pages_cursor
+    )
+
+    return render_template('job_details.html', job=job, pages=pages, user=user,
+                           timings=summarize_timings(job.get('timings')),
+                           archive_available=job['archive'] and archive_exists(job_id),
+                           pages_cursor=pages_cursor, next_pages_cursor=next_pages_cursor)
+
+
+# Сообщения о командах управления, примененных сразу (задание не выполнялось)
+JOB_CONTROL_MESSAGES = {
+    'pause': 'Задание приостановлено',
+    'resume': 'Задание возвращено в очередь',
+    'cancel': 'Задание отменено',
+}
+
+
+@app.route('/job/<int:job_id>/<any(pause, resume, cancel):action>', methods=['POST'])
+@login_required
+def control_job(job_id, action):
+    """Пауза, возобновление или отмена задания"""
+    user = get_current_user()
+
+    status = db_manager.request_job_control(job_id, action, user['id'] if user['role'] != 'admin' else None,
+                                            user['role'] == 'admin')
+    if status is None:
+        flash('Команда неприменима к заданию в текущем статусе', 'error')
+    elif status == 'running':
+        # Выполняющееся задание остановит воркер после текущей страницы
+        flash('Команда отправлена, задание остановится после текущей страницы', 'info')
+    else:
+        # Снимок пишется сразу в БД, как и при создании задания
+        if status == 'queued':
+            db_manager.publish_queue_positions()
+        else:
+            db_manager.save_job_progress(job_id, stopped_snapshot(job_id, status))
+        flash(JOB_CONTROL_MESSAGES[action], 'success')
+
+    return redirect(url_for('job_details', job_id=job_id))
+
 
-    return render_template('job_details.html', job=job, pages=pages, user=user)
+@app.route('/job/<int:job_id>/reextract', methods=['POST'])
+@login_required
+def reextract_job(job_id):
+    """Повторное извлечение данных задания из архива ответов без обхода сайта"""
+    user = get_current_user()
+
+    if not archive_exists(job_id):
+        flash('Архив ответов задания не найден', 'error')
+    elif db_manager.request_job_reextract(job_id, user['id'] if user['role'] != 'admin' else None,
+                                          user['role'] == 'admin'):
+        db_manager.publish_queue_positions()
+        flash('Задание поставлено в очередь на повторное извлечение из архива', 'success')
+    else:
+        flash('Повторное извлечение доступно только для завершенных заданий с архивом', 'error')
+
+    return redirect(url_for('job_details', job_id=job_id))
 
 
 @app.route('/job/<int:job_id>/delete', methods=['POST'])
@@ -342,18 +454,23 @@ def delete_job(job_id):
         flash('Задание не найдено', 'error')
         return redirect(url_for('dashboard'))
 
+    # Выполняющееся задание продолжало бы писать в удаленные партиции
+    if job['status'] == 'running':
+        flash('Задание выполняется: отмените его перед удалением', 'warning')
+        return redirect(url_for('job_details', job_id=job_id))
+
     try:
         # Удаляем задание
         success = db_manager.delete_job(job_id, user['id'] if user['role'] != 'admin' else None,
                                         user['role'] == 'admin')
 
         if success:
+            remove_archive(job_id)
             flash(f'Задание "{job["job_name"]}" успешно удалено', 'success')
             logger.info(f"Пользователь {user['username']} удалил задание {job_id}")
 
             # Удаляем информацию о прогрессе, если есть
-            if job_id in job_progress:
-                del job_progress[job_id]
+            job_progress.discard(job_id)
         else:
             flash('Ошибка при удалении задания', 'error')
 
@@ -562,6 +679,22 @@ def preview_export_data(job_id):
 
 
 # API для отслеживания прогресса
+# Максимум заданий в одном запросе пакетного прогресса
+MAX_PROGRESS_BATCH = 100
+
+
+def job_status_progress(job: dict) -> dict:
+    """Прогресс задания по его записи в БД, когда снимка в памяти нет"""
+    return {
+        'active': job['status'] == 'queued',
+        'job_id': job['id'],
+        'status': job['status'],
+        'progress': 100 if job['status'] == 'completed' else 0,
+        'pages_processed': job['pages_crawled'],
+        'message': f'Задание {job["status"]}'
+    }
+
+
 @app.route('/api/job/<int:job_id>/progress')
 @login_required
 def get_job_progress(job_id):
@@ -575,18 +708,140 @@ def get_job_progress(job_id):
         return jsonify({'error': 'Задание не найдено'}), 404
 
     # Проверяем, есть ли информация о прогрессе
-    if job_id in job_progress:
-        progress_data = job_progress[job_id].copy()
+    progress_data = job_progress.get(job_id)
+    if progress_data is not None:
         return jsonify(progress_data)
 
     # Если нет активного прогресса, возвращаем статус из БД
-    return jsonify({
-        'active': False,
-        'job_id': job_id,
-        'status': job['status'],
-        'progress': 100 if job['status'] == 'completed' else 0,
-        'message': f'Задание {job["status"]}'
+    return jsonify(job_status_progress(job))
+
+
+@app.route('/api/jobs/progress')
+@login_required
+def get_jobs_progress():
+    """
+    Прогресс нескольких заданий одним ответом: ?ids=1,2,3 или все выполняющиеся задания пользователя.
+    Ответ снабжается ETag, и неизменившееся состояние возвращается как 304 без тела.
+    """
+    user = get_current_user()
+    job_ids = None
+    if request.args.get('ids'):
+        try:
+            job_ids = [int(job_id) for job_id in request.args['ids'].split(',') if job_id.strip()]
+        except ValueError:
+            return jsonify({'error': 'Некорректный список заданий'}), 400
+        if len(job_ids) > MAX_PROGRESS_BATCH:
+            return jsonify({'error': f'Не более {MAX_PROGRESS_BATCH} заданий за запрос'}), 400
+
+    rows = db_manager.get_jobs_progress(job_ids, user['id'] if user['role'] != 'admin' else None)
+    jobs = {}
+    for row in rows:
+        jobs[row['id']] = job_progress.get_local(row['id']) or row['snapshot'] or job_status_progress(row)
+
+    response = jsonify({
+        'jobs': jobs,
+        'active_count': sum(1 for snapshot in jobs.values() if snapshot.get('active'))
     })
+    response.headers['Cache-Control'] = 'no-cache'
+    response.add_etag()
+    return response.make_conditional(request)
+
+
+@app.route('/api/job/<int:job_id>/progress/stream')
+@login_required
+def stream_job_progress(job_id):
+    """
+    Поток Server-Sent Events с прогрессом задания.
+    Права проверяются один раз при подключении, дальше события берутся из хранилища прогресса
+    (таблица job_progress): не чаще PROGRESS_STREAM_MIN_INTERVAL
+    (промежуточные снимки схлопываются), а при отсутствии изменений отправляется комментарий-heartbeat.
+    Каждый поток занимает рабочий поток сервера, поэтому их число на процесс ограничено
+    PROGRESS_STREAM_MAX_CLIENTS; сверх предела отвечаем 503, и клиент переходит на опрос /progress.
+    """
+    user = get_current_user()
+    job = db_manager.get_job_details(job_id, user['id'] if user['role'] != 'admin' else None, user['role'] == 'admin')
+
+    if not job:
+        return jsonify({'error': 'Задание не найдено'}), 404
+
+    if not _progress_stream_slots.acquire(blocking=False):
+        response = jsonify({'error': 'Слишком много потоков прогресса, используйте опрос', 'fallback': 'polling'})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(Config.PROGRESS_STREAM_MAX_AGE)
+        return response
+
+    fallback = job_status_progress(job)
+
+    def generate():
+        # Поток ограничен по времени, чтобы не занимать рабочий поток сервера бесконечно;
+        # EventSource переподключится сам через retry миллисекунд
+        deadline = time.monotonic() + Config.PROGRESS_STREAM_MAX_AGE
+        version = -1
+        yield 'retry: 3000\n\n'
+
+        while time.monotonic() < deadline:
+            new_version, snapshot = job_progress.wait_for_update(
+                job_id, version, Config.PROGRESS_HEARTBEAT_INTERVAL
+            )
+            if new_version == version:
+                yield ': heartbeat\n\n'
+                continue
+            version = new_version
+
+            if snapshot is None:
+                # Задание выполняется не в этом процессе или еще не начало отчитываться
+                if job['status'] in ('running', 'queued'):
+                    continue
+                snapshot = fallback
+
+            yield f"data: {json.dumps(snapshot, ensure_ascii=False)}\n\n"
+            if not snapshot.get('active'):
+                yield 'event: end\ndata: {}\n\n'
+                return
+
+            time.sleep(Config.PROGRESS_STREAM_MIN_INTERVAL)
+
+    response = Response(generate(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Место освобождается при закрытии ответа, в том числе если клиент отключился до первого события
+    response.call_on_close(_progress_stream_slots.release)
+    return response
+
+
+@app.route('/api/job/<int:job_id>/page/<int:page_id>')
+@login_required
+def get_page_details(job_id, page_id):
+    """API для ленивой загрузки содержимого страницы при раскрытии строки"""
+    user = get_current_user()
+
+    page = db_manager.get_page_details(job_id, page_id, user['id'] if user['role'] != 'admin' else None,
+                                       user['role'] == 'admin')
+    if not page:
+        return jsonify({'error': 'Страница не найдена'}), 404
+
+    page['crawled_at'] = page['crawled_at'].isoformat() if page.get('crawled_at') else None
+    return jsonify(page)
+
+
+def collect_job_metrics():
+    """Число заданий по статусам из БД - общее для всех процессов"""
+    counts = db_manager.get_job_status_counts()
+    return [('crawler_jobs', {'status': status}, count) for status, count in counts.items() if status != 'total']
+
+
+REGISTRY.describe('crawler_jobs', 'gauge', 'Задания по статусам (crawl_jobs)')
+REGISTRY.add_collector(collect_job_metrics)
+
+
+@app.route('/metrics')
+def metrics():
+    """
+    Метрики процесса в формате Prometheus: длительности этапов краулинга (если задания выполняются
+    в этом процессе) и число заданий по статусам. Воркеры отдают свои метрики на CRAWL_WORKER_METRICS_PORT.
+    """
+    if not metrics_authorized(request.headers.get('Authorization'), request.remote_addr, Config.METRICS_TOKEN):
+        return Response('Unauthorized\n', status=401, mimetype='text/plain')
+    return Response(REGISTRY.render(), content_type=PROMETHEUS_CONTENT_TYPE)
 
 
 # Административные маршруты
@@ -595,10 +850,52 @@ def get_job_progress(job_id):
 @admin_required
 def admin_panel():
     """Административная панель"""
-    users = db_manager.get_all_users()
-    jobs = db_manager.get_all_jobs()
+    users_cursor = request.args.get('users_cursor')
+    jobs_cursor = request.args.get('jobs_cursor')
 
-    return render_template('admin_panel.html', users=users, jobs=jobs)
+    users, next_users_cursor = db_manager.get_all_users(cursor=users_cursor, limit=20)
+    jobs, next_jobs_cursor = db_manager.get_all_jobs(cursor=jobs_cursor, limit=10)
+
+    return render_template('admin_panel.html', users=users, jobs=jobs,
+                           user_counts=db_manager.get_user_role_counts(),
+                           job_counts=db_manager.get_job_status_counts(),
+                           top_users=db_manager.get_top_users_by_jobs(),
+                           profiles=db_manager.get_job_profiles(),
+                           profile_duration=Config.CRAWL_PROFILE_DEFAULT_DURATION,
+                           users_cursor=users_cursor, jobs_cursor=jobs_cursor,
+                           next_users_cursor=next_users_cursor, next_jobs_cursor=next_jobs_cursor)
+
+
+@app.route('/admin/job/<int:job_id>/profile', methods=['POST'])
+@login_required
+@admin_required
+def admin_profile_job(job_id):
+    """Запрос семплирующего профиля выполняющегося задания"""
+    duration = request.form.get('duration', Config.CRAWL_PROFILE_DEFAULT_DURATION, type=int)
+    duration = max(1, min(duration, Config.CRAWL_PROFILE_MAX_DURATION))
+
+    profile_id = db_manager.request_job_profile(job_id, get_current_user()['id'], duration)
+    if profile_id:
+        flash(f'Профилирование задания {job_id} запрошено на {duration} с', 'success')
+    else:
+        flash('Профилировать можно только выполняющееся задание', 'error')
+    return redirect(url_for('admin_panel'))
+
+
+@app.route('/admin/profile/<int:profile_id>')
+@login_required
+@admin_required
+def admin_download_profile(profile_id):
+    """Скачивание профиля в формате collapsed stacks (flamegraph.pl, speedscope)"""
+    profile = db_manager.get_job_profile(profile_id)
+    if not profile or not profile['data']:
+        flash('Профиль не найден или еще не готов', 'error')
+        return redirect(url_for('admin_panel'))
+
+    return Response(
+        profile['data'], mimetype='text/plain',
+        headers={'Content-Disposition': f'attachment; filename=job_{profile["job_id"]}_profile_{profile_id}.folded'}
+    )
 
 
 @app.route('/admin/toggle_role/<int:user_id>', methods=['POST'])
@@ -680,11 +977,13 @@ def admin_delete_user(user_id):
         flash('Нельзя удалить администратора', 'error')
         return redirect(url_for('admin_panel'))
 
-    success = db_manager.delete_user(user_id)
-    if success:
+    job_ids = db_manager.delete_user(user_id)
+    if job_ids is not None:
+        for job_id in job_ids:
+            remove_archive(job_id)
         flash(f'Пользователь {user_to_delete["username"]} удален', 'success')
     else:
-        flash('Ошибка удаления пользователя', 'error')
+        flash('Не удалось удалить пользователя (выполняющиеся задания нужно сначала отменить)', 'error')
 
     return redirect(url_for('admin_panel'))
 
@@ -0,0 +1,356 @@
+"""
+Офлайн-бенчмарк краулера на синтетическом сайте.
+
+Локальный aiohttp-сервер в отдельном процессе отдает детерминированный (по seed) сайт:
+заданное число страниц, ссылок на странице, размер страницы, распределение задержек,
+доля ошибок 500 и ответов 429, ловушки с бесконечным пространством URL.
+WebCrawler обходит его с хранилищем в памяти (или с PostgreSQL), результат - JSON
+со скоростью, задержками страниц, процессорным временем и пиковым RSS.
+С --baseline результат сравнивается с прошлым запуском, и регрессия больше --tolerance
+завершает процесс с кодом 1.
+
+    python benchmarks/crawl_benchmark.py --pages 500 --output results.json
+    python benchmarks/crawl_benchmark.py --pages 500 --baseline results.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiohttp import web
+
+from crawler import WebCrawler
+from metrics import summarize_timings
+
+# Слова для текста синтетических страниц
+WORDS = ('crawler', 'page', 'network', 'latency', 'index', 'parser', 'queue', 'storage', 'thread', 'socket',
+         'document', 'header', 'content', 'request', 'response', 'archive', 'search', 'link', 'metric', 'table')
+
+# Метрики результата и направление улучшения: True - чем больше, тем лучше
+COMPARED_METRICS = {
+    'pages_per_sec': True,
+    'latency_p50_ms': False,
+    'latency_p99_ms': False,
+    'cpu_ms_per_page': False,
+    'peak_rss_mb': False,
+}
+
+
+class SyntheticSite:
+    """Детерминированный сайт: содержимое и поведение каждой страницы зависят только от seed и пути"""
+
+    def __init__(self, pages: int = 200, fanout: int = 10, page_size: int = 20000, latency_ms: float = 0.0,
+                 latency_dist: str = 'fixed', error_rate: float = 0.0, rate_limit_rate: float = 0.0,
+                 trap_rate: float = 0.0, seed: int = 1):
+        self.pages = pages
+        self.fanout = fanout
+        self.page_size = page_size
+        self.latency_ms = latency_ms
+        self.latency_dist = latency_dist
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.trap_rate = trap_rate
+        self.seed = seed
+        # Страницы, уже ответившие 429: повторный запрос проходит
+        self._rate_limited = set()
+
+    def _rng(self, path: str) -> random.Random:
+        return random.Random(f"{self.seed}:{path}")
+
+    def _latency(self, rng: random.Random) -> float:
+        if self.latency_ms <= 0:
+            return 0.0
+        if self.latency_dist == 'exponential':
+            return rng.expovariate(1000 / self.latency_ms)
+        if self.latency_dist == 'uniform':
+            return rng.uniform(0, 2 * self.latency_ms) / 1000
+        return self.latency_ms / 1000
+
+    def render(self, path: str, links: List[str], rng: random.Random) -> str:
+        """HTML страницы со ссылками, дополненный абзацами текста до page_size байт"""
+        parts = [
+            '<!DOCTYPE html><html lang="en"><head><meta charset="utf-8">',
+            f'<title>Synthetic {path}</title>',
+            f'<meta name="description" content="Synthetic page {path}">',
+            '<meta name="keywords" content="benchmark, crawler">',
+            '<style>body { font-family: sans-serif; }</style><script>var page = 1;</script>',
+            f'</head><body><h1>Page {path}</h1><nav>',
+        ]
+        parts.extend(f'<a href="{link}">Link to {link}</a> ' for link in links)
+        parts.append('</nav><h2>Content</h2>')
+
+        size = sum(map(len, parts))
+        while size < self.page_size:
+            paragraph = '<p>' + ' '.join(rng.choice(WORDS) for _ in range(60)) + '</p>'
+            parts.append(paragraph)
+            size += len(paragraph)
+        parts.append('</body></html>')
+        return ''.join(parts)
+
+    async def page(self, request: web.Request) -> web.Response:
+        number = int(request.match_info['number'])
+        path = request.path
+        rng = self._rng(path)
+        delay = self._latency(rng)
+        if delay:
+            await asyncio.sleep(delay)
+
+        if number >= self.pages:
+            return web.Response(status=404, text='Not found')
+        # Стартовая страница всегда доступна, иначе обход закончится сразу
+        if number and rng.random() < self.error_rate:
+            return web.Response(status=500, text='Internal error')
+        if number and rng.random() < self.rate_limit_rate and path not in self._rate_limited:
+            self._rate_limited.add(path)
+            return web.Response(status=429, text='Too many requests', headers={'Retry-After': '1'})
+
+        links = [f'/page/{rng.randrange(self.pages)}' for _ in range(self.fanout)]
+        if rng.random() < self.trap_rate:
+            links.append(f'/trap/{number}/0')
+        return web.Response(text=self.render(path, links, rng), content_type='text/html')
+
+    async def trap(self, request: web.Request) -> web.Response:
+        """Ловушка: каждая страница ведет на следующую "дату" и на вариант с уникальным параметром"""
+        trap_id, depth = request.match_info['trap'], int(request.match_info['depth'])
+        rng = self._rng(request.path_qs)
+        links = [f'/trap/{trap_id}/{depth + 1}', f'/trap/{trap_id}/{depth}?session={rng.getrandbits(32):08x}']
+        return web.Response(text=self.render(request.path_qs, links, rng), content_type='text/html')
+
+    async def robots(self, request: web.Request) -> web.Response:
+        return web.Response(text='User-agent: *\nAllow: /\n')
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get('/robots.txt', self.robots)
+        app.router.add_get('/page/{number:\\d+}', self.page)
+        app.router.add_get('/trap/{trap}/{depth:\\d+}', self.trap)
+        return app
+
+
+def serve_site(options: Dict, port_queue):
+    """Процесс сервера: нагрузка сервера не попадает в процессорное время и память краулера"""
+
+    async def run():
+        runner = web.AppRunner(SyntheticSite(**options).app(), access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        port_queue.put(runner.addresses[0][1])
+        await asyncio.Event().wait()
+
+    asyncio.run(run())
+
+
+class MemoryStorage:
+    """
+    Хранилище в памяти вместо DatabaseManager: те же методы, которые вызывает WebCrawler.
+    Данные страниц сериализуются в JSON, как при записи в БД, чтобы стоимость на стороне краулера сохранялась.
+    """
+
+    def __init__(self):
+        self.jobs: Dict[int, Dict] = {}
+        self.pages: Dict[str, int] = {}
+        self.links = 0
+        self.timings: Dict = {}
+        self.checkpoint: Optional[Dict] = None
+
+    def create_job(self, user_id, job_name, start_url, max_pages, max_depth, delay, status='running') -> int:
+        job_id = len(self.jobs) + 1
+        self.jobs[job_id] = {'status': status, 'pages_failed': 0}
+        return job_id
+
+    def update_job_status(self, job_id: int, status: str):
+        self.jobs[job_id]['status'] = status
+
+    def save_page(self, job_id, url, title, depth, status_code, metadata, content, bytes_downloaded=0):
+        if url in self.pages:
+            return None
+        json.dumps(metadata, ensure_ascii=False)
+        json.dumps(content, ensure_ascii=False)
+        self.pages[url] = len(self.pages) + 1
+        return self.pages[url]
+
+    def save_links(self, job_id, page_id, links, link_texts=None):
+        json.dumps(link_texts or {}, ensure_ascii=False)
+        self.links += len(links)
+
+    def increment_job_counters(self, job_id: int, **deltas):
+        for name, value in deltas.items():
+            self.jobs[job_id][name] = self.jobs[job_id].get(name, 0) + value
+
+    def save_job_timings(self, job_id: int, timings: Dict):
+        self.timings = timings
+
+    def get_job_timings(self, job_id: int) -> Dict:
+        return self.timings
+
+    def save_job_checkpoint(self, job_id, frontier, visited, stats):
+        self.checkpoint = {'frontier': list(frontier), 'visited': set(visited), 'stats': dict(stats)}
+
+    def get_job_checkpoint(self, job_id: int) -> Optional[Dict]:
+        return None
+
+    def delete_job_checkpoint(self, job_id: int):
+        self.checkpoint = None
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+
+async def run_crawl(start_url: str, storage, max_pages: int, max_depth: int) -> Dict:
+    """Обход сайта с замером задержки каждой страницы и процессорного времени"""
+    crawler = WebCrawler(job_name='benchmark', start_url=start_url, max_pages=max_pages,
+                         delay=0, max_depth=max_depth)
+    crawler.set_db_manager(storage)
+    # Замеряется загрузка по сети: общий кеш HTTP-ответов не используется
+    crawler.response_cache = None
+
+    latencies = []
+    process_url = crawler.process_url
+
+    async def timed_process_url(url, depth, queue):
+        started = time.perf_counter()
+        try:
+            await process_url(url, depth, queue)
+        finally:
+            latencies.append(time.perf_counter() - started)
+
+    crawler.process_url = timed_process_url
+
+    usage_before = resource.getrusage(resource.RUSAGE_SELF)
+    started = time.perf_counter()
+    job_id = await crawler.crawl()
+    wall = time.perf_counter() - started
+    usage_after = resource.getrusage(resource.RUSAGE_SELF)
+    cpu = (usage_after.ru_utime - usage_before.ru_utime) + (usage_after.ru_stime - usage_before.ru_stime)
+
+    pages = crawler.stats['pages_successful']
+    return {
+        'job_id': job_id,
+        'pages': pages,
+        'pages_failed': crawler.stats['pages_failed'],
+        'links': crawler.stats['links_found'],
+        'bytes_downloaded': crawler.stats['bytes_downloaded'],
+        'wall_s': round(wall, 3),
+        'pages_per_sec': round(pages / wall, 2) if wall else 0.0,
+        'latency_p50_ms': round(percentile(latencies, 0.5) * 1000, 2),
+        'latency_p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'latency_mean_ms': round(statistics.fmean(latencies) * 1000, 2) if latencies else 0.0,
+        'cpu_s': round(cpu, 3),
+        'cpu_ms_per_page': round(cpu / pages * 1000, 3) if pages else 0.0,
+        # ru_maxrss в Linux - в килобайтах
+        'peak_rss_mb': round(usage_after.ru_maxrss / 1024, 1),
+        'stages': summarize_timings(crawler.timings.to_dict())
+    }
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Сравнение с базовым запуском; возвращает список регрессий больше tolerance"""
+    regressions = []
+    print(f"{'метрика':<18}{'база':>12}{'сейчас':>12}{'изменение':>12}")
+    for metric, higher_is_better in COMPARED_METRICS.items():
+        old, new = baseline['results'].get(metric), results.get(metric)
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        print(f"{metric:<18}{old:>12}{new:>12}{change:>+12.1%}")
+        if (change < -tolerance) if higher_is_better else (change > tolerance):
+            regressions.append(f"{metric}: {old} -> {new} ({change:+.1%})")
+    return regressions
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк краулера на синтетическом локальном сайте")
+    parser.add_argument("--pages", type=int, default=200, help="Страниц на сайте")
+    parser.add_argument("--fanout", type=int, default=10, help="Ссылок на странице")
+    parser.add_argument("--page-size", type=int, default=20000, help="Размер страницы, байт")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Средняя задержка ответа, мс")
+    parser.add_argument("--latency-dist", choices=('fixed', 'uniform', 'exponential'), default='fixed')
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Доля страниц с ответом 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Доля страниц, отвечающих 429 один раз")
+    parser.add_argument("--trap-rate", type=float, default=0.0, help="Доля страниц со ссылкой в ловушку")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--max-pages", type=int, default=None, help="Лимит страниц задания (по умолчанию --pages)")
+    parser.add_argument("--max-depth", type=int, default=10)
+    parser.add_argument("--storage", choices=('memory', 'postgres'), default='memory',
+                        help="Хранилище: в памяти или PostgreSQL из конфигурации (задание удаляется после запуска)")
+    parser.add_argument("--log-level", default='WARNING', help="Уровень логирования во время обхода")
+    parser.add_argument("--output", help="Файл для результата в JSON")
+    parser.add_argument("--baseline", help="JSON прошлого запуска для сравнения")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Допустимое ухудшение метрик (доля)")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(args.log_level)
+
+    site_options = {
+        'pages': args.pages, 'fanout': args.fanout, 'page_size': args.page_size,
+        'latency_ms': args.latency_ms, 'latency_dist': args.latency_dist, 'error_rate': args.error_rate,
+        'rate_limit_rate': args.rate_limit_rate, 'trap_rate': args.trap_rate, 'seed': args.seed
+    }
+    port_queue = multiprocessing.Queue()
+    server = multiprocessing.Process(target=serve_site, args=(site_options, port_queue), daemon=True)
+    server.start()
+
+    try:
+        port = port_queue.get(timeout=30)
+        if args.storage == 'postgres':
+            from database import db_manager
+            storage = db_manager
+        else:
+            storage = MemoryStorage()
+
+        results = asyncio.run(run_crawl(f"http://127.0.0.1:{port}/page/0", storage,
+                                        args.max_pages or args.pages, args.max_depth))
+        job_id = results.pop('job_id')
+        if args.storage == 'postgres':
+            storage.delete_job(job_id, is_admin=True)
+    finally:
+        server.terminate()
+
+    report = {
+        'benchmark': 'crawl',
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': sys.version.split()[0],
+        'storage': args.storage,
+        'site': site_options,
+        'results': results
+    }
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            file.write(output + '\n')
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        if regressions:
+            print("Регрессия производительности:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,382 @@
+"""
+Нагрузочный прогон веб-части на базе, наполненной seed_database.py.
+
+Приложение Flask работает в этом же процессе: виртуальные пользователи в потоках через test_client
+воспроизводят смесь сессий - просмотр списка заданий и страниц задания, наблюдение за выполняющимся
+заданием через API прогресса, экспорт, работа администратора. По каждому маршруту считаются запросы,
+ошибки, пропускная способность, перцентили задержки, а также число SQL-запросов, соединений
+и время в БД на запрос (DatabaseManager.count_queries).
+
+Максимум SQL-запросов на запрос маршрута проверяется по бюджету ROUTE_QUERY_BUDGETS при каждом прогоне:
+превышение (например, запрос на каждую строку списка) завершает процесс с кодом 1. С --baseline результат
+также сравнивается с прошлым запуском: рост максимума SQL-запросов или ухудшение задержки и пропускной
+способности больше --tolerance - тоже регрессия.
+
+    python benchmarks/seed_database.py --jobs 10000 --links 10000000
+    python benchmarks/load_test.py --requests 500 --concurrency 1
+    python benchmarks/load_test.py --duration 60 --concurrency 8 --output load.json
+    python benchmarks/load_test.py --duration 60 --concurrency 8 --baseline load.json
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import re
+import statistics
+import sys
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from crawl_benchmark import git_commit, percentile
+from seed_database import USER_PREFIX
+
+# Смесь сессий по умолчанию: тип сессии -> вес
+DEFAULT_MIX = {'browse': 50, 'monitor': 30, 'export': 10, 'admin': 10}
+
+# Метрики маршрута, сравниваемые с базовым запуском: метрика -> допускается ли отклонение на tolerance
+COMPARED_ROUTE_METRICS = {
+    'latency_p95_ms': True,
+    'queries_max': False,
+}
+
+
+# Бюджет SQL-запросов на один запрос маршрута; число запросов не должно зависеть от объема данных
+ROUTE_QUERY_BUDGETS = {
+    'dashboard': 3,
+    'dashboard_admin': 3,
+    'job_details': 4,
+    'job_details_admin': 4,
+    'page_details': 2,
+    'progress': 2,
+    'jobs_progress': 1,
+    'export': 5,
+}
+
+
+class LoadFinished(Exception):
+    """Лимит запросов или времени прогона исчерпан"""
+
+
+CURSOR_PATTERN = re.compile(r'[?&]cursor=([\w-]+)')
+PAGES_CURSOR_PATTERN = re.compile(r'[?&]pages_cursor=([\w-]+)')
+
+
+class RouteStats:
+    """Замеры запросов одного маршрута"""
+
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.queries: List[int] = []
+        self.connections: List[int] = []
+        self.db_seconds: List[float] = []
+        self.errors = 0
+        self.statuses: Dict[int, int] = {}
+
+    def summary(self, wall: float) -> Dict:
+        count = len(self.latencies)
+        return {
+            'requests': count,
+            'errors': self.errors,
+            'statuses': {str(code): number for code, number in sorted(self.statuses.items())},
+            'requests_per_sec': round(count / wall, 2) if wall else 0.0,
+            'latency_p50_ms': round(percentile(self.latencies, 0.5) * 1000, 2),
+            'latency_p95_ms': round(percentile(self.latencies, 0.95) * 1000, 2),
+            'latency_p99_ms': round(percentile(self.latencies, 0.99) * 1000, 2),
+            'latency_max_ms': round(max(self.latencies, default=0) * 1000, 2),
+            'queries_mean': round(statistics.fmean(self.queries), 2) if self.queries else 0.0,
+            'queries_max': max(self.queries, default=0),
+            'connections_mean': round(statistics.fmean(self.connections), 2) if self.connections else 0.0,
+            'db_ms_mean': round(statistics.fmean(self.db_seconds) * 1000, 2) if self.db_seconds else 0.0
+        }
+
+
+class LoadDriver:
+    """Виртуальные пользователи, выполняющие сессии против приложения в текущем процессе"""
+
+    def __init__(self, app, db_manager, mix: Dict[str, int], concurrency: int, seed: int = 1, polls: int = 5):
+        self.app = app
+        self.db_manager = db_manager
+        self.mix = mix
+        self.concurrency = concurrency
+        self.seed = seed
+        self.polls = polls
+        self.routes: Dict[str, RouteStats] = {}
+        self.sessions: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._remaining: Optional[int] = None
+        self._deadline: Optional[float] = None
+        self._load_accounts()
+
+    def _load_accounts(self):
+        """Пользователи генератора и их задания (вне замеров)"""
+        pattern = USER_PREFIX.replace('_', '\\_') + '%'
+        users = self.db_manager.fetch_all("SELECT id, role FROM users WHERE username LIKE %s", (pattern,))
+        self.admins = [user['id'] for user in users if user['role'] == 'admin']
+        jobs = self.db_manager.fetch_all("""
+            SELECT cj.id, cj.user_id, cj.status, cj.pages_crawled
+            FROM crawl_jobs cj JOIN users u ON u.id = cj.user_id
+            WHERE u.username LIKE %s
+        """, (pattern,))
+        self.jobs_by_user: Dict[int, List[Dict]] = {}
+        for job in jobs:
+            self.jobs_by_user.setdefault(job['user_id'], []).append(job)
+        self.users = list(self.jobs_by_user)
+        self.all_jobs = jobs
+        if not self.users:
+            raise RuntimeError("В базе нет данных генератора: сначала запустите benchmarks/seed_database.py")
+
+    def first_page_id(self, job_id: int) -> Optional[int]:
+        return self.db_manager.fetch_val(
+            "SELECT id FROM crawled_pages WHERE job_id = %s ORDER BY crawled_at, id LIMIT 1", (job_id,))
+
+    def request(self, client, route: str, url: str) -> Optional[str]:
+        """Запрос к приложению с замером; возвращает тело ответа (None при ошибке)"""
+        with self.db_manager.count_queries(route) as queries:
+            started = time.perf_counter()
+            try:
+                response = client.get(url)
+                body = response.get_data(as_text=True)
+                response.close()
+                status = response.status_code
+            except Exception as e:
+                logging.getLogger(__name__).error(f"Ошибка запроса {url}: {e}")
+                body, status = None, 0
+            elapsed = time.perf_counter() - started
+
+        with self._lock:
+            stats = self.routes.setdefault(route, RouteStats())
+            stats.latencies.append(elapsed)
+            stats.queries.append(queries.queries)
+            stats.connections.append(queries.connections)
+            stats.db_seconds.append(queries.db_seconds)
+            stats.statuses[status] = stats.statuses.get(status, 0) + 1
+            if not 200 <= status < 400:
+                stats.errors += 1
+        return body if 200 <= status < 400 else None
+
+    def _take_request(self) -> bool:
+        """Можно ли выполнить еще один запрос (по лимиту запросов или времени)"""
+        if self._deadline is not None and time.perf_counter() >= self._deadline:
+            return False
+        if self._remaining is None:
+            return True
+        with self._lock:
+            if self._remaining <= 0:
+                return False
+            self._remaining -= 1
+            return True
+
+    def _login(self, client, user_id: int):
+        with client.session_transaction() as session:
+            session['user_id'] = user_id
+
+    def session_browse(self, client, rng: random.Random):
+        """Список заданий с фильтром и следующей страницей, затем детали задания и его страниц"""
+        user_id = rng.choice(self.users)
+        self._login(client, user_id)
+        body = self.step(client, 'dashboard', '/dashboard')
+        match = CURSOR_PATTERN.search(body or '')
+        if match:
+            self.step(client, 'dashboard', f"/dashboard?cursor={match.group(1)}")
+        self.step(client, 'dashboard', '/dashboard?status=completed&sort=created_at&order=desc')
+
+        job = rng.choice(self.jobs_by_user[user_id])
+        body = self.step(client, 'job_details', f"/job/{job['id']}")
+        match = PAGES_CURSOR_PATTERN.search(body or '')
+        if match:
+            self.step(client, 'job_details', f"/job/{job['id']}?pages_cursor={match.group(1)}")
+        page_id = self.first_page_id(job['id']) if job['pages_crawled'] else None
+        if page_id:
+            self.step(client, 'page_details', f"/api/job/{job['id']}/page/{page_id}")
+
+    def session_monitor(self, client, rng: random.Random):
+        """Открытие выполняющегося (или любого) задания и опрос его прогресса"""
+        user_id = rng.choice(self.users)
+        self._login(client, user_id)
+        jobs = self.jobs_by_user[user_id]
+        running = [job for job in jobs if job['status'] == 'running']
+        job = rng.choice(running or jobs)
+        self.step(client, 'job_details', f"/job/{job['id']}")
+        for _ in range(self.polls):
+            self.step(client, 'progress', f"/api/job/{job['id']}/progress")
+        self.step(client, 'jobs_progress', '/api/jobs/progress')
+
+    def session_export(self, client, rng: random.Random):
+        """Экспорт завершенного задания пользователя"""
+        user_id = rng.choice(self.users)
+        self._login(client, user_id)
+        completed = [job for job in self.jobs_by_user[user_id] if job['status'] == 'completed']
+        if not completed:
+            return
+        job = rng.choice(completed)
+        self.step(client, 'job_details', f"/job/{job['id']}")
+        self.step(client, 'export', f"/job/{job['id']}/export")
+
+    def session_admin(self, client, rng: random.Random):
+        """Администратор: список всех заданий и детали произвольного задания"""
+        if not self.admins:
+            return
+        self._login(client, rng.choice(self.admins))
+        self.step(client, 'dashboard_admin', '/dashboard')
+        job = rng.choice(self.all_jobs)
+        self.step(client, 'job_details_admin', f"/job/{job['id']}")
+
+    def step(self, client, route: str, url: str) -> Optional[str]:
+        """Шаг сессии; когда лимит прогона исчерпан, сессия прерывается"""
+        if not self._take_request():
+            raise LoadFinished()
+        return self.request(client, route, url)
+
+    def _run_user(self, index: int):
+        rng = random.Random(f"{self.seed}:{index}")
+        client = self.app.test_client()
+        names = list(self.mix)
+        weights = [self.mix[name] for name in names]
+        while True:
+            name = rng.choices(names, weights)[0]
+            try:
+                getattr(self, f"session_{name}")(client, rng)
+            except LoadFinished:
+                return
+            with self._lock:
+                self.sessions[name] = self.sessions.get(name, 0) + 1
+
+    def run(self, duration: float = None, requests: int = None) -> Dict:
+        self._remaining = requests
+        self._deadline = time.perf_counter() + duration if duration else None
+        started = time.perf_counter()
+        threads = [threading.Thread(target=self._run_user, args=(index,), name=f"LoadUser-{index}")
+                   for index in range(self.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - started
+
+        routes = {route: stats.summary(wall) for route, stats in sorted(self.routes.items())}
+        total = sum(route['requests'] for route in routes.values())
+        return {
+            'wall_s': round(wall, 2),
+            'requests': total,
+            'errors': sum(route['errors'] for route in routes.values()),
+            'requests_per_sec': round(total / wall, 2) if wall else 0.0,
+            'sessions': dict(sorted(self.sessions.items())),
+            'routes': routes
+        }
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """
+    Сравнение с базовым запуском. Число SQL-запросов детерминировано и сравнивается строго,
+    задержка и пропускная способность - с допуском tolerance.
+    """
+    regressions = []
+    old, new = baseline['results']['requests_per_sec'], results['requests_per_sec']
+    print(f"{'запросов/с':<34}{old:>12}{new:>12}")
+    if old and (new - old) / old < -tolerance:
+        regressions.append(f"requests_per_sec: {old} -> {new}")
+
+    for route, stats in results['routes'].items():
+        old_stats = baseline['results']['routes'].get(route)
+        if not old_stats:
+            continue
+        for metric, tolerant in COMPARED_ROUTE_METRICS.items():
+            old, new = old_stats[metric], stats[metric]
+            print(f"{route + ' ' + metric:<34}{old:>12}{new:>12}")
+            if tolerant and old and (new - old) / old > tolerance:
+                regressions.append(f"{route} {metric}: {old} -> {new} ({(new - old) / old:+.1%})")
+            elif not tolerant and new > old:
+                regressions.append(f"{route} {metric}: {old} -> {new}")
+    return regressions
+
+
+def check_query_budgets(results: Dict) -> List[str]:
+    """Маршруты, максимум SQL-запросов которых превысил бюджет ROUTE_QUERY_BUDGETS"""
+    exceeded = []
+    for route, stats in results['routes'].items():
+        budget = ROUTE_QUERY_BUDGETS.get(route)
+        if budget is not None and stats['queries_max'] > budget:
+            exceeded.append(f"{route} queries_max: {stats['queries_max']} > бюджета {budget}")
+    return exceeded
+
+
+def parse_mix(value: str) -> Dict[str, int]:
+    """Смесь сессий из строки вида browse=50,monitor=30"""
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        if name.strip() not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"Неизвестный тип сессии: {name}")
+        mix[name.strip()] = int(weight or 1)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон веб-части на сгенерированной базе")
+    parser.add_argument("--duration", type=float, default=30, help="Длительность прогона, с")
+    parser.add_argument("--requests", type=int, help="Число запросов вместо длительности")
+    parser.add_argument("--concurrency", type=int, default=8, help="Виртуальных пользователей (потоков)")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX,
+                        help="Веса сессий: browse=50,monitor=30,export=10,admin=10")
+    parser.add_argument("--polls", type=int, default=5, help="Опросов прогресса в сессии monitor")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="Файл для результата в JSON")
+    parser.add_argument("--baseline", help="JSON прошлого запуска для сравнения")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Допустимое ухудшение задержки (доля)")
+    args = parser.parse_args()
+
+    from app import app
+    from config import Config
+    from database import db_manager
+
+    # Воркер краулинга и очистка старых заданий в прогоне не участвуют
+    Config.CRAWL_EMBEDDED_WORKER = False
+    Config.JOB_RETENTION_DAYS = 0
+    logging.getLogger().setLevel(logging.WARNING)
+
+    driver = LoadDriver(app, db_manager, args.mix, args.concurrency, seed=args.seed, polls=args.polls)
+    results = driver.run(duration=None if args.requests else args.duration, requests=args.requests)
+
+    print(f"{'маршрут':<20}{'запросов':>9}{'ошибок':>8}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}"
+          f"{'SQL ср.':>9}{'SQL макс':>9}{'соед.':>7}{'БД, мс':>9}")
+    for route, stats in results['routes'].items():
+        print(f"{route:<20}{stats['requests']:>9}{stats['errors']:>8}{stats['latency_p50_ms']:>10}"
+              f"{stats['latency_p95_ms']:>10}{stats['latency_p99_ms']:>10}{stats['queries_mean']:>9}"
+              f"{stats['queries_max']:>9}{stats['connections_mean']:>7}{stats['db_ms_mean']:>9}")
+    print(f"Всего: {results['requests']} запросов за {results['wall_s']} с, {results['requests_per_sec']} запросов/с, "
+          f"ошибок {results['errors']}")
+
+    report = {
+        'benchmark': 'load',
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': sys.version.split()[0],
+        'concurrency': args.concurrency,
+        'mix': args.mix,
+        'dataset': db_manager.fetch_one("""
+            SELECT COUNT(*) AS jobs, COALESCE(SUM(pages_crawled), 0) AS pages, COALESCE(SUM(links_found), 0) AS links
+            FROM crawl_jobs
+        """),
+        'results': results
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+            file.write('\n')
+
+    regressions = check_query_budgets(results)
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as file:
+            regressions += compare(results, json.load(file), args.tolerance)
+    if regressions:
+        print("Регрессия производительности:\n  " + "\n  ".join(regressions))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
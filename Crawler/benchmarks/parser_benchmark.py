@@ -0,0 +1,212 @@
+"""
+Микробенчмарк разбора страниц на корпусе HTML из benchmarks/corpus.
+
+Для каждой страницы корпуса замеряются построение дерева BeautifulSoup и экстракторы
+parse_metadata, parse_headings, parse_content, extract_links - в том же порядке и на том же
+дереве, что и в WebCrawler.parse_page (parse_content удаляет скрипты и стили из дерева),
+а также parse_page целиком. Результат parse_page сверяется с эталоном из corpus/golden;
+расхождение завершает скрипт с кодом 1, поэтому оптимизации разбора проверяются на неизменность вывода.
+
+    python benchmarks/parser_benchmark.py
+    python benchmarks/parser_benchmark.py --update-golden   # после намеренного изменения вывода
+    python benchmarks/parser_benchmark.py --output parser.json --baseline parser_base.json
+"""
+import argparse
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+from datetime import datetime
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bs4 import BeautifulSoup
+
+from crawler import WebCrawler
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus')
+
+# Этапы разбора в порядке выполнения в parse_page
+STAGES = ('soup', 'parse_metadata', 'parse_headings', 'parse_content', 'extract_links')
+
+
+def load_corpus(corpus_dir: str, only: List[str] = None) -> List[Dict]:
+    with open(os.path.join(corpus_dir, 'manifest.json'), encoding='utf-8') as file:
+        manifest = json.load(file)
+    pages = []
+    for name, entry in manifest.items():
+        if only and name not in only:
+            continue
+        with open(os.path.join(corpus_dir, name), encoding='utf-8') as file:
+            html = file.read()
+        pages.append({'name': name, 'url': entry['url'], 'html': html, 'size': len(html.encode('utf-8'))})
+    return pages
+
+
+def time_stages(crawler: WebCrawler, html: str, url: str) -> Dict[str, float]:
+    """Один проход разбора по этапам, секунды"""
+    timings = {}
+    started = time.perf_counter()
+    soup = BeautifulSoup(html, 'lxml')
+    timings['soup'] = time.perf_counter() - started
+
+    for stage in STAGES[1:]:
+        started = time.perf_counter()
+        if stage == 'extract_links':
+            crawler.extract_links(soup, url)
+        else:
+            getattr(crawler, stage)(soup)
+        timings[stage] = time.perf_counter() - started
+    return timings
+
+
+def benchmark_page(page: Dict, iterations: int) -> Dict:
+    """Медианы по итерациям: этапы по отдельности и parse_page целиком"""
+    crawler = WebCrawler(job_name='parser-benchmark', start_url=page['url'])
+    stage_samples = {stage: [] for stage in STAGES}
+    totals = []
+
+    for _ in range(iterations):
+        for stage, seconds in time_stages(crawler, page['html'], page['url']).items():
+            stage_samples[stage].append(seconds)
+        started = time.perf_counter()
+        crawler.parse_page(page['html'], page['url'])
+        totals.append(time.perf_counter() - started)
+
+    total = statistics.median(totals)
+    return {
+        'size_kb': round(page['size'] / 1024, 1),
+        'stages_ms': {stage: round(statistics.median(samples) * 1000, 2) for stage, samples in stage_samples.items()},
+        'total_ms': round(total * 1000, 2),
+        'mb_per_sec': round(page['size'] / 1048576 / total, 2),
+        'pages_per_sec': round(1 / total, 1)
+    }
+
+
+def golden_path(corpus_dir: str, name: str) -> str:
+    return os.path.join(corpus_dir, 'golden', os.path.splitext(name)[0] + '.json')
+
+
+def parse_output(page: Dict) -> Dict:
+    """Вывод parse_page в виде, пригодном для JSON-эталона"""
+    crawler = WebCrawler(job_name='parser-benchmark', start_url=page['url'])
+    page_data, metadata, headings, content, links, link_texts = crawler.parse_page(page['html'], page['url'])
+    return {
+        'page_data': page_data,
+        'metadata': metadata,
+        'headings': headings,
+        'content': content,
+        'links': links,
+        'link_texts': link_texts
+    }
+
+
+def check_golden(corpus_dir: str, page: Dict, update: bool) -> List[str]:
+    """Сверка вывода с эталоном; возвращает список расхождающихся частей"""
+    output = json.loads(json.dumps(parse_output(page), ensure_ascii=False))
+    path = golden_path(corpus_dir, page['name'])
+    if update:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(output, file, ensure_ascii=False, indent=1, sort_keys=True)
+            file.write('\n')
+        return []
+
+    if not os.path.exists(path):
+        return ['нет эталона (запустите с --update-golden)']
+    with open(path, encoding='utf-8') as file:
+        golden = json.load(file)
+    return [part for part in output if output[part] != golden.get(part)]
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Сравнение общей скорости и времени страниц с базовым запуском"""
+    regressions = []
+    old, new = baseline['results']['total']['mb_per_sec'], results['total']['mb_per_sec']
+    print(f"Всего: {old} -> {new} МБ/с ({(new - old) / old:+.1%})")
+    if (new - old) / old < -tolerance:
+        regressions.append(f"total mb_per_sec: {old} -> {new}")
+    for name, page in results['pages'].items():
+        old_page = baseline['results']['pages'].get(name)
+        if not old_page:
+            continue
+        change = (page['total_ms'] - old_page['total_ms']) / old_page['total_ms']
+        print(f"  {name:<26}{old_page['total_ms']:>10} -> {page['total_ms']:>10} мс ({change:+.1%})")
+        if change > tolerance:
+            regressions.append(f"{name}: {old_page['total_ms']} -> {page['total_ms']} мс")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Микробенчмарк разбора страниц на корпусе HTML")
+    parser.add_argument("--corpus", default=CORPUS_DIR, help="Каталог корпуса с manifest.json и golden/")
+    parser.add_argument("--only", nargs='*', help="Только указанные файлы корпуса")
+    parser.add_argument("--iterations", type=int, default=5, help="Итераций на страницу (берется медиана)")
+    parser.add_argument("--update-golden", action='store_true', help="Перезаписать эталоны текущим выводом")
+    parser.add_argument("--output", help="Файл для результата в JSON")
+    parser.add_argument("--baseline", help="JSON прошлого запуска для сравнения")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Допустимое ухудшение (доля)")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    pages = load_corpus(args.corpus, args.only)
+
+    mismatches = {}
+    for page in pages:
+        differences = check_golden(args.corpus, page, args.update_golden)
+        if differences:
+            mismatches[page['name']] = differences
+
+    results = {'pages': {}}
+    print(f"{'страница':<26}{'КБ':>8}" + ''.join(f"{stage:>16}" for stage in STAGES) + f"{'всего, мс':>12}{'МБ/с':>8}")
+    for page in pages:
+        result = benchmark_page(page, args.iterations)
+        results['pages'][page['name']] = result
+        print(f"{page['name']:<26}{result['size_kb']:>8}" +
+              ''.join(f"{result['stages_ms'][stage]:>16}" for stage in STAGES) +
+              f"{result['total_ms']:>12}{result['mb_per_sec']:>8}")
+
+    total_ms = sum(page['total_ms'] for page in results['pages'].values())
+    total_mb = sum(page['size'] for page in pages) / 1048576
+    results['total'] = {
+        'pages': len(pages),
+        'total_ms': round(total_ms, 2),
+        'mb_per_sec': round(total_mb / (total_ms / 1000), 2) if total_ms else 0.0,
+        'pages_per_sec': round(len(pages) / (total_ms / 1000), 1) if total_ms else 0.0
+    }
+    print(f"Всего: {results['total']['mb_per_sec']} МБ/с, {results['total']['pages_per_sec']} стр/с")
+
+    report = {
+        'benchmark': 'parser',
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'python': sys.version.split()[0],
+        'iterations': args.iterations,
+        'results': results,
+        'golden_mismatches': mismatches
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+            file.write('\n')
+
+    failed = False
+    if mismatches:
+        print("Вывод отличается от эталона:")
+        for name, parts in mismatches.items():
+            print(f"  {name}: {', '.join(parts)}")
+        failed = True
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        if regressions:
+            print("Регрессия производительности:\n  " + "\n  ".join(regressions))
+            failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,429 @@
+"""
+Генератор большой синтетической базы для нагрузочного тестирования веб-части.
+
+Наполняет PostgreSQL из конфигурации (DATABASE_URL / DB_*) пользователями, заданиями, страницами
+и ссылками через COPY: по умолчанию 10 000 заданий и 10 млн ссылок. Набор детерминирован (--seed):
+число страниц заданий распределено с тяжелым хвостом (несколько огромных заданий и много маленьких),
+статусы - как в рабочей базе, у страниц меню и подвал ведут на одни и те же адреса, счетчики
+crawl_jobs согласованы со страницами и ссылками. Данные задания пишутся в его партиции, как у краулера.
+
+Пользователи генератора называются loadtest_* (пароль --password) и удаляются вместе с заданиями
+через --reset. Стартовые URL заданий находятся в зарезервированной зоне .example: воркеры краулинга
+к такой базе подключать не нужно.
+
+    python benchmarks/seed_database.py --jobs 10000 --links 10000000
+    python benchmarks/seed_database.py --jobs 1000 --links 500000 --seed 2
+    python benchmarks/seed_database.py --reset
+"""
+import argparse
+import itertools
+import json
+import logging
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bcrypt
+
+from database import db_manager
+
+# Префикс имен пользователей генератора: по нему load_test.py находит сессии, а --reset - данные
+USER_PREFIX = 'loadtest_'
+ADMIN_USERNAME = USER_PREFIX + 'admin'
+
+# Статусы заданий и их доли в наборе
+JOB_STATUSES = (
+    ('completed', 0.85),
+    ('failed', 0.04),
+    ('cancelled', 0.03),
+    ('paused', 0.03),
+    ('running', 0.03),
+    ('queued', 0.02),
+)
+
+# Лимиты страниц, из которых выбирается max_pages задания
+MAX_PAGES_CHOICES = (50, 100, 500, 1000, 5000, 10000, 50000)
+
+# Ссылок меню и подвала на каждой странице: ведут на первые страницы сайта
+MENU_LINKS = 10
+
+WORDS = ('crawler', 'page', 'network', 'latency', 'index', 'parser', 'queue', 'storage', 'thread', 'socket',
+         'document', 'header', 'content', 'request', 'response', 'archive', 'search', 'link', 'metric', 'table',
+         'страница', 'поиск', 'данные', 'сеть', 'задание', 'очередь', 'ссылка', 'текст', 'запрос', 'ответ')
+
+
+def copy_value(value) -> str:
+    """Значение в текстовом формате COPY"""
+    if value is None:
+        return '\\N'
+    if isinstance(value, datetime):
+        return value.isoformat(' ')
+    if isinstance(value, (dict, list)):
+        value = json.dumps(value, ensure_ascii=False)
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+def copy_row(*values) -> str:
+    return '\t'.join(map(copy_value, values)) + '\n'
+
+
+class CopyStream:
+    """Файлоподобный источник для cursor.copy_expert: строки COPY берутся из генератора по мере чтения"""
+
+    def __init__(self, lines: Iterable[str]):
+        self._lines = iter(lines)
+        self._chunks: List[str] = []
+        self._size = 0
+        self.rows = 0
+
+    def read(self, size: int = -1) -> str:
+        while size < 0 or self._size < size:
+            line = next(self._lines, None)
+            if line is None:
+                break
+            self._chunks.append(line)
+            self._size += len(line)
+            self.rows += 1
+        data = ''.join(self._chunks)
+        self._chunks, self._size = [], 0
+        return data
+
+    readline = read
+
+
+def copy_rows(cursor, table: str, columns: str, lines: Iterable[str]) -> int:
+    """COPY строк в таблицу (партиционированная таблица сама раскладывает их по партициям)"""
+    stream = CopyStream(lines)
+    cursor.copy_expert(f"COPY {table} ({columns}) FROM STDIN", stream, size=65536)
+    return stream.rows
+
+
+def reserve_ids(cursor, sequence: str, count: int) -> int:
+    """Резервирование непрерывного блока значений последовательности; возвращает первое"""
+    if count <= 0:
+        return 0
+    cursor.execute("SELECT setval(%s, nextval(%s) + %s - 1)", (sequence, sequence, count))
+    return cursor.fetchone()[0] - count + 1
+
+
+class DatasetPlan:
+    """
+    План набора: пользователи, задания и по каждой сохраненной странице (число ссылок, слов).
+    Содержимое страниц генерируется позже потоком, план нужен для согласованных счетчиков crawl_jobs.
+    """
+
+    def __init__(self, users: int, jobs: int, links: int, links_per_page: int, max_job_pages: int,
+                 days: int, seed: int):
+        self.rng = random.Random(seed)
+        self.seed = seed
+        self.now = datetime.now().replace(microsecond=0)
+        self.users = users
+        self.jobs: List[Dict] = []
+
+        statuses = [status for status, _ in JOB_STATUSES]
+        weights = [weight for _, weight in JOB_STATUSES]
+        # Активность пользователей тоже неравномерна
+        user_weights = list(itertools.accumulate(self.rng.paretovariate(1.5) for _ in range(users)))
+        for index in range(jobs):
+            status = self.rng.choices(statuses, weights)[0]
+            created_at = self.now - timedelta(seconds=self.rng.uniform(0, days * 86400))
+            self.jobs.append({
+                'index': index,
+                'user': self.rng.choices(range(users), cum_weights=user_weights)[0],
+                'status': status,
+                'created_at': created_at,
+                'max_depth': self.rng.choice((1, 2, 3, 3, 3, 5)),
+                'delay': self.rng.choice((0.5, 1.0, 1.0, 2.0)),
+                'pages': []
+            })
+
+        # Число страниц - доля от общего с весом Парето; у заданий в очереди страниц нет
+        total_pages = max(1, links // max(1, links_per_page))
+        crawled = [job for job in self.jobs if job['status'] != 'queued']
+        shares = [self.rng.paretovariate(1.2) for _ in crawled]
+        scale = total_pages / sum(shares) if shares else 0
+        counts = [min(max_job_pages, max(1, round(share * scale))) for share in shares]
+        # Срезанное ограничением max_job_pages распределяем по остальным заданиям
+        capped = sum(1 for count in counts if count >= max_job_pages)
+        uncapped = sum(count for count in counts if count < max_job_pages)
+        if uncapped:
+            factor = max(0, total_pages - capped * max_job_pages) / uncapped
+            counts = [count if count >= max_job_pages else max(1, min(max_job_pages, round(count * factor)))
+                      for count in counts]
+
+        for job, count in zip(crawled, counts):
+            job['pages'] = [(max(1, round(links_per_page * self.rng.uniform(0.5, 1.5))), self.rng.randint(50, 3000))
+                            for _ in range(count)]
+            # Страницы с ошибками краулер не сохраняет, они есть только в счетчике
+            job['failed'] = sum(1 for _ in range(count) if self.rng.random() < 0.02)
+            job['max_pages'] = next((limit for limit in MAX_PAGES_CHOICES
+                                     if limit >= count * (1 if job['status'] == 'completed' else 2)),
+                                    MAX_PAGES_CHOICES[-1])
+        for job in self.jobs:
+            job.setdefault('max_pages', self.rng.choice(MAX_PAGES_CHOICES[:5]))
+            job.setdefault('failed', 0)
+
+    @property
+    def total_pages(self) -> int:
+        return sum(len(job['pages']) for job in self.jobs)
+
+    @property
+    def total_links(self) -> int:
+        return sum(links for job in self.jobs for links, _ in job['pages'])
+
+
+class DatasetWriter:
+    """Запись плана в базу: пользователи и задания одной транзакцией, данные заданий - пачками"""
+
+    def __init__(self, plan: DatasetPlan, password: str, text_size: int, batch_jobs: int):
+        self.plan = plan
+        self.text_size = text_size
+        self.batch_jobs = batch_jobs
+        self.password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+        rng = random.Random(plan.seed)
+        # Пул абзацев: текст страниц собирается из него, а не генерируется по слову
+        self.paragraphs = [' '.join(rng.choice(WORDS) for _ in range(rng.randint(20, 120))) for _ in range(256)]
+        self.rows = {'users': 0, 'crawl_jobs': 0, 'crawled_pages': 0, 'links': 0, 'crawl_urls': 0,
+                     'link_texts': 0}
+
+    def write(self, conn):
+        cursor = conn.cursor()
+        conn.autocommit = False
+        try:
+            self._write_jobs(cursor)
+            conn.commit()
+            for start in range(0, len(self.plan.jobs), self.batch_jobs):
+                batch = [job for job in self.plan.jobs[start:start + self.batch_jobs] if job['pages']]
+                if batch:
+                    self._write_job_data(cursor, batch)
+                    conn.commit()
+                print(f"  задания {min(start + self.batch_jobs, len(self.plan.jobs))}/{len(self.plan.jobs)}, "
+                      f"ссылок {self.rows['links']}", flush=True)
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.autocommit = True
+
+    def _write_jobs(self, cursor):
+        plan = self.plan
+        cursor.execute("SELECT pg_get_serial_sequence('users', 'id'), pg_get_serial_sequence('crawl_jobs', 'id')")
+        users_sequence, jobs_sequence = cursor.fetchone()
+
+        first_user = reserve_ids(cursor, users_sequence, plan.users + 1)
+        self.user_ids = [first_user + i for i in range(plan.users)]
+        admin_id = first_user + plan.users
+        user_rows = [copy_row(user_id, f"{USER_PREFIX}user_{i}", self.password_hash, 'user',
+                              plan.now - timedelta(days=400 - i % 300))
+                     for i, user_id in enumerate(self.user_ids)]
+        user_rows.append(copy_row(admin_id, ADMIN_USERNAME, self.password_hash, 'admin', plan.now - timedelta(days=400)))
+        self.rows['users'] += copy_rows(cursor, 'users', 'id, username, password_hash, role, created_at', user_rows)
+
+        first_job = reserve_ids(cursor, jobs_sequence, len(plan.jobs))
+        for job in plan.jobs:
+            job['id'] = first_job + job['index']
+            job['user_id'] = self.user_ids[job['user']]
+            job['start_url'] = f"https://site{job['index']}.loadtest.example/"
+            job['started_at'] = job['created_at'] + timedelta(seconds=plan.rng.uniform(1, 120))
+            job['step'] = timedelta(seconds=job['delay'] * plan.rng.uniform(1.0, 1.5))
+
+        self.rows['crawl_jobs'] += copy_rows(cursor, 'crawl_jobs', """
+            id, user_id, job_name, start_url, max_pages, max_depth, delay, status, created_at, started_at,
+            finished_at, pages_crawled, pages_failed, links_found, total_words, bytes_downloaded, attempts,
+            worker_id, lease_expires_at
+        """, (self._job_row(job) for job in plan.jobs))
+
+        # Выполняющимся заданиям - снимок прогресса, как от воркера
+        for job in plan.jobs:
+            if job['status'] == 'running':
+                pages = len(job['pages'])
+                snapshot = {
+                    'active': True, 'job_id': job['id'], 'status': 'processing',
+                    'current_url': f"{job['start_url']}section-{pages % 7}/page-{pages}",
+                    'progress': min(95, int(pages / job['max_pages'] * 100)),
+                    'pages_processed': pages, 'total_pages': job['max_pages'],
+                    'message': f"Обработано {pages} из {job['max_pages']} страниц",
+                    'pages_per_sec': round(1 / job['delay'], 2), 'bytes_per_sec': 40000, 'eta_seconds': None,
+                    'updated_at': plan.now.strftime('%H:%M:%S')
+                }
+                cursor.execute("INSERT INTO job_progress (job_id, version, snapshot) VALUES (%s, %s, %s)",
+                               (job['id'], pages, json.dumps(snapshot, ensure_ascii=False)))
+
+    def _job_row(self, job: Dict) -> str:
+        pages = job['pages']
+        status = job['status']
+        finished = status in ('completed', 'failed', 'cancelled')
+        return copy_row(
+            job['id'], job['user_id'], f"site{job['index']} {job['created_at']:%Y-%m-%d}", job['start_url'],
+            job['max_pages'], job['max_depth'], job['delay'], status, job['created_at'],
+            job['started_at'] if status != 'queued' else None,
+            job['started_at'] + job['step'] * (len(pages) + 1) if finished else None,
+            len(pages),
+            job['failed'],
+            sum(links for links, _ in pages),
+            sum(words for _, words in pages),
+            sum(self._page_size(words) for _, words in pages),
+            1 if status != 'queued' else 0,
+            'loadtest' if status == 'running' else None,
+            self.plan.now + timedelta(days=1) if status == 'running' else None
+        )
+
+    @staticmethod
+    def _page_size(words: int) -> int:
+        return 8000 + words * 7
+
+    def _write_job_data(self, cursor, jobs: List[Dict]):
+        """Партиции и данные пачки заданий: словари, страницы, ссылки"""
+        cursor.execute("SELECT create_job_partitions(id) FROM unnest(%s::int[]) AS j(id)",
+                       ([job['id'] for job in jobs],))
+
+        for job in jobs:
+            pages = len(job['pages'])
+            # Адреса сайта: собранные страницы, найденные, но не собранные, и внешние
+            job['url_count'] = pages + pages // 2 + 5
+            job['text_count'] = 30 + min(pages, 200)
+            job['first_url'] = reserve_ids(cursor, 'crawl_urls_id_seq', job['url_count'])
+            job['first_text'] = reserve_ids(cursor, 'link_texts_id_seq', job['text_count'])
+            job['first_page'] = reserve_ids(cursor, 'crawled_pages_part_id_seq', pages)
+
+        self.rows['crawl_urls'] += copy_rows(cursor, 'crawl_urls', 'job_id, url_id, url',
+                                             (line for job in jobs for line in self._url_rows(job)))
+        self.rows['link_texts'] += copy_rows(cursor, 'link_texts', 'job_id, text_id, text',
+                                             (line for job in jobs for line in self._text_rows(job)))
+        self.rows['crawled_pages'] += copy_rows(cursor, 'crawled_pages', """
+            id, job_id, url_id, url, title, depth, crawled_at, status_code, metadata, content, links_count
+        """, (line for job in jobs for line in self._page_rows(job)))
+        self.rows['links'] += copy_rows(cursor, 'links', 'job_id, from_url_id, to_url_id, text_id, found_at',
+                                        (line for job in jobs for line in self._link_rows(job)))
+
+    @staticmethod
+    def _url(job: Dict, position: int) -> str:
+        pages = len(job['pages'])
+        if position == 0:
+            return job['start_url']
+        if position < pages + pages // 2:
+            return f"{job['start_url']}section-{position % 7}/page-{position}"
+        return f"https://external{position}.loadtest.example/ref/{job['index']}"
+
+    def _url_rows(self, job: Dict):
+        for position in range(job['url_count']):
+            yield copy_row(job['id'], job['first_url'] + position, self._url(job, position))
+
+    def _text_rows(self, job: Dict):
+        for position in range(job['text_count']):
+            yield copy_row(job['id'], job['first_text'] + position,
+                           f"{WORDS[position % len(WORDS)].capitalize()} {position}")
+
+    def _page_rows(self, job: Dict):
+        rng = random.Random(f"{self.plan.seed}:pages:{job['index']}")
+        for position, (links, words) in enumerate(job['pages']):
+            url = self._url(job, position)
+            title = f"Site {job['index']} page {position}"
+            text = ''
+            while len(text) < self.text_size:
+                text += rng.choice(self.paragraphs) + ' '
+            metadata = {
+                'description': f"Page {position} of synthetic site {job['index']}",
+                'keywords': ', '.join(WORDS[position % 10:position % 10 + 3]),
+                'author': '', 'robots': '', 'viewport': 'width=device-width', 'charset': 'utf-8',
+                'og_title': title, 'og_description': '', 'og_image': '', 'og_url': url,
+                'headings': {'h1': [title], 'h2': [f"Section {i}" for i in range(position % 5)],
+                             'h3': [], 'h4': [], 'h5': [], 'h6': []}
+            }
+            content = {
+                'content_text': text[:self.text_size], 'word_count': words, 'char_count': words * 6,
+                'paragraphs_count': words // 80, 'links_count': links,
+                'images_count': position % 6, 'forms_count': position % 2
+            }
+            yield copy_row(
+                job['first_page'] + position, job['id'], job['first_url'] + position, url, title,
+                0 if position == 0 else min(job['max_depth'], len(str(position))),
+                job['started_at'] + job['step'] * position, 200, metadata, content, links
+            )
+
+    def _link_rows(self, job: Dict):
+        rng = random.Random(f"{self.plan.seed}:links:{job['index']}")
+        job_id, first_url, first_text = job['id'], job['first_url'], job['first_text']
+        url_count, text_count = job['url_count'], job['text_count']
+        menu = min(MENU_LINKS, url_count)
+        for position, (links, _) in enumerate(job['pages']):
+            found_at = (job['started_at'] + job['step'] * position).isoformat(' ')
+            from_url = first_url + position
+            for link in range(links):
+                if link < menu:
+                    to_url, text = first_url + link, first_text + link
+                else:
+                    to_url, text = first_url + rng.randrange(url_count), first_text + rng.randrange(text_count)
+                yield f"{job_id}\t{from_url}\t{to_url}\t{text}\t{found_at}\n"
+
+
+def reset(conn) -> int:
+    """Удаление пользователей генератора вместе с заданиями и их партициями; возвращает число заданий"""
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT cj.id FROM crawl_jobs cj JOIN users u ON u.id = cj.user_id
+        WHERE u.username LIKE %s
+    """, (USER_PREFIX.replace('_', '\\_') + '%',))
+    job_ids = [row[0] for row in cursor.fetchall()]
+    # Партиции сбрасываются пачками: блокировка на каждую таблицу держится до конца транзакции
+    for start in range(0, len(job_ids), 100):
+        cursor.execute("SELECT drop_job_partitions(id) FROM unnest(%s::int[]) AS j(id)",
+                       (job_ids[start:start + 100],))
+    cursor.execute("DELETE FROM users WHERE username LIKE %s", (USER_PREFIX.replace('_', '\\_') + '%',))
+    return len(job_ids)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Генерация большой синтетической базы для нагрузочных тестов")
+    parser.add_argument("--users", type=int, default=200, help="Пользователей (плюс один администратор)")
+    parser.add_argument("--jobs", type=int, default=10000, help="Заданий")
+    parser.add_argument("--links", type=int, default=10000000, help="Ссылок всего (примерно)")
+    parser.add_argument("--links-per-page", type=int, default=25, help="Среднее число ссылок на странице")
+    parser.add_argument("--max-job-pages", type=int, default=20000, help="Максимум страниц одного задания")
+    parser.add_argument("--text-size", type=int, default=2000, help="Символов content_text на странице")
+    parser.add_argument("--days", type=int, default=90, help="За сколько дней распределены задания")
+    parser.add_argument("--batch-jobs", type=int, default=100, help="Заданий в одной транзакции COPY")
+    parser.add_argument("--password", default='loadtest', help="Пароль пользователей генератора")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--reset", action='store_true', help="Только удалить ранее сгенерированные данные")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    with db_manager.get_connection() as conn:
+        started = time.perf_counter()
+        removed = reset(conn)
+        if removed or args.reset:
+            print(f"Удалено заданий прошлой генерации: {removed} ({time.perf_counter() - started:.1f} с)")
+        if args.reset:
+            return
+
+        started = time.perf_counter()
+        plan = DatasetPlan(args.users, args.jobs, args.links, args.links_per_page, args.max_job_pages,
+                           args.days, args.seed)
+        print(f"План: {args.users} пользователей, {len(plan.jobs)} заданий, "
+              f"{plan.total_pages} страниц, {plan.total_links} ссылок")
+
+        writer = DatasetWriter(plan, args.password, args.text_size, args.batch_jobs)
+        writer.write(conn)
+        loaded = time.perf_counter() - started
+
+        cursor = conn.cursor()
+        for table in ('users', 'crawl_jobs', 'job_progress', 'crawled_pages', 'links', 'crawl_urls', 'link_texts'):
+            cursor.execute(f"ANALYZE {table}")
+
+    elapsed = time.perf_counter() - started
+    rows = sum(writer.rows.values())
+    print(f"Загружено строк: {rows} за {loaded:.1f} с ({rows / loaded:.0f} строк/с), с ANALYZE - {elapsed:.1f} с")
+    for table, count in writer.rows.items():
+        print(f"  {table:<16}{count:>12}")
+
+
+if __name__ == "__main__":
+    main()
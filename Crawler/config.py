@@ -17,3 +17,88 @@ class Config:
         'port': int(os.getenv('DB_PORT', '5432'))
     }
 
+    # Хранение результатов: задания, завершенные более N дней назад, удаляются в фоне (0 - хранить всегда)
+    JOB_RETENTION_DAYS = int(os.getenv('JOB_RETENTION_DAYS', '0'))
+    RETENTION_CHECK_INTERVAL = int(os.getenv('RETENTION_CHECK_INTERVAL', '3600'))
+
+    # Поток прогресса (SSE): минимальный интервал между событиями, период heartbeat и максимальная длительность
+    PROGRESS_STREAM_MIN_INTERVAL = float(os.getenv('PROGRESS_STREAM_MIN_INTERVAL', '0.5'))
+    PROGRESS_HEARTBEAT_INTERVAL = float(os.getenv('PROGRESS_HEARTBEAT_INTERVAL', '15'))
+    PROGRESS_STREAM_MAX_AGE = int(os.getenv('PROGRESS_STREAM_MAX_AGE', '300'))
+    # Предел одновременных потоков прогресса на процесс сервера: каждый занимает рабочий поток gunicorn,
+    # сверх предела клиент получает 503 и переходит на опрос
+    PROGRESS_STREAM_MAX_CLIENTS = int(os.getenv('PROGRESS_STREAM_MAX_CLIENTS', '4'))
+
+    # Хранилище прогресса: 'database' - общая таблица для всех воркеров, 'memory' - только текущий процесс
+    PROGRESS_BACKEND = os.getenv('PROGRESS_BACKEND', 'database')
+    PROGRESS_WRITE_INTERVAL = float(os.getenv('PROGRESS_WRITE_INTERVAL', '1'))
+    PROGRESS_POLL_INTERVAL = float(os.getenv('PROGRESS_POLL_INTERVAL', '1'))
+
+    # Время жизни записи пользователя в кеше процесса, сек. (0 - не кешировать)
+    USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', '30'))
+
+    # Исполнитель заданий воркера: число циклов событий, предел одновременных заданий, размер очереди
+    # ожидающих заданий в crawl_jobs, число одновременных загрузок страниц на цикл
+    # и вес заданий администраторов в round-robin
+    CRAWL_EXECUTOR_LOOPS = int(os.getenv('CRAWL_EXECUTOR_LOOPS', '1'))
+    CRAWL_MAX_CONCURRENT_JOBS = int(os.getenv('CRAWL_MAX_CONCURRENT_JOBS', '4'))
+    CRAWL_QUEUE_SIZE = int(os.getenv('CRAWL_QUEUE_SIZE', '100'))
+    CRAWL_FETCH_SLOTS = int(os.getenv('CRAWL_FETCH_SLOTS', '10'))
+    CRAWL_ADMIN_WEIGHT = int(os.getenv('CRAWL_ADMIN_WEIGHT', '2'))
+
+    # Общий HTTP-пул исполнителя: всего соединений, на один хост, TTL кеша DNS (сек.)
+    # и предел одновременных запросов одного задания
+    CRAWL_HTTP_LIMIT = int(os.getenv('CRAWL_HTTP_LIMIT', '100'))
+    CRAWL_HTTP_LIMIT_PER_HOST = int(os.getenv('CRAWL_HTTP_LIMIT_PER_HOST', '10'))
+    CRAWL_DNS_TTL = int(os.getenv('CRAWL_DNS_TTL', '300'))
+    CRAWL_JOB_CONNECTIONS = int(os.getenv('CRAWL_JOB_CONNECTIONS', '5'))
+
+    # Воркеры краулинга (worker.py): срок аренды задания и период ее продления, сек.,
+    # период опроса очереди и запуск воркера внутри веб-процесса (для разработки в одном процессе)
+    CRAWL_WORKER_LEASE = int(os.getenv('CRAWL_WORKER_LEASE', '60'))
+    CRAWL_WORKER_HEARTBEAT = float(os.getenv('CRAWL_WORKER_HEARTBEAT', '15'))
+    CRAWL_WORKER_POLL_INTERVAL = float(os.getenv('CRAWL_WORKER_POLL_INTERVAL', '2'))
+    CRAWL_EMBEDDED_WORKER = os.getenv('CRAWL_EMBEDDED_WORKER', '0').lower() in ('1', 'true', 'yes')
+
+    # Период сохранения контрольной точки обхода (очередь, посещенные URL, статистика), сек.
+    CRAWL_CHECKPOINT_INTERVAL = float(os.getenv('CRAWL_CHECKPOINT_INTERVAL', '30'))
+
+    # Метрики Prometheus: токен для /metrics (пустой - метрики доступны только с localhost), порт HTTP-сервера метрик воркера (0 - выключен)
+    # и адрес, на котором он слушает (по умолчанию только локальный)
+    METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+    CRAWL_WORKER_METRICS_PORT = int(os.getenv('CRAWL_WORKER_METRICS_PORT', '0'))
+    CRAWL_WORKER_METRICS_HOST = os.getenv('CRAWL_WORKER_METRICS_HOST', '127.0.0.1')
+
+    # Сторож цикла событий краулера: период замера задержки и порог, после которого
+    # цикл считается заблокированным и в лог пишется стек блокирующего вызова, сек.
+    CRAWL_LOOP_LAG_INTERVAL = float(os.getenv('CRAWL_LOOP_LAG_INTERVAL', '0.1'))
+    CRAWL_LOOP_STALL_THRESHOLD = float(os.getenv('CRAWL_LOOP_STALL_THRESHOLD', '0.5'))
+
+    # Профилирование задания по запросу администратора: период семплирования стека,
+    # длительность по умолчанию и максимальная длительность профиля, сек.
+    CRAWL_PROFILE_INTERVAL = float(os.getenv('CRAWL_PROFILE_INTERVAL', '0.005'))
+    CRAWL_PROFILE_DEFAULT_DURATION = int(os.getenv('CRAWL_PROFILE_DEFAULT_DURATION', '30'))
+    CRAWL_PROFILE_MAX_DURATION = int(os.getenv('CRAWL_PROFILE_MAX_DURATION', '120'))
+
+    # Бюджеты памяти, МБ (0 - без ограничения): оценка памяти задания, сверх которой новые ссылки
+    # не добавляются в очередь, и RSS процесса воркера, сверх которого он не берет новые задания
+    # и приостанавливает самое большое по памяти задание
+    CRAWL_JOB_MEMORY_MB = int(os.getenv('CRAWL_JOB_MEMORY_MB', '0'))
+    CRAWL_PROCESS_MEMORY_MB = int(os.getenv('CRAWL_PROCESS_MEMORY_MB', '0'))
+
+    # SQL-запросы дольше порога пишутся в лог медленных запросов в нормализованном виде, мс (0 - выключено);
+    # число запросов и время в БД на веб-запрос отдаются в заголовках X-DB-* в режиме отладки или с SQL_DEBUG_HEADERS
+    SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', '200'))
+    SQL_DEBUG_HEADERS = os.getenv('SQL_DEBUG_HEADERS', '0').lower() in ('1', 'true', 'yes')
+
+    # Общий для заданий кеш HTTP-ответов на диске: каталог (пустой - кеш выключен), предельный размер, МБ,
+    # срок свежести ответов без Cache-Control/Expires, сек., и принудительный срок вместо заголовков свежести
+    CRAWL_HTTP_CACHE_DIR = os.getenv('CRAWL_HTTP_CACHE_DIR', '')
+    CRAWL_HTTP_CACHE_MAX_MB = int(os.getenv('CRAWL_HTTP_CACHE_MAX_MB', '1024'))
+    CRAWL_HTTP_CACHE_TTL = float(os.getenv('CRAWL_HTTP_CACHE_TTL', '3600'))
+    CRAWL_HTTP_CACHE_FORCE_TTL = os.getenv('CRAWL_HTTP_CACHE_FORCE_TTL', '0').lower() in ('1', 'true', 'yes')
+
+    # Архив исходных ответов заданий (WARC): каталог (пустой - архивирование недоступно; при нескольких
+    # воркерах каталог должен быть общим) и число процессов разбора при повторном извлечении из архива
+    CRAWL_ARCHIVE_DIR = os.getenv('CRAWL_ARCHIVE_DIR', '')
+    CRAWL_REEXTRACT_PROCESSES = int(os.getenv('CRAWL_REEXTRACT_PROCESSES', str(min(4, os.cpu_count() or 1))))
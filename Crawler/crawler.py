@@ -1,5 +1,6 @@
 # Импорты для асинхронной работы и HTTP-запросов
 import asyncio
+import hashlib
 import traceback
 
 import aiohttp
@@ -15,8 +16,16 @@ from typing import Set, Dict, Optional, Tuple, List, Callable
 import re
 import sys
 import time
+from collections import deque
+from itertools import islice
+from contextlib import asynccontextmanager, contextmanager
 
 from config import Config
+from http_client import SharedHttpClient
+from loop_watchdog import LoopWatchdog
+from metrics import REGISTRY, StageTimings, process_rss_bytes
+from page_archive import ArchiveWriter
+from response_cache import ResponseCache, default_response_cache
 
 # Настройка для Windows
 if sys.platform == "win32":
@@ -33,6 +42,132 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Через сколько неудачных страниц сбрасывать накопленный счетчик ошибок в БД
+FAILED_COUNTER_FLUSH_EVERY = 10
+
+# Снимки прогресса отправляются не чаще раза в PROGRESS_EMIT_INTERVAL_MS или каждые PROGRESS_EMIT_EVERY_PAGES страниц;
+# скорость считается по окну последних PROGRESS_RATE_WINDOW секунд
+PROGRESS_EMIT_INTERVAL_MS = 500
+PROGRESS_EMIT_EVERY_PAGES = 10
+PROGRESS_RATE_WINDOW = 10.0
+
+
+def url_fingerprint(url: str) -> bytes:
+    """Отпечаток URL для множества посещенных: md5, как колонки fingerprint в БД"""
+    return hashlib.md5(url.encode('utf-8')).digest()
+
+
+# Размер одного отпечатка в множестве посещенных и число элементов очереди, по которым оценивается ее размер
+VISITED_ENTRY_SIZE = sys.getsizeof(url_fingerprint(''))
+MEMORY_SAMPLE_SIZE = 100
+
+
+def frontier_entry_size(entry: Tuple[str, int]) -> int:
+    """Элемент очереди: кортеж (url, глубина), строка URL и отметка времени в _enqueued_at"""
+    return sys.getsizeof(entry) + sys.getsizeof(entry[0]) + 24
+
+
+class ProgressReporter:
+    """
+    Прогресс краулинга с ограничением частоты отправки.
+    Вызовы report() только запоминают поля; снимок (с процентом, скоростью и ETA)
+    собирается и передается в emit лишь когда истек интервал или набралось достаточно страниц.
+    """
+
+    def __init__(self, emit: Callable, stats: Dict, max_pages: int,
+                 interval_ms: int = PROGRESS_EMIT_INTERVAL_MS,
+                 every_pages: int = PROGRESS_EMIT_EVERY_PAGES,
+                 window: float = PROGRESS_RATE_WINDOW):
+        self.emit = emit
+        self.stats = stats
+        self.max_pages = max_pages
+        self.interval = interval_ms / 1000
+        self.every_pages = every_pages
+        self.window = window
+
+        self.status = 'running'
+        self.current_url = None
+        self.message = None
+        self._dirty = False
+        self._last_emit = 0.0
+        self._pages_at_emit = 0
+        # Перцентили задержки цикла событий, в котором идет краулинг (LoopWatchdog.summary)
+        self.loop_lag: Optional[Callable] = None
+        # Оценка памяти задания и RSS процесса (WebCrawler.memory_report)
+        self.memory: Optional[Callable] = None
+        # Отсчеты (время, страниц обработано, байт загружено) для скорости в скользящем окне
+        self._samples = deque()
+
+    def report(self, status: str = None, current_url: str = None, message: str = None, force: bool = False):
+        """Обновление состояния; сообщение без явного текста формируется при отправке"""
+        if status is not None:
+            self.status = status
+        if current_url is not None:
+            self.current_url = current_url
+        self.message = message
+        self._dirty = True
+
+        now = time.monotonic()
+        if (force or now - self._last_emit >= self.interval or
+                self.stats['pages_processed'] - self._pages_at_emit >= self.every_pages):
+            self._emit(now)
+
+    def flush(self):
+        """Гарантированная отправка последнего состояния, если оно еще не отправлено"""
+        if self._dirty:
+            self._emit(time.monotonic())
+
+    def _emit(self, now: float):
+        self._last_emit = now
+        self._pages_at_emit = self.stats['pages_processed']
+        self._dirty = False
+        self.emit(**self.snapshot(now))
+
+    def snapshot(self, now: float = None) -> Dict:
+        """Текущее состояние прогресса вместе со скоростью и оценкой оставшегося времени"""
+        now = now if now is not None else time.monotonic()
+        pages = self.stats['pages_processed']
+        downloaded = self.stats['bytes_downloaded']
+
+        self._samples.append((now, pages, downloaded))
+        while len(self._samples) > 2 and now - self._samples[0][0] > self.window:
+            self._samples.popleft()
+        first_time, first_pages, first_bytes = self._samples[0]
+        elapsed = now - first_time
+        pages_per_sec = (pages - first_pages) / elapsed if elapsed > 0 else 0.0
+        bytes_per_sec = (downloaded - first_bytes) / elapsed if elapsed > 0 else 0.0
+        remaining = max(0, self.max_pages - pages)
+        eta = round(remaining / pages_per_sec) if pages_per_sec > 0 else None
+
+        if self.status == 'completed':
+            progress = 100
+        else:
+            progress = min(95, int(pages / self.max_pages * 100)) if self.max_pages else 0
+
+        message = self.message
+        if message is None:
+            if self.status == 'processing' and self.current_url:
+                message = f'Обработка: {self.current_url[:50]}...'
+            else:
+                message = f'Обработано {pages} из {self.max_pages} страниц'
+
+        snapshot = {
+            'status': self.status,
+            'current_url': self.current_url,
+            'progress': progress,
+            'pages_processed': pages,
+            'total_pages': self.max_pages,
+            'message': message,
+            'pages_per_sec': round(pages_per_sec, 2),
+            'bytes_per_sec': round(bytes_per_sec),
+            'eta_seconds': eta
+        }
+        if self.loop_lag is not None:
+            snapshot['loop_lag_ms'] = self.loop_lag()
+        if self.memory is not None:
+            snapshot['memory'] = self.memory()
+        return snapshot
+
 
 class WebCrawler:
     """
@@ -74,8 +209,9 @@ class WebCrawler:
         self.max_retries = max_retries
         self.user_agent = user_agent
 
-        # Инициализация базовых параметров
-        self.visited_urls: Set[str] = set()
+        # Инициализация базовых параметров: очередь обхода (url, глубина) и отпечатки уже поставленных в нее URL
+        self.frontier: deque = deque()
+        self.visited: Set[bytes] = set()
         self.ua = UserAgent()
         self.domain = urlparse(start_url).netloc
         self.robots_parser = RobotFileParser()
@@ -84,28 +220,198 @@ class WebCrawler:
         self.progress_callback: Optional[Callable] = None
         self.db_manager = None  # Будет установлен извне
 
+        # Общий планировщик загрузок исполнителя заданий (None - без ограничения)
+        self.fetch_scheduler = None
+        self.fetch_weight = 1
+        # Общая HTTP-сессия исполнителя (None - своя сессия на время краулинга)
+        self.http_client = None
+        self._own_http_client: Optional[SharedHttpClient] = None
+        # Сторож цикла событий исполнителя (None - свой на время краулинга)
+        self.loop_watchdog: Optional[LoopWatchdog] = None
+        self._own_loop_watchdog: Optional[LoopWatchdog] = None
+        # Общий кеш HTTP-ответов (по умолчанию - кеш процесса из конфигурации, None - выключен)
+        self.response_cache: Optional[ResponseCache] = default_response_cache()
+        # Запись исходных ответов в архив задания (page_archive) для повторного извлечения без сети
+        self.archive_pages = False
+        self.archive: Optional[ArchiveWriter] = None
+        # Запрошенная остановка: 'pause' или 'cancel' и ее причина; проверяется между страницами
+        self.stop_action: Optional[str] = None
+        self.stop_reason: Optional[str] = None
+        self._last_checkpoint = 0.0
+
+        # Длительности этапов обработки страниц (гистограммы задания и процесса)
+        self.timings = StageTimings(REGISTRY)
+        self._enqueued_at: Dict[str, float] = {}
+
+        # Учет памяти: байты загруженных и еще не обработанных страниц, бюджет задания;
+        # при превышении бюджета новые ссылки не добавляются в очередь (shedding)
+        self._inflight_bytes = 0
+        self.memory_budget = Config.CRAWL_JOB_MEMORY_MB * 1048576
+        self.memory_shedding = False
+
         # Статистика
         self.stats = {
             'pages_processed': 0,
             'pages_successful': 0,
             'pages_failed': 0,
             'links_found': 0,
+            'bytes_downloaded': 0,
+            'cache_hits': 0,
+            'cache_misses': 0,
+            'bytes_from_cache': 0,
             'start_time': None,
             'end_time': None
         }
 
-        # Загрузка и парсинг robots.txt
-        self._init_robots_parser()
+        # Приращения счетчиков задания (pages_failed, счетчики кеша), еще не записанные в БД
+        self._unflushed_counters: Dict[str, int] = {}
+
+        # Прогресс отправляется в progress_callback с ограничением частоты
+        self.progress = ProgressReporter(self.update_progress, self.stats, self.max_pages)
+        self.progress.memory = self.memory_report
 
     def set_db_manager(self, db_manager):
         """Установка менеджера базы данных"""
         self.db_manager = db_manager
 
-    def _init_robots_parser(self):
-        """Инициализация парсера robots.txt"""
+    def request_stop(self, action: str, reason: str = None):
+        """Запрос остановки ('pause' или 'cancel'); краулер остановится после текущей страницы"""
+        if self.stop_action is None:
+            self.stop_action = action
+            self.stop_reason = reason
+            logger.info(f"Задание {self.job_id}: запрошена остановка ({action})")
+
+    def mark_visited(self, url: str) -> bool:
+        """Отметка URL как посещенного; False, если он уже был"""
+        fingerprint = url_fingerprint(url)
+        if fingerprint in self.visited:
+            return False
+        self.visited.add(fingerprint)
+        return True
+
+    @contextmanager
+    def timed(self, stage: str):
+        """Замер длительности этапа в гистограмму задания"""
+        start = time.perf_counter()
         try:
-            self.robots_parser.set_url(urljoin(self.start_url, "/robots.txt"))
-            self.robots_parser.read()
+            yield
+        finally:
+            self.timings.observe(stage, time.perf_counter() - start)
+
+    def enqueue(self, url: str, depth: int):
+        """Постановка URL в очередь обхода с отметкой времени для замера ожидания"""
+        self.frontier.append((url, depth))
+        self._enqueued_at[url] = time.perf_counter()
+
+    def dequeue(self) -> Tuple[str, int]:
+        url, depth = self.frontier.popleft()
+        enqueued_at = self._enqueued_at.pop(url, None)
+        if enqueued_at is not None:
+            self.timings.observe('queue_wait', time.perf_counter() - enqueued_at)
+        return url, depth
+
+    def memory_usage(self) -> Dict[str, int]:
+        """
+        Оценка памяти основных структур задания в байтах: множество посещенных, очередь обхода
+        (по выборке из MEMORY_SAMPLE_SIZE элементов) и загруженные, но еще не обработанные страницы
+        """
+        visited = sys.getsizeof(self.visited) + len(self.visited) * VISITED_ENTRY_SIZE
+        frontier = sys.getsizeof(self.frontier) + sys.getsizeof(self._enqueued_at)
+        if self.frontier:
+            sample = list(islice(self.frontier, MEMORY_SAMPLE_SIZE))
+            frontier += sum(map(frontier_entry_size, sample)) * len(self.frontier) // len(sample)
+        return {
+            'visited': visited,
+            'frontier': frontier,
+            'inflight': self._inflight_bytes,
+            'total': visited + frontier + self._inflight_bytes
+        }
+
+    def memory_report(self) -> Dict:
+        """Память задания и RSS процесса в МБ для снимка прогресса"""
+        to_mb = lambda value: round(value / 1048576, 1)
+        report = {key: to_mb(value) for key, value in self.memory_usage().items()}
+        report['rss'] = to_mb(process_rss_bytes())
+        report['shedding'] = self.memory_shedding
+        return report
+
+    def check_memory_budget(self):
+        """Включение и выключение (с запасом 20%) отказа от новых ссылок по бюджету памяти задания"""
+        if not self.memory_budget:
+            return
+        total = self.memory_usage()['total']
+        if not self.memory_shedding and total > self.memory_budget:
+            self.memory_shedding = True
+            logger.warning(f"Задание {self.job_id} превысило бюджет памяти "
+                           f"({total // 1048576} МБ > {Config.CRAWL_JOB_MEMORY_MB} МБ), новые ссылки не добавляются")
+        elif self.memory_shedding and total < self.memory_budget * 0.8:
+            self.memory_shedding = False
+            logger.info(f"Память задания {self.job_id} снова в пределах бюджета")
+
+    async def save_timings(self):
+        """Сохранение гистограмм этапов задания в crawl_jobs.timings"""
+        if self.job_id and self.db_manager:
+            await asyncio.to_thread(self.db_manager.save_job_timings, self.job_id, self.timings.to_dict())
+
+    async def save_checkpoint(self):
+        """
+        Контрольная точка: очередь обхода, отпечатки посещенных URL и статистика.
+        Запись идет в отдельном потоке; обход задания на это время остановлен, поэтому
+        visited не меняется, пока сериализуется.
+        """
+        if not (self.job_id and self.db_manager):
+            return
+        self._last_checkpoint = time.monotonic()
+        await self.flush_counters()
+        stats = {key: value for key, value in self.stats.items() if key not in ('start_time', 'end_time')}
+        await asyncio.to_thread(self.db_manager.save_job_checkpoint, self.job_id, list(self.frontier),
+                                self.visited, stats)
+        await self.save_timings()
+        logger.debug(f"Контрольная точка задания {self.job_id}: в очереди {len(self.frontier)} URL")
+
+    async def delete_checkpoint(self):
+        """Удаление контрольной точки завершенного или отмененного задания"""
+        if self.db_manager:
+            await asyncio.to_thread(self.db_manager.delete_job_checkpoint, self.job_id)
+
+    async def restore_checkpoint(self) -> bool:
+        """Восстановление обхода из контрольной точки задания; False, если ее нет"""
+        if not self.db_manager:
+            return False
+        checkpoint = await asyncio.to_thread(self.db_manager.get_job_checkpoint, self.job_id)
+        if not checkpoint:
+            return False
+        self.frontier = deque(tuple(item) for item in checkpoint['frontier'])
+        self.visited = checkpoint['visited']
+        self.stats.update(checkpoint['stats'])
+        self.timings.load(await asyncio.to_thread(self.db_manager.get_job_timings, self.job_id))
+        logger.info(f"Задание {self.job_id} продолжается с контрольной точки: "
+                    f"обработано {self.stats['pages_processed']}, в очереди {len(self.frontier)} URL")
+        return True
+
+    async def load_robots(self):
+        """
+        Загрузка robots.txt через HTTP-сессию задания, в его цикле событий и с таймаутом:
+        конструктор краулера вызывается в управляющем потоке воркера и не должен ждать сеть.
+        Коды ответа обрабатываются как в RobotFileParser.read: 401/403 - обход запрещен,
+        прочие 4xx - разрешен; если robots.txt прочитать не удалось, URL не обходятся.
+        """
+        url = urljoin(self.start_url, "/robots.txt")
+        self.robots_parser.set_url(url)
+        try:
+            timeout = aiohttp.ClientTimeout(total=30, connect=10)
+            async with self.session.get(url, headers=self.get_headers(), timeout=timeout,
+                                        allow_redirects=True) as response:
+                if response.status in (401, 403):
+                    self.robots_parser.disallow_all = True
+                elif 400 <= response.status < 500:
+                    self.robots_parser.allow_all = True
+                elif response.status >= 500:
+                    logger.warning(f"Не удалось прочитать robots.txt для {self.domain}: HTTP {response.status}")
+                    return
+                else:
+                    body = await response.read()
+                    self.robots_parser.parse(body.decode('utf-8', errors='replace').splitlines())
             logger.info(f"Robots.txt загружен для {self.domain}")
         except Exception as e:
             logger.warning(f"Не удалось прочитать robots.txt для {self.domain}: {str(e)}")
@@ -115,10 +421,20 @@ class WebCrawler:
         logger.info("База данных уже инициализирована")
 
     async def close(self):
-        """Закрытие всех соединений"""
+        """Закрытие всех соединений (общая сессия исполнителя остается открытой)"""
         if self.session:
             await self.session.close()
+            self.session = None
+        if self._own_http_client is not None:
+            await self._own_http_client.close()
             logger.info("HTTP сессия закрыта")
+            self.http_client = self._own_http_client = None
+        if self._own_loop_watchdog is not None:
+            self._own_loop_watchdog.stop()
+            self.loop_watchdog = self._own_loop_watchdog = None
+        if self.archive is not None:
+            await asyncio.to_thread(self.archive.close)
+            self.archive = None
 
     def get_headers(self) -> Dict:
         """Генерация HTTP-заголовков для запроса"""
@@ -139,55 +455,138 @@ class WebCrawler:
             logger.error(f"Ошибка проверки robots.txt для {url}: {str(e)}")
             return True  # Разрешаем в случае ошибки
 
-    async def fetch_page(self, url: str) -> Tuple[Optional[str], int]:
+    async def fetch_page(self, url: str, depth: int = 0) -> Tuple[Optional[str], int, int]:
         """
         Получение содержимого страницы с поддержкой повторных попыток
-        и обработкой ошибок
+        и обработкой ошибок.
+        Свежий ответ из общего кеша возвращается без запроса, устаревший с валидаторами
+        перепроверяется условным запросом. Полученное тело записывается в архив задания, если он ведется
+        (depth - глубина страницы для записи в архиве).
+        Возвращает HTML, код ответа и размер тела, загруженного по сети, в байтах (0 - ответ из кеша).
         """
+        cached = None
+        if self.response_cache is not None:
+            cached = await asyncio.to_thread(self.response_cache.lookup, url)
+            if cached is not None and cached['fresh']:
+                return await self.from_cache(url, depth, cached, 'hit')
+
         for attempt in range(self.max_retries):
             try:
                 timeout = aiohttp.ClientTimeout(total=30, connect=10)
-                async with self.session.get(
-                        url,
-                        headers=self.get_headers(),
-                        timeout=timeout,
-                        allow_redirects=True
-                ) as response:
-                    if response.status == 200:
-                        content = await response.text()
-                        logger.debug(f"Успешно получена страница {url} (размер: {len(content)} символов)")
-                        return content, response.status
-                    elif response.status == 429:  # Too Many Requests
-                        delay = min(60, 2 ** (attempt + 1))  # Максимум 60 секунд
-                        logger.warning(f"Превышен лимит запросов для {url}. Повтор через {delay} сек...")
-                        await asyncio.sleep(delay)
-                    elif response.status in [301, 302, 303, 307, 308]:
-                        # Редиректы уже обрабатываются автоматически с allow_redirects=True
-                        logger.warning(f"Редирект {response.status} для {url}")
-                        return None, response.status
-                    else:
-                        logger.warning(f"HTTP {response.status} для {url}")
-                        return None, response.status
+                headers = self.get_headers()
+                if cached is not None:
+                    headers.update(self.response_cache.validators(cached))
+                async with self.fetch_slot():
+                    async with self.session.get(
+                            url,
+                            headers=headers,
+                            timeout=timeout,
+                            allow_redirects=True
+                    ) as response:
+                        if response.status == 200:
+                            with self.timed('body'):
+                                body = await response.read()
+                            content = await response.text()
+                            encoding = self.response_encoding(response)
+                            self.stats['bytes_downloaded'] += len(body)
+                            logger.debug(f"Успешно получена страница {url} (размер: {len(body)} байт)")
+                            if self.response_cache is not None:
+                                await self.store_in_cache(url, response, body, encoding)
+                            await self.archive_response(url, depth, response.status, response.headers, body, encoding)
+                            return content, response.status, len(body)
+                        elif response.status == 304 and cached is not None:
+                            await asyncio.to_thread(self.response_cache.refresh, url, response.headers)
+                            return await self.from_cache(url, depth, cached, 'revalidated')
+                        elif response.status in [301, 302, 303, 307, 308]:
+                            # Редиректы уже обрабатываются автоматически с allow_redirects=True
+                            logger.warning(f"Редирект {response.status} для {url}")
+                            return None, response.status, 0
+                        elif response.status != 429:
+                            logger.warning(f"HTTP {response.status} для {url}")
+                            return None, response.status, 0
+
+                # Too Many Requests: ждем, не занимая слот загрузки
+                delay = min(60, 2 ** (attempt + 1))  # Максимум 60 секунд
+                logger.warning(f"Превышен лимит запросов для {url}. Повтор через {delay} сек...")
+                await asyncio.sleep(delay)
 
             except asyncio.TimeoutError:
                 logger.warning(f"Таймаут при запросе {url} (попытка {attempt + 1})")
                 if attempt == self.max_retries - 1:
-                    return None, 0
+                    return None, 0, 0
                 await asyncio.sleep(2 ** attempt)
 
             except aiohttp.ClientError as e:
                 logger.warning(f"Ошибка клиента при запросе {url}: {str(e)} (попытка {attempt + 1})")
                 if attempt == self.max_retries - 1:
-                    return None, 0
+                    return None, 0, 0
                 await asyncio.sleep(2 ** attempt)
 
             except Exception as e:
                 logger.error(f"Неожиданная ошибка при запросе {url}: {str(e)} (попытка {attempt + 1})")
                 if attempt == self.max_retries - 1:
-                    return None, 0
+                    return None, 0, 0
                 await asyncio.sleep(2 ** attempt)
 
-        return None, 0
+        return None, 0, 0
+
+    async def from_cache(self, url: str, depth: int, cached: Dict, outcome: str) -> Tuple[str, int, int]:
+        """Ответ из кеша ('hit' - свежий, 'revalidated' - подтвержден ответом 304)"""
+        self.response_cache.record(outcome)
+        self.count('cache_hits')
+        self.count('bytes_from_cache', cached['body_size'])
+        logger.debug(f"Страница {url} получена из кеша ({outcome}, {cached['body_size']} байт)")
+        # Заголовки ответа в кеше не хранятся: в архив попадает только тип содержимого
+        content_type = f"text/html; charset={cached['encoding']}" if cached['encoding'] else 'text/html'
+        await self.archive_response(url, depth, cached['status'], {'Content-Type': content_type},
+                                    cached['body'], cached['encoding'])
+        return cached['body'].decode(cached['encoding'] or 'utf-8', errors='replace'), cached['status'], 0
+
+    @staticmethod
+    def response_encoding(response: aiohttp.ClientResponse) -> Optional[str]:
+        """Кодировка тела ответа, которой его декодировал aiohttp"""
+        try:
+            return response.get_encoding()
+        except Exception:
+            return None
+
+    async def store_in_cache(self, url: str, response: aiohttp.ClientResponse, body: bytes, encoding: Optional[str]):
+        """Сохранение загруженного ответа в общий кеш"""
+        self.response_cache.record('miss')
+        self.count('cache_misses')
+        await asyncio.to_thread(self.response_cache.store, url, response.status, response.headers, body, encoding)
+
+    async def open_archive(self, resumed: bool):
+        """Открытие архива задания: продолжение после контрольной точки дописывает его, новый обход начинает заново"""
+        if not self.archive_pages or not self.job_id:
+            return
+        if not Config.CRAWL_ARCHIVE_DIR:
+            logger.warning(f"Задание {self.job_id}: архив ответов не ведется, CRAWL_ARCHIVE_DIR не задан")
+            return
+        try:
+            self.archive = await asyncio.to_thread(ArchiveWriter, self.job_id, resumed)
+        except OSError as e:
+            logger.error(f"Задание {self.job_id}: не удалось открыть архив ответов: {e}")
+
+    async def archive_response(self, url: str, depth: int, status: int, headers, body: bytes,
+                               encoding: Optional[str]):
+        """Запись тела ответа в архив задания; ошибка записи не прерывает обработку страницы"""
+        if self.archive is None:
+            return
+        try:
+            with self.timed('archive'):
+                await asyncio.to_thread(self.archive.write, url, status, headers, body, depth, encoding)
+        except Exception as e:
+            logger.error(f"Ошибка записи {url} в архив задания: {str(e)}")
+
+    @asynccontextmanager
+    async def fetch_slot(self):
+        """Слот загрузки у общего планировщика исполнителя; вне исполнителя ограничения нет"""
+        if self.fetch_scheduler is None:
+            yield
+            return
+        async with self.fetch_scheduler.slot(self.user_id, self.fetch_weight):
+            yield
 
     async def create_job(self) -> int:
         """Создание нового задания на краулинг в БД"""
@@ -199,7 +598,8 @@ class WebCrawler:
             if not self.db_manager:
                 raise Exception("DatabaseManager не установлен")
 
-            job_id = self.db_manager.create_job(
+            job_id = await asyncio.to_thread(
+                self.db_manager.create_job,
                 self.user_id,
                 self.job_name,
                 self.start_url,
@@ -217,14 +617,14 @@ class WebCrawler:
         """Обновление статуса задания"""
         try:
             if self.job_id and self.db_manager:
-                self.db_manager.update_job_status(self.job_id, status)
+                await asyncio.to_thread(self.db_manager.update_job_status, self.job_id, status)
                 logger.info(f"Обновлен статус задания {self.job_id} на {status}")
         except Exception as e:
             logger.error(f"Ошибка обновления статуса задания: {str(e)}")
 
     async def save_page(self, url: str, title: str, depth: int, status_code: int,
-                        metadata: dict, content: dict, headings: dict) -> int:
-        """Сохранение данных страницы в БД"""
+                        metadata: dict, content: dict, headings: dict, bytes_downloaded: int = 0) -> Optional[int]:
+        """Сохранение данных страницы в БД (None - страница уже была сохранена)"""
         # Объединяем мета-теги и заголовки в один JSON для метаданных
         metadata_json = {
             **metadata,
@@ -235,14 +635,16 @@ class WebCrawler:
             if not self.db_manager:
                 raise Exception("DatabaseManager не установлен")
 
-            page_id = self.db_manager.save_page(
+            page_id = await asyncio.to_thread(
+                self.db_manager.save_page,
                 self.job_id,
                 url,
                 title,
                 depth,
                 status_code,
                 metadata_json,
-                content
+                content,
+                bytes_downloaded
             )
             logger.debug(f"Сохранена страница с ID: {page_id}")
             return page_id
@@ -259,12 +661,37 @@ class WebCrawler:
             if not self.db_manager:
                 raise Exception("DatabaseManager не установлен")
 
-            self.db_manager.save_links(self.job_id, page_id, links, link_texts)
+            await asyncio.to_thread(self.db_manager.save_links, self.job_id, page_id, links, link_texts)
             logger.debug(f"Сохранено {len(links)} ссылок для страницы {page_id}")
             self.stats['links_found'] += len(links)
         except Exception as e:
             logger.error(f"Ошибка сохранения ссылок: {str(e)}")
 
+    def count(self, name: str, value: int = 1):
+        """Увеличение счетчика статистики и задания; в БД он попадет при следующем flush_counters()"""
+        self.stats[name] += value
+        self._unflushed_counters[name] = self._unflushed_counters.get(name, 0) + value
+
+    async def record_failure(self):
+        """Учет неудачной страницы; счетчик задания в БД обновляется пачками"""
+        self.count('pages_failed')
+        if self._unflushed_counters.get('pages_failed', 0) >= FAILED_COUNTER_FLUSH_EVERY:
+            await self.flush_counters()
+
+    async def flush_counters(self):
+        """Запись накопленных счетчиков задания в БД"""
+        if not self._unflushed_counters or not (self.job_id and self.db_manager):
+            return
+
+        # Приращения, набранные во время записи, попадут в следующий flush
+        counters, self._unflushed_counters = self._unflushed_counters, {}
+        try:
+            await asyncio.to_thread(self.db_manager.increment_job_counters, self.job_id, **counters)
+        except Exception as e:
+            logger.error(f"Ошибка записи счетчиков задания: {str(e)}")
+            for name, value in counters.items():
+                self._unflushed_counters[name] = self._unflushed_counters.get(name, 0) + value
+
     def parse_metadata(self, soup: BeautifulSoup) -> Dict:
         """Извлечение мета-данных страницы"""
         meta = {
@@ -487,53 +914,60 @@ class WebCrawler:
             except Exception as e:
                 logger.error(f"Ошибка в callback прогресса: {e}")
 
-    async def process_url(self, url: str, depth: int, queue: asyncio.Queue):
+    async def process_url(self, url: str, depth: int, queue: deque):
         """Обработка одной URL с учетом глубины и очереди"""
+        inflight = 0
         try:
             # Обновляем прогресс - начинаем обработку URL
-            self.update_progress(
-                status='processing',
-                current_url=url,
-                pages_processed=self.stats['pages_processed'],
-                progress=min(90, int((self.stats['pages_processed'] / self.max_pages) * 100)),
-                message=f'Обработка: {url[:50]}...'
-            )
+            self.progress.report(status='processing', current_url=url)
 
             if not self.allowed_by_robots(url):
                 logger.info(f"Пропуск {url} - запрещено robots.txt")
                 return
 
             # Получаем содержимое страницы и статус ответа
-            html, status_code = await self.fetch_page(url)
+            html, status_code, body_size = await self.fetch_page(url, depth)
 
             if not html:
                 logger.warning(f"Не удалось получить содержимое страницы: {url}")
-                self.stats['pages_failed'] += 1
+                await self.record_failure()
                 return
 
+            # Тело ответа и декодированный текст живут до конца обработки страницы
+            inflight = body_size + sys.getsizeof(html)
+            self._inflight_bytes += inflight
+            self.check_memory_budget()
+
             # Парсим страницу
-            parsed_data = self.parse_page(html, url)
+            with self.timed('parse'):
+                parsed_data = self.parse_page(html, url)
             if not parsed_data:
                 logger.warning(f"Не удалось парсить страницу: {url}")
-                self.stats['pages_failed'] += 1
+                await self.record_failure()
                 return
 
             page_data, metadata, headings, content, links, link_texts = parsed_data
 
             # Сохраняем данные страницы в БД
-            page_id = await self.save_page(
-                page_data['url'],
-                page_data['title'],
-                depth,
-                status_code,
-                metadata,
-                content,
-                headings
-            )
+            with self.timed('save_page'):
+                page_id = await self.save_page(
+                    page_data['url'],
+                    page_data['title'],
+                    depth,
+                    status_code,
+                    metadata,
+                    content,
+                    headings,
+                    body_size
+                )
+            if page_id is None:
+                # Страница с таким URL уже сохранена в этом задании
+                return
 
             # Сохраняем найденные ссылки
             if links:
-                await self.save_links(page_id, links, link_texts)
+                with self.timed('save_links'):
+                    await self.save_links(page_id, links, link_texts)
 
             # Обновляем статистику
             self.stats['pages_processed'] += 1
@@ -543,20 +977,14 @@ class WebCrawler:
                 f"Обработано: {url} (Глубина {depth}, Ссылок: {len(links)}, Слов: {content.get('word_count', 0)})")
 
             # Обновляем прогресс после обработки
-            self.update_progress(
-                pages_processed=self.stats['pages_processed'],
-                progress=min(95, int((self.stats['pages_processed'] / self.max_pages) * 100)),
-                message=f'Обработано {self.stats["pages_processed"]} из {self.max_pages} страниц'
-            )
+            self.progress.report()
 
-            # Добавление новых ссылок в очередь
-            if depth < self.max_depth and len(self.visited_urls) < self.max_pages:
+            # Добавление новых ссылок в очередь (кроме режима экономии памяти)
+            if depth < self.max_depth and len(self.visited) < self.max_pages and not self.memory_shedding:
                 new_links_added = 0
                 for link in links:
-                    if (link not in self.visited_urls and
-                            len(self.visited_urls) < self.max_pages):
-                        self.visited_urls.add(link)
-                        await queue.put((link, depth + 1))
+                    if len(self.visited) < self.max_pages and self.mark_visited(link):
+                        self.enqueue(link, depth + 1)
                         new_links_added += 1
 
                 if new_links_added > 0:
@@ -564,10 +992,27 @@ class WebCrawler:
 
         except Exception as e:
             logger.error(f"Ошибка обработки URL {url}: {str(e)}")
-            self.stats['pages_failed'] += 1
-            self.update_progress(
-                message=f'Ошибка при обработке {url}: {str(e)}'
-            )
+            await self.record_failure()
+            self.progress.report(message=f'Ошибка при обработке {url}: {str(e)}')
+        finally:
+            self._inflight_bytes -= inflight
+
+    async def finish_stopped(self):
+        """Остановка по запросу: пауза сохраняет контрольную точку, отмена удаляет ее"""
+        if self.stop_action == 'pause':
+            await self.save_checkpoint()
+            await self.update_job_status('paused')
+            message = f'Задание приостановлено, обработано {self.stats["pages_processed"]} страниц'
+            if self.stop_reason:
+                message += f' ({self.stop_reason})'
+            self.progress.report(status='paused', message=message, force=True)
+        else:
+            await self.flush_counters()
+            await self.update_job_status('cancelled')
+            await self.delete_checkpoint()
+            message = f'Задание отменено, обработано {self.stats["pages_processed"]} страниц'
+            self.progress.report(status='cancelled', message=message, force=True)
+        logger.info(message)
 
     async def crawl(self):
         """
@@ -587,65 +1032,79 @@ class WebCrawler:
             # Обновляем статус на 'running'
             await self.update_job_status('running')
 
-            # Обновляем прогресс - начинаем краулинг
-            self.update_progress(
-                status='running',
-                progress=0,
-                message='Запуск краулера...',
-                current_url=self.start_url
-            )
+            # Продолжаем с контрольной точки (пауза или перезапуск воркера) или начинаем с заданного URL
+            resumed = await self.restore_checkpoint()
+            if not resumed:
+                self.frontier = deque()
+                self.enqueue(self.start_url, 0)
+                self.visited = {url_fingerprint(self.start_url)}
+            self._last_checkpoint = time.monotonic()
+            await self.open_archive(resumed)
+
+            if self.loop_watchdog is None:
+                self.loop_watchdog = self._own_loop_watchdog = LoopWatchdog(
+                    f"Crawler-{self.job_id}", Config.CRAWL_LOOP_LAG_INTERVAL, Config.CRAWL_LOOP_STALL_THRESHOLD
+                )
+                self.loop_watchdog.start()
+            self.progress.loop_lag = self.loop_watchdog.summary
 
-            # Устанавливаем HTTP-сессию
-            connector = aiohttp.TCPConnector(
-                limit=10,  # Максимум 10 одновременных соединений
-                limit_per_host=5,  # Максимум 5 соединений на хост
-                ttl_dns_cache=300,  # Кеш DNS на 5 минут
-                use_dns_cache=True
-            )
+            # Обновляем прогресс - начинаем краулинг
+            self.progress.report(status='running', current_url=self.start_url,
+                                 message='Продолжение с контрольной точки...' if resumed else 'Запуск краулера...',
+                                 force=True)
+
+            # Устанавливаем HTTP-сессию: общую сессию исполнителя или собственную при запуске вне его
+            if self.http_client is None:
+                self.http_client = self._own_http_client = SharedHttpClient(
+                    limit=10,  # Максимум 10 одновременных соединений
+                    limit_per_host=5,  # Максимум 5 соединений на хост
+                    dns_ttl=300  # Кеш DNS на 5 минут
+                )
 
-            async with aiohttp.ClientSession(connector=connector) as session:
+            async with self.http_client.for_job(self.job_id, observe=self.timings.observe) as session:
                 self.session = session
-                queue = asyncio.Queue()
-
-                # Начинаем с заданного URL
-                await queue.put((self.start_url, 0))
-                self.visited_urls.add(self.start_url)
+                await self.load_robots()
+                queue = self.frontier
 
                 # Счетчик активных задач
                 active_tasks = 0
                 max_concurrent_tasks = 3  # Максимум одновременных задач
 
-                # Обрабатываем очередь URL
-                while (not queue.empty() or active_tasks > 0) and len(self.visited_urls) <= self.max_pages:
+                # Обрабатываем очередь URL до ее исчерпания или запрошенной остановки
+                while (queue or active_tasks > 0) and len(self.visited) <= self.max_pages and not self.stop_action:
                     # Запускаем новые задачи, если есть место и URL в очереди
-                    while active_tasks < max_concurrent_tasks and not queue.empty() and len(
-                            self.visited_urls) <= self.max_pages:
+                    while (active_tasks < max_concurrent_tasks and queue and len(self.visited) <= self.max_pages
+                           and not self.stop_action):
+                        url, depth = self.dequeue()
+                        task = asyncio.create_task(self.process_url(url, depth, queue))
+                        active_tasks += 1
+
+                        # Ждем завершения задачи
                         try:
-                            url, depth = await asyncio.wait_for(queue.get(), timeout=0.1)
-                            task = asyncio.create_task(self.process_url(url, depth, queue))
-                            active_tasks += 1
-
-                            # Ждем завершения задачи
-                            try:
-                                await task
-                            except Exception as e:
-                                logger.error(f"Ошибка в задаче обработки URL: {e}")
-                            finally:
-                                active_tasks -= 1
-
-                            # Добавляем задержку между запросами
-                            if self.delay > 0:
-                                await asyncio.sleep(self.delay)
-
-                        except asyncio.TimeoutError:
-                            # Очередь пуста, выходим из внутреннего цикла
-                            break
+                            await task
+                        except Exception as e:
+                            logger.error(f"Ошибка в задаче обработки URL: {e}")
+                        finally:
+                            active_tasks -= 1
+
+                        if time.monotonic() - self._last_checkpoint >= Config.CRAWL_CHECKPOINT_INTERVAL:
+                            await self.save_checkpoint()
+
+                        # Добавляем задержку между запросами
+                        if self.delay > 0 and not self.stop_action:
+                            await asyncio.sleep(self.delay)
 
                     # Небольшая пауза, чтобы не загружать CPU
                     await asyncio.sleep(0.1)
 
+                if self.stop_action:
+                    await self.finish_stopped()
+                    return self.job_id
+
                 # Обновляем статус задания на 'completed'
+                await self.flush_counters()
                 await self.update_job_status('completed')
+                await self.delete_checkpoint()
 
                 self.stats['end_time'] = datetime.now()
                 duration = self.stats['end_time'] - self.stats['start_time']
@@ -656,12 +1115,14 @@ class WebCrawler:
                 logger.info(f"  - Успешно: {self.stats['pages_successful']}")
                 logger.info(f"  - Ошибок: {self.stats['pages_failed']}")
                 logger.info(f"  - Ссылок найдено: {self.stats['links_found']}")
+                if self.response_cache is not None:
+                    logger.info(f"  - Из кеша: {self.stats['cache_hits']}, загружено: {self.stats['cache_misses']}")
 
                 # Финальное обновление прогресса
-                self.update_progress(
+                self.progress.report(
                     status='completed',
-                    progress=100,
-                    message=f'Краулинг завершен! Обработано {self.stats["pages_processed"]} страниц'
+                    message=f'Краулинг завершен! Обработано {self.stats["pages_processed"]} страниц',
+                    force=True
                 )
 
         except Exception as e:
@@ -671,14 +1132,14 @@ class WebCrawler:
             if self.job_id:
                 await self.update_job_status('failed')
 
-            self.update_progress(
-                status='failed',
-                message=f'Ошибка краулинга: {str(e)}'
-            )
+            self.progress.report(status='failed', message=f'Ошибка краулинга: {str(e)}', force=True)
             raise
 
         finally:
-            # Закрываем все соединения
+            # Дописываем оставшиеся счетчики, замеры этапов и прогресс, закрываем все соединения
+            await self.flush_counters()
+            await self.save_timings()
+            self.progress.flush()
             await self.close()
 
         # Возвращаем ID выполненного задания
@@ -1,17 +1,640 @@
 import psycopg2
+import psycopg2.extensions
 import psycopg2.extras
 import bcrypt
 import json
 from typing import List, Dict, Optional, Tuple
 from config import Config
 import threading
+import time
 from contextlib import contextmanager
 import logging
+import base64
+import re
 import dj_database_url
+from metrics import REGISTRY
 
 # Создаем собственный логгер для database.py
 logger = logging.getLogger(__name__)
 
+# Счетчики, которые ведутся прямо в crawl_jobs вместо COUNT(*) по страницам и ссылкам
+JOB_COUNTER_COLUMNS = ('pages_crawled', 'pages_failed', 'links_found', 'total_words', 'bytes_downloaded',
+                       'cache_hits', 'cache_misses', 'bytes_from_cache')
+
+# Размер страницы для списков с курсорной (keyset) пагинацией
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# Допустимые ключи сортировки списка заданий; вторым ключом всегда идет id
+JOB_SORT_COLUMNS = {
+    'created_at': 'cj.created_at',
+    'max_depth': 'cj.max_depth',
+}
+
+# Пересчет счетчиков заданий по фактическим данным (используется миграциями)
+RECOUNT_JOB_COUNTERS = [
+    """
+    UPDATE crawl_jobs cj
+    SET pages_crawled = s.pages, total_words = s.words
+    FROM (
+        SELECT job_id, COUNT(*) AS pages,
+               COALESCE(SUM((content->>'word_count')::bigint), 0) AS words
+        FROM crawled_pages
+        GROUP BY job_id
+    ) s
+    WHERE cj.id = s.job_id
+    """,
+    """
+    UPDATE crawl_jobs cj
+    SET links_found = s.links
+    FROM (SELECT job_id, COUNT(*) AS links FROM links GROUP BY job_id) s
+    WHERE cj.id = s.job_id
+    """,
+]
+
+# Версионированные миграции схемы: (версия, описание, SQL-операторы).
+# Каждая версия применяется один раз в своей транзакции и записывается в schema_migrations.
+# Операторы версий 1-5 написаны идемпотентно, чтобы их можно было накатить и на базу, созданную
+# вручную по ER-диаграмме. Начиная с 6 (перенос таблиц в партиции) миграции рассчитаны на однократное
+# применение и повторно не выполняются: версия откатывается целиком, если какой-то оператор не прошел.
+SCHEMA_MIGRATIONS = [
+    (1, 'Базовые таблицы', [
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id SERIAL PRIMARY KEY,
+            username VARCHAR(100) NOT NULL UNIQUE,
+            password_hash VARCHAR(255) NOT NULL,
+            role VARCHAR(20) NOT NULL DEFAULT 'user',
+            created_at TIMESTAMP NOT NULL DEFAULT NOW()
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS crawl_jobs (
+            id SERIAL PRIMARY KEY,
+            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            job_name VARCHAR(255) NOT NULL,
+            start_url TEXT NOT NULL,
+            max_pages INTEGER NOT NULL DEFAULT 100,
+            max_depth INTEGER NOT NULL DEFAULT 3,
+            delay NUMERIC(5, 2) NOT NULL DEFAULT 1.0,
+            status VARCHAR(20) NOT NULL DEFAULT 'running',
+            created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            started_at TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS crawled_pages (
+            id SERIAL PRIMARY KEY,
+            job_id INTEGER NOT NULL REFERENCES crawl_jobs(id) ON DELETE CASCADE,
+            url TEXT NOT NULL,
+            title TEXT,
+            depth INTEGER NOT NULL DEFAULT 0,
+            crawled_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            status_code INTEGER,
+            metadata JSONB,
+            content JSONB
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS links (
+            id SERIAL PRIMARY KEY,
+            job_id INTEGER NOT NULL REFERENCES crawl_jobs(id) ON DELETE CASCADE,
+            from_page_id INTEGER NOT NULL REFERENCES crawled_pages(id) ON DELETE CASCADE,
+            to_url TEXT NOT NULL,
+            link_text TEXT,
+            found_at TIMESTAMP NOT NULL DEFAULT NOW()
+        )
+        """,
+    ]),
+    (2, 'Счетчики заданий в crawl_jobs', [
+        """
+        ALTER TABLE crawl_jobs
+        ADD COLUMN IF NOT EXISTS pages_crawled INTEGER NOT NULL DEFAULT 0,
+        ADD COLUMN IF NOT EXISTS pages_failed INTEGER NOT NULL DEFAULT 0,
+        ADD COLUMN IF NOT EXISTS links_found INTEGER NOT NULL DEFAULT 0,
+        ADD COLUMN IF NOT EXISTS total_words BIGINT NOT NULL DEFAULT 0,
+        ADD COLUMN IF NOT EXISTS bytes_downloaded BIGINT NOT NULL DEFAULT 0
+        """,
+        *RECOUNT_JOB_COUNTERS,
+    ]),
+    (3, 'Скалярные колонки crawled_pages для списков', [
+        # word_count вычисляется из JSONB при записи, чтобы списки не читали content
+        """
+        ALTER TABLE crawled_pages
+        ADD COLUMN IF NOT EXISTS word_count INTEGER
+            GENERATED ALWAYS AS (COALESCE((content->>'word_count')::integer, 0)) STORED,
+        ADD COLUMN IF NOT EXISTS links_count INTEGER NOT NULL DEFAULT 0
+        """,
+        """
+        UPDATE crawled_pages cp
+        SET links_count = s.links
+        FROM (SELECT from_page_id, COUNT(*) AS links FROM links GROUP BY from_page_id) s
+        WHERE cp.id = s.from_page_id
+        """,
+    ]),
+    (4, 'Индексы курсорной пагинации', [
+        "CREATE INDEX IF NOT EXISTS idx_crawl_jobs_created ON crawl_jobs (created_at, id)",
+        "CREATE INDEX IF NOT EXISTS idx_crawl_jobs_user_created ON crawl_jobs (user_id, created_at, id)",
+        "CREATE INDEX IF NOT EXISTS idx_crawl_jobs_status_created ON crawl_jobs (status, created_at, id)",
+        "CREATE INDEX IF NOT EXISTS idx_crawl_jobs_user_status_created "
+        "ON crawl_jobs (user_id, status, created_at, id)",
+        "CREATE INDEX IF NOT EXISTS idx_crawl_jobs_depth ON crawl_jobs (max_depth, id)",
+        "CREATE INDEX IF NOT EXISTS idx_crawl_jobs_user_depth ON crawl_jobs (user_id, max_depth, id)",
+        "CREATE INDEX IF NOT EXISTS idx_users_created ON users (created_at, id)",
+        "CREATE INDEX IF NOT EXISTS idx_crawled_pages_job_crawled ON crawled_pages (job_id, crawled_at, id)",
+    ]),
+    (5, 'Индексы горячих запросов и уникальность (job_id, url)', [
+        "CREATE INDEX IF NOT EXISTS idx_links_job_from_page ON links (job_id, from_page_id)",
+        # Перед созданием уникального индекса убираем дубликаты страниц (оставляем первую)
+        """
+        DELETE FROM links l
+        USING crawled_pages cp
+        WHERE l.from_page_id = cp.id
+          AND EXISTS (SELECT 1 FROM crawled_pages d
+                      WHERE d.job_id = cp.job_id AND d.url = cp.url AND d.id < cp.id)
+        """,
+        """
+        DELETE FROM crawled_pages cp
+        WHERE EXISTS (SELECT 1 FROM crawled_pages d
+                      WHERE d.job_id = cp.job_id AND d.url = cp.url AND d.id < cp.id)
+        """,
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_crawled_pages_job_url ON crawled_pages (job_id, url)",
+        *RECOUNT_JOB_COUNTERS,
+    ]),
+    # Страницы и ссылки каждого задания живут в своих партициях: удаление задания - это DROP TABLE.
+    # Внешних ключей у партиционированных таблиц нет намеренно: их проверки затрагивали бы
+    # все партиции, а целостность обеспечивается удалением партиций вместе с заданием.
+    (6, 'Партиционирование crawled_pages и links по заданиям', [
+        "ALTER TABLE links RENAME TO links_legacy",
+        "ALTER TABLE crawled_pages RENAME TO crawled_pages_legacy",
+        "DROP INDEX IF EXISTS idx_crawled_pages_job_crawled",
+        "DROP INDEX IF EXISTS uq_crawled_pages_job_url",
+        "DROP INDEX IF EXISTS idx_links_job_from_page",
+        "CREATE SEQUENCE IF NOT EXISTS crawled_pages_part_id_seq",
+        "CREATE SEQUENCE IF NOT EXISTS links_part_id_seq",
+        """
+        CREATE TABLE crawled_pages (
+            id INTEGER NOT NULL DEFAULT nextval('crawled_pages_part_id_seq'),
+            job_id INTEGER NOT NULL,
+            url TEXT NOT NULL,
+            title TEXT,
+            depth INTEGER NOT NULL DEFAULT 0,
+            crawled_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            status_code INTEGER,
+            metadata JSONB,
+            content JSONB,
+            word_count INTEGER GENERATED ALWAYS AS (COALESCE((content->>'word_count')::integer, 0)) STORED,
+            links_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (job_id, id)
+        ) PARTITION BY LIST (job_id)
+        """,
+        "CREATE INDEX idx_crawled_pages_job_crawled ON crawled_pages (job_id, crawled_at, id)",
+        "CREATE UNIQUE INDEX uq_crawled_pages_job_url ON crawled_pages (job_id, url)",
+        """
+        CREATE TABLE links (
+            id BIGINT NOT NULL DEFAULT nextval('links_part_id_seq'),
+            job_id INTEGER NOT NULL,
+            from_page_id INTEGER NOT NULL,
+            to_url TEXT NOT NULL,
+            link_text TEXT,
+            found_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            PRIMARY KEY (job_id, id)
+        ) PARTITION BY LIST (job_id)
+        """,
+        "CREATE INDEX idx_links_job_from_page ON links (job_id, from_page_id)",
+        "ALTER SEQUENCE crawled_pages_part_id_seq OWNED BY crawled_pages.id",
+        "ALTER SEQUENCE links_part_id_seq OWNED BY links.id",
+        """
+        CREATE OR REPLACE FUNCTION create_job_partitions(p_job_id INTEGER) RETURNS VOID AS $$
+        BEGIN
+            EXECUTE format('CREATE TABLE IF NOT EXISTS %I PARTITION OF crawled_pages FOR VALUES IN (%s)',
+                           'crawled_pages_j' || p_job_id, p_job_id);
+            EXECUTE format('CREATE TABLE IF NOT EXISTS %I PARTITION OF links FOR VALUES IN (%s)',
+                           'links_j' || p_job_id, p_job_id);
+        END;
+        $$ LANGUAGE plpgsql
+        """,
+        """
+        CREATE OR REPLACE FUNCTION drop_job_partitions(p_job_id INTEGER) RETURNS VOID AS $$
+        BEGIN
+            EXECUTE format('DROP TABLE IF EXISTS %I', 'links_j' || p_job_id);
+            EXECUTE format('DROP TABLE IF EXISTS %I', 'crawled_pages_j' || p_job_id);
+        END;
+        $$ LANGUAGE plpgsql
+        """,
+        # Партиции нужны заданиям с данными и тем, что еще могут писать страницы
+        """
+        SELECT create_job_partitions(cj.id)
+        FROM crawl_jobs cj
+        WHERE cj.status NOT IN ('completed', 'failed')
+           OR EXISTS (SELECT 1 FROM crawled_pages_legacy cp WHERE cp.job_id = cj.id)
+        """,
+        """
+        INSERT INTO crawled_pages (id, job_id, url, title, depth, crawled_at, status_code,
+                                   metadata, content, links_count)
+        SELECT id, job_id, url, title, depth, crawled_at, status_code, metadata, content, links_count
+        FROM crawled_pages_legacy
+        """,
+        """
+        INSERT INTO links (id, job_id, from_page_id, to_url, link_text, found_at)
+        SELECT id, job_id, from_page_id, to_url, link_text, found_at
+        FROM links_legacy
+        """,
+        "SELECT setval('crawled_pages_part_id_seq', (SELECT COALESCE(MAX(id), 0) + 1 FROM crawled_pages), false)",
+        "SELECT setval('links_part_id_seq', (SELECT COALESCE(MAX(id), 0) + 1 FROM links), false)",
+        "DROP TABLE links_legacy",
+        "DROP TABLE crawled_pages_legacy",
+    ]),
+    # Словари URL и текстов ссылок задания: ссылки хранятся как тройки целых чисел,
+    # а повторяющиеся на каждой странице адреса меню и подвала - один раз на задание.
+    # fingerprint (md5) используется для поиска и уникальности вместо индекса по длинному тексту.
+    (7, 'Словари URL и текстов ссылок, ссылки как пары ID', [
+        "CREATE SEQUENCE IF NOT EXISTS crawl_urls_id_seq",
+        "CREATE SEQUENCE IF NOT EXISTS link_texts_id_seq",
+        """
+        CREATE TABLE crawl_urls (
+            job_id INTEGER NOT NULL,
+            url_id BIGINT NOT NULL DEFAULT nextval('crawl_urls_id_seq'),
+            url TEXT NOT NULL,
+            fingerprint BYTEA GENERATED ALWAYS AS (decode(md5(url), 'hex')) STORED,
+            PRIMARY KEY (job_id, url_id)
+        ) PARTITION BY LIST (job_id)
+        """,
+        "CREATE UNIQUE INDEX uq_crawl_urls_job_fingerprint ON crawl_urls (job_id, fingerprint)",
+        """
+        CREATE TABLE link_texts (
+            job_id INTEGER NOT NULL,
+            text_id BIGINT NOT NULL DEFAULT nextval('link_texts_id_seq'),
+            text TEXT NOT NULL,
+            fingerprint BYTEA GENERATED ALWAYS AS (decode(md5(text), 'hex')) STORED,
+            PRIMARY KEY (job_id, text_id)
+        ) PARTITION BY LIST (job_id)
+        """,
+        "CREATE UNIQUE INDEX uq_link_texts_job_fingerprint ON link_texts (job_id, fingerprint)",
+        "ALTER SEQUENCE crawl_urls_id_seq OWNED BY crawl_urls.url_id",
+        "ALTER SEQUENCE link_texts_id_seq OWNED BY link_texts.text_id",
+        """
+        CREATE OR REPLACE FUNCTION create_job_partitions(p_job_id INTEGER) RETURNS VOID AS $$
+        DECLARE
+            t TEXT;
+        BEGIN
+            FOREACH t IN ARRAY ARRAY['crawled_pages', 'links', 'crawl_urls', 'link_texts'] LOOP
+                EXECUTE format('CREATE TABLE IF NOT EXISTS %I PARTITION OF %I FOR VALUES IN (%s)',
+                               t || '_j' || p_job_id, t, p_job_id);
+            END LOOP;
+        END;
+        $$ LANGUAGE plpgsql
+        """,
+        """
+        CREATE OR REPLACE FUNCTION drop_job_partitions(p_job_id INTEGER) RETURNS VOID AS $$
+        DECLARE
+            t TEXT;
+        BEGIN
+            FOREACH t IN ARRAY ARRAY['links', 'link_texts', 'crawl_urls', 'crawled_pages'] LOOP
+                EXECUTE format('DROP TABLE IF EXISTS %I', t || '_j' || p_job_id);
+            END LOOP;
+        END;
+        $$ LANGUAGE plpgsql
+        """,
+        """
+        SELECT create_job_partitions(cj.id)
+        FROM crawl_jobs cj
+        WHERE to_regclass('crawled_pages_j' || cj.id) IS NOT NULL
+        """,
+        """
+        INSERT INTO crawl_urls (job_id, url)
+        SELECT job_id, url FROM crawled_pages
+        UNION
+        SELECT job_id, to_url FROM links
+        """,
+        """
+        INSERT INTO link_texts (job_id, text)
+        SELECT DISTINCT job_id, link_text FROM links WHERE link_text <> ''
+        """,
+        "ALTER TABLE crawled_pages ADD COLUMN url_id BIGINT",
+        """
+        UPDATE crawled_pages cp SET url_id = u.url_id
+        FROM crawl_urls u
+        WHERE u.job_id = cp.job_id AND u.fingerprint = decode(md5(cp.url), 'hex')
+        """,
+        "ALTER TABLE crawled_pages ALTER COLUMN url_id SET NOT NULL",
+        "DROP INDEX IF EXISTS uq_crawled_pages_job_url",
+        "CREATE UNIQUE INDEX uq_crawled_pages_job_url_id ON crawled_pages (job_id, url_id)",
+        "ALTER TABLE links ADD COLUMN from_url_id BIGINT, ADD COLUMN to_url_id BIGINT, ADD COLUMN text_id BIGINT",
+        """
+        UPDATE links l SET from_url_id = cp.url_id, to_url_id = u.url_id
+        FROM crawled_pages cp, crawl_urls u
+        WHERE cp.job_id = l.job_id AND cp.id = l.from_page_id
+          AND u.job_id = l.job_id AND u.fingerprint = decode(md5(l.to_url), 'hex')
+        """,
+        """
+        UPDATE links l SET text_id = t.text_id
+        FROM link_texts t
+        WHERE t.job_id = l.job_id AND t.fingerprint = decode(md5(l.link_text), 'hex')
+        """,
+        "DELETE FROM links WHERE from_url_id IS NULL OR to_url_id IS NULL",
+        "DROP INDEX IF EXISTS idx_links_job_from_page",
+        "ALTER TABLE links DROP COLUMN from_page_id, DROP COLUMN to_url, DROP COLUMN link_text",
+        "ALTER TABLE links ALTER COLUMN from_url_id SET NOT NULL, ALTER COLUMN to_url_id SET NOT NULL",
+        "CREATE INDEX idx_links_job_from_url ON links (job_id, from_url_id)",
+    ]),
+    (8, 'Общий для процессов прогресс заданий', [
+        """
+        CREATE TABLE IF NOT EXISTS job_progress (
+            job_id INTEGER PRIMARY KEY REFERENCES crawl_jobs(id) ON DELETE CASCADE,
+            version BIGINT NOT NULL,
+            snapshot JSONB NOT NULL,
+            updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+        )
+        """,
+    ]),
+    (9, 'Очередь заданий для отдельных воркеров краулинга', [
+        """
+        ALTER TABLE crawl_jobs
+        ADD COLUMN IF NOT EXISTS worker_id VARCHAR(255),
+        ADD COLUMN IF NOT EXISTS lease_expires_at TIMESTAMP,
+        ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_crawl_jobs_queued ON crawl_jobs (created_at, id) WHERE status = 'queued'",
+        "CREATE INDEX IF NOT EXISTS idx_crawl_jobs_lease ON crawl_jobs (lease_expires_at) WHERE status = 'running'",
+        # Задания, выполнявшиеся внутри веб-процессов до обновления, возвращаются в очередь. Аренды у них
+        # еще нет, поэтому живое задание не отличить от брошенного: старые веб-процессы должны быть
+        # остановлены до запуска новой версии, иначе задание выполнит и воркер
+        "UPDATE crawl_jobs SET status = 'queued', attempts = 1 WHERE status = 'running'",
+    ]),
+    (10, 'Пауза, возобновление и отмена заданий, контрольные точки обхода', [
+        "ALTER TABLE crawl_jobs ADD COLUMN IF NOT EXISTS control VARCHAR(10)",
+        """
+        CREATE TABLE IF NOT EXISTS job_checkpoints (
+            job_id INTEGER PRIMARY KEY REFERENCES crawl_jobs(id) ON DELETE CASCADE,
+            frontier JSONB NOT NULL,
+            visited BYTEA[] NOT NULL,
+            stats JSONB NOT NULL,
+            updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+        )
+        """,
+    ]),
+    (11, 'Гистограммы длительностей этапов обработки страниц задания', [
+        "ALTER TABLE crawl_jobs ADD COLUMN IF NOT EXISTS timings JSONB",
+    ]),
+    (12, 'Профили выполняющихся заданий по запросу администратора', [
+        """
+        CREATE TABLE IF NOT EXISTS job_profiles (
+            id SERIAL PRIMARY KEY,
+            job_id INTEGER NOT NULL REFERENCES crawl_jobs(id) ON DELETE CASCADE,
+            requested_by INTEGER REFERENCES users(id) ON DELETE SET NULL,
+            duration REAL NOT NULL,
+            status VARCHAR(10) NOT NULL DEFAULT 'requested',
+            samples INTEGER NOT NULL DEFAULT 0,
+            data TEXT,
+            error TEXT,
+            created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            finished_at TIMESTAMP
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_job_profiles_requested ON job_profiles (job_id) WHERE status = 'requested'",
+        "CREATE INDEX IF NOT EXISTS idx_job_profiles_created ON job_profiles (created_at DESC)",
+    ]),
+    (13, 'Счетчики общего кеша HTTP-ответов в заданиях', [
+        "ALTER TABLE crawl_jobs ADD COLUMN IF NOT EXISTS cache_hits INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE crawl_jobs ADD COLUMN IF NOT EXISTS cache_misses INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE crawl_jobs ADD COLUMN IF NOT EXISTS bytes_from_cache BIGINT NOT NULL DEFAULT 0",
+    ]),
+    # kind - что выполняет воркер: обход сайта (crawl) или повторное извлечение из архива ответов (reextract)
+    (14, 'Архив исходных ответов заданий и повторное извлечение из него', [
+        "ALTER TABLE crawl_jobs ADD COLUMN IF NOT EXISTS archive BOOLEAN NOT NULL DEFAULT FALSE",
+        "ALTER TABLE crawl_jobs ADD COLUMN IF NOT EXISTS kind VARCHAR(10) NOT NULL DEFAULT 'crawl'",
+    ]),
+]
+
+# Статусы заданий, после которых задание больше не выполняется
+FINISHED_JOB_STATUSES = ('completed', 'failed', 'cancelled')
+
+# Команды управления заданием: команда -> (статусы, из которых она применяется сразу, новый статус).
+# Для выполняющегося задания команда записывается в crawl_jobs.control, и воркер останавливает краулер сам
+JOB_CONTROL_ACTIONS = {
+    'pause': (('queued',), 'paused'),
+    'resume': (('paused',), 'queued'),
+    'cancel': (('queued', 'paused'), 'cancelled'),
+}
+
+# Словарные таблицы задания: таблица -> (колонка ID, колонка значения)
+DICTIONARY_TABLES = {
+    'crawl_urls': ('url_id', 'url'),
+    'link_texts': ('text_id', 'text'),
+}
+
+def queued_jobs_order() -> str:
+    """
+    Ожидающие задания с очередностью выдачи воркерам: turn - номер круга взвешенного round-robin
+    между пользователями. За круг пользователь получает одно задание, администратор - CRAWL_ADMIN_WEIGHT.
+    Выполняющиеся задания пользователя занимают его первые места, иначе после каждого захвата
+    следующее задание того же пользователя снова попадало бы в первый круг.
+    По этому же порядку считается позиция задания в очереди.
+    """
+    return f"""
+        SELECT id, turn FROM (
+            SELECT q.id, q.status,
+                   (row_number() OVER (PARTITION BY q.user_id ORDER BY q.status = 'running' DESC, q.created_at, q.id) - 1)
+                   / CASE WHEN u.role = 'admin' THEN {max(1, Config.CRAWL_ADMIN_WEIGHT)} ELSE 1 END AS turn
+            FROM crawl_jobs q
+            JOIN users u ON u.id = q.user_id
+            WHERE q.status IN ('queued', 'running')
+        ) active
+        WHERE status = 'queued'
+    """
+
+# Ключи advisory-блокировок: миграции (несколько воркеров стартуют одновременно), очистка старых заданий
+# и постановка в очередь с ограничением ее размера
+SCHEMA_LOCK_KEY = 7316001
+RETENTION_LOCK_KEY = 7316002
+QUEUE_LOCK_KEY = 7316003
+
+# Горячие запросы, планы которых проверяет check_query_plans: (название, SQL с именованными параметрами)
+HOT_QUERIES = [
+    ('job_details', "SELECT cj.* FROM crawl_jobs cj WHERE cj.id = %(job_id)s AND cj.user_id = %(user_id)s"),
+    ('user_jobs', """
+        SELECT id, job_name, status, created_at FROM crawl_jobs
+        WHERE user_id = %(user_id)s
+        ORDER BY created_at DESC, id DESC
+        LIMIT 51
+    """),
+    ('queued_jobs', """
+        SELECT id, user_id FROM crawl_jobs
+        WHERE status = 'queued'
+        ORDER BY created_at, id
+        LIMIT 100
+    """),
+    ('job_pages', """
+        SELECT id, url, title, depth, status_code, crawled_at, word_count, links_count
+        FROM crawled_pages
+        WHERE job_id = %(job_id)s
+        ORDER BY crawled_at DESC, id DESC
+        LIMIT 51
+    """),
+    ('page_by_url', """
+        SELECT cp.id FROM crawl_urls u
+        JOIN crawled_pages cp ON cp.job_id = u.job_id AND cp.url_id = u.url_id
+        WHERE u.job_id = %(job_id)s AND u.fingerprint = decode(md5(%(url)s), 'hex')
+    """),
+    ('page_links', """
+        SELECT u.url, t.text FROM links l
+        JOIN crawl_urls u ON u.job_id = l.job_id AND u.url_id = l.to_url_id
+        LEFT JOIN link_texts t ON t.job_id = l.job_id AND t.text_id = l.text_id
+        WHERE l.job_id = %(job_id)s AND l.from_url_id = %(url_id)s
+        ORDER BY l.id
+        LIMIT 100
+    """),
+]
+
+# Таблицы, полный просмотр которых в горячих запросах считается ошибкой
+PLAN_CHECK_TABLES = ('crawl_jobs', 'crawled_pages', 'links', 'crawl_urls', 'link_texts')
+
+
+# Нормализация SQL для лога медленных запросов: значения заменяются на ?, списки значений сворачиваются
+SQL_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+SQL_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+SQL_PLACEHOLDER = re.compile(r"%(?:\(\w+\))?s")
+SQL_VALUE_LIST = re.compile(r"\?(?:\s*,\s*\?)+")
+SQL_ROW_LIST = re.compile(r"\(\?\.\.\.\)(?:\s*,\s*\(\?\.\.\.\))+|\(\?\)(?:\s*,\s*\(\?\))+")
+
+REGISTRY.describe('crawler_db_query_seconds', 'histogram', 'Длительность SQL-запросов процесса')
+REGISTRY.describe('crawler_db_slow_queries_total', 'counter', 'SQL-запросы дольше SLOW_QUERY_MS')
+
+
+def normalize_sql(query) -> str:
+    """Текст запроса без значений: одинаковые по форме запросы с разными параметрами совпадают"""
+    if isinstance(query, bytes):
+        query = query.decode('utf-8', errors='replace')
+    elif not isinstance(query, str):
+        query = str(query)
+    query = SQL_STRING_LITERAL.sub('?', query)
+    query = SQL_PLACEHOLDER.sub('?', query)
+    query = SQL_NUMBER_LITERAL.sub('?', query)
+    query = SQL_VALUE_LIST.sub('?...', ' '.join(query.split()))
+    return SQL_ROW_LIST.sub(lambda match: match.group(0).split(',')[0] + ', ...', query)
+
+
+class QueryStats:
+    """SQL-запросы в пределах области (веб-запроса или блока count_queries): число, соединения, время в БД"""
+
+    def __init__(self, label: str = None):
+        self.label = label
+        self.queries = 0
+        self.connections = 0
+        self.db_seconds = 0.0
+        self.slow_queries: List[Tuple[float, str]] = []
+        self.parent: Optional['QueryStats'] = None
+
+    def merge(self, other: 'QueryStats'):
+        self.queries += other.queries
+        self.connections += other.connections
+        self.db_seconds += other.db_seconds
+        self.slow_queries.extend(other.slow_queries)
+
+
+# Область подсчета SQL-запросов текущего потока (None - запросы попадают только в метрики процесса)
+_query_scope = threading.local()
+
+
+def current_query_stats() -> Optional[QueryStats]:
+    return getattr(_query_scope, 'stats', None)
+
+
+def record_query(query, seconds: float):
+    """Учет выполненного запроса: область потока, метрики процесса и лог медленных запросов"""
+    stats = current_query_stats()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_seconds += seconds
+    REGISTRY.observe('crawler_db_query_seconds', seconds)
+
+    if Config.SLOW_QUERY_MS > 0 and seconds * 1000 >= Config.SLOW_QUERY_MS:
+        normalized = normalize_sql(query)
+        REGISTRY.inc('crawler_db_slow_queries_total')
+        if stats is not None:
+            stats.slow_queries.append((seconds, normalized))
+        where = f" ({stats.label})" if stats is not None and stats.label else ''
+        logger.warning(f"Медленный SQL-запрос{where}: {seconds * 1000:.0f} мс: {normalized}")
+
+
+class InstrumentedCursorMixin:
+    """Замер каждого выполнения курсора; подмешивается к любому cursor_factory"""
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            record_query(query, time.perf_counter() - started)
+
+    def executemany(self, query, vars_list):
+        started = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            record_query(query, time.perf_counter() - started)
+
+
+_instrumented_cursor_classes: Dict[type, type] = {}
+
+
+def instrumented_cursor_class(factory: type) -> type:
+    cursor_class = _instrumented_cursor_classes.get(factory)
+    if cursor_class is None:
+        cursor_class = type(f"Instrumented{factory.__name__}", (InstrumentedCursorMixin, factory), {})
+        _instrumented_cursor_classes[factory] = cursor_class
+    return cursor_class
+
+
+class InstrumentedConnection(psycopg2.extensions.connection):
+    """
+    Соединение DatabaseManager: курсоры с любым cursor_factory замеряют запросы, поэтому учитываются
+    и execute_query/fetch_one/fetch_all/fetch_val, и методы, работающие с курсором напрямую.
+    """
+
+    def __init__(self, *args, **kwargs):
+        started = time.perf_counter()
+        super().__init__(*args, **kwargs)
+        stats = current_query_stats()
+        if stats is not None:
+            stats.connections += 1
+            stats.db_seconds += time.perf_counter() - started
+
+    def cursor(self, *args, **kwargs):
+        factory = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+        kwargs['cursor_factory'] = instrumented_cursor_class(factory)
+        return super().cursor(*args, **kwargs)
+
+
+def encode_cursor(values: tuple) -> str:
+    """Упаковка значений ключа последней строки в непрозрачный курсор для URL"""
+    raw = json.dumps([v.isoformat() if hasattr(v, 'isoformat') else v for v in values])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: Optional[str], size: int = 2) -> Optional[list]:
+    """Распаковка курсора; некорректный курсор считается отсутствующим"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+        if isinstance(values, list) and len(values) == size:
+            return values
+    except (ValueError, TypeError):
+        pass
+    logger.warning(f"Некорректный курсор пагинации: {cursor}")
+    return None
+
+
+def clamp_page_size(limit: Optional[int]) -> int:
+    """Ограничение размера страницы списка разумными пределами"""
+    if not limit or limit < 1:
+        return DEFAULT_PAGE_SIZE
+    return min(limit, MAX_PAGE_SIZE)
+
 
 class DatabaseManager:
     _instance = None
@@ -46,8 +669,13 @@ class DatabaseManager:
                     'host': Config.DATABASE_CONFIG['host'],
                     'port': Config.DATABASE_CONFIG['port']
                 }
-            self._initialized = True
+            self.config['connection_factory'] = InstrumentedConnection
+            # Кеш записей пользователей: user_id -> (момент истечения, запись)
+            self._user_cache: Dict[int, Tuple[float, Dict]] = {}
+            self._user_cache_lock = threading.Lock()
+            self._apply_migrations()
             self._create_default_admin()
+            self._initialized = True
 
     @contextmanager
     def get_connection(self):
@@ -65,6 +693,238 @@ class DatabaseManager:
             if conn:
                 conn.close()
 
+    def begin_query_stats(self, label: str = None) -> QueryStats:
+        """
+        Начало подсчета SQL-запросов текущего потока (веб-запрос: before_request).
+        Вложенная область по окончании добавляет свои счетчики во внешнюю.
+        """
+        stats = QueryStats(label)
+        stats.parent = current_query_stats()
+        _query_scope.stats = stats
+        return stats
+
+    def end_query_stats(self, stats: QueryStats):
+        """Окончание области подсчета, начатой begin_query_stats"""
+        if current_query_stats() is stats:
+            _query_scope.stats = stats.parent
+            if stats.parent is not None:
+                stats.parent.merge(stats)
+
+    @contextmanager
+    def count_queries(self, label: str = None):
+        """
+        Подсчет SQL-запросов внутри блока, например для проверки числа запросов маршрута:
+
+            with db_manager.count_queries() as stats:
+                client.get('/dashboard')
+            assert stats.queries <= 3
+        """
+        stats = self.begin_query_stats(label)
+        try:
+            yield stats
+        finally:
+            self.end_query_stats(stats)
+
+    @contextmanager
+    def transaction(self):
+        """Контекстный менеджер для выполнения нескольких запросов в одной транзакции"""
+        with self.get_connection() as conn:
+            conn.autocommit = False
+            try:
+                yield conn
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+    def _apply_migrations(self):
+        """
+        Применение миграций схемы при старте.
+        Ошибка останавливает запуск: веб-приложение и воркеры не должны работать на схеме старой версии.
+        """
+        try:
+            applied = self.migrate()
+            if applied:
+                logger.info(f"Применены миграции схемы: {', '.join(map(str, applied))}")
+        except Exception as e:
+            logger.critical(f"Ошибка применения миграций схемы, запуск остановлен: {e}")
+            raise
+
+    def get_schema_version(self) -> int:
+        """Текущая версия схемы базы данных (0 - миграции не применялись)"""
+        if not self.fetch_val("SELECT to_regclass('schema_migrations')"):
+            return 0
+        return self.fetch_val("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")
+
+    def migrate(self) -> List[int]:
+        """
+        Применение недостающих миграций из SCHEMA_MIGRATIONS.
+        Возвращает список примененных версий.
+        """
+        applied = []
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT pg_advisory_lock(%s)", (SCHEMA_LOCK_KEY,))
+            try:
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS schema_migrations (
+                        version INTEGER PRIMARY KEY,
+                        description TEXT NOT NULL,
+                        applied_at TIMESTAMP NOT NULL DEFAULT NOW()
+                    )
+                """)
+                cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")
+                current_version = cursor.fetchone()[0]
+
+                for version, description, statements in SCHEMA_MIGRATIONS:
+                    if version <= current_version:
+                        continue
+
+                    conn.autocommit = False
+                    try:
+                        for statement in statements:
+                            cursor.execute(statement)
+                        cursor.execute(
+                            "INSERT INTO schema_migrations (version, description) VALUES (%s, %s)",
+                            (version, description)
+                        )
+                        conn.commit()
+                    except Exception:
+                        conn.rollback()
+                        logger.error(f"Ошибка миграции схемы {version} ({description})")
+                        raise
+                    finally:
+                        conn.autocommit = True
+
+                    applied.append(version)
+                    logger.info(f"Применена миграция схемы {version}: {description}")
+            finally:
+                cursor.execute("SELECT pg_advisory_unlock(%s)", (SCHEMA_LOCK_KEY,))
+
+        return applied
+
+    def check_query_plans(self, seed: bool = True, seed_users: int = 50, seed_jobs: int = 5000,
+                          seed_page_jobs: int = 20, seed_pages: int = 2000, seed_links: int = 5) -> List[Dict]:
+        """
+        Проверка через EXPLAIN, что горячие запросы используют индексы.
+
+        При seed=True база временно наполняется синтетическими данными (внутри транзакции,
+        которая затем откатывается), чтобы планировщик выбирал планы как на большой базе.
+        Возвращает по записи на запрос: название, узлы плана и признак ok.
+        """
+        results = []
+        with self.get_connection() as conn:
+            conn.autocommit = False
+            try:
+                cursor = conn.cursor()
+                if seed:
+                    params = self._seed_plan_check_data(cursor, seed_users, seed_jobs, seed_page_jobs,
+                                                        seed_pages, seed_links)
+                else:
+                    cursor.execute("""
+                        SELECT cp.job_id, cj.user_id, cp.id, cp.url, cp.url_id
+                        FROM crawled_pages cp JOIN crawl_jobs cj ON cj.id = cp.job_id
+                        ORDER BY cp.id DESC LIMIT 1
+                    """)
+                    row = cursor.fetchone() or (0, 0, 0, '', 0)
+                    params = {'job_id': row[0], 'user_id': row[1], 'page_id': row[2], 'url': row[3],
+                              'url_id': row[4]}
+
+                for name, query in HOT_QUERIES:
+                    cursor.execute("EXPLAIN (FORMAT JSON) " + query, params)
+                    plan = cursor.fetchone()[0]
+                    if isinstance(plan, str):
+                        plan = json.loads(plan)
+
+                    nodes = []
+                    self._collect_plan_nodes(plan[0]['Plan'], nodes)
+                    seq_scans = [
+                        relation for node_type, relation in nodes
+                        if node_type == 'Seq Scan' and relation and relation.startswith(PLAN_CHECK_TABLES)
+                    ]
+                    results.append({
+                        'query': name,
+                        'nodes': [f"{node_type} on {relation}" if relation else node_type
+                                  for node_type, relation in nodes],
+                        'ok': not seq_scans
+                    })
+            finally:
+                conn.rollback()
+                conn.autocommit = True
+
+        return results
+
+    @staticmethod
+    def _collect_plan_nodes(plan: Dict, nodes: list):
+        """Рекурсивный сбор (тип узла, таблица) из JSON-плана EXPLAIN"""
+        nodes.append((plan.get('Node Type'), plan.get('Relation Name')))
+        for child in plan.get('Plans', []):
+            DatabaseManager._collect_plan_nodes(child, nodes)
+
+    @staticmethod
+    def _seed_plan_check_data(cursor, users: int, jobs: int, page_jobs: int, pages: int, links: int) -> Dict:
+        """
+        Наполнение базы синтетическими данными для проверки планов (в текущей транзакции).
+        Страницы и ссылки получают только первые page_jobs заданий: у каждого задания свои партиции.
+        """
+        cursor.execute("""
+            INSERT INTO users (username, password_hash, role)
+            SELECT '__plan_check_' || g, '-', 'user' FROM generate_series(1, %s) g
+            RETURNING id
+        """, (users,))
+        user_ids = [row[0] for row in cursor.fetchall()]
+
+        cursor.execute("""
+            INSERT INTO crawl_jobs (user_id, job_name, start_url, max_pages, max_depth, delay, status, created_at)
+            SELECT (%s::int[])[1 + g %% %s], 'plan-check-' || g, 'https://example.com/', 100, 3, 0,
+                   'completed', NOW() - g * INTERVAL '1 minute'
+            FROM generate_series(1, %s) g
+            RETURNING id
+        """, (user_ids, len(user_ids), jobs))
+        job_ids = [row[0] for row in cursor.fetchall()][:page_jobs]
+        cursor.execute("SELECT create_job_partitions(id) FROM unnest(%s::int[]) AS j(id)", (job_ids,))
+
+        # Ссылки ведут на страницы того же задания, как у шаблонных сайтов с общим меню
+        cursor.execute("""
+            INSERT INTO crawl_urls (job_id, url)
+            SELECT j.id, 'https://example.com/' || j.id || '/' || g
+            FROM unnest(%s::int[]) AS j(id), generate_series(1, %s) g
+        """, (job_ids, pages))
+        cursor.execute("""
+            INSERT INTO link_texts (job_id, text)
+            SELECT j.id, 'link ' || g
+            FROM unnest(%s::int[]) AS j(id), generate_series(1, %s) g
+        """, (job_ids, pages))
+
+        cursor.execute("""
+            INSERT INTO crawled_pages (job_id, url_id, url, title, depth, status_code, metadata, content, crawled_at)
+            SELECT u.job_id, u.url_id, u.url, 'Page ' || u.url_id, u.url_id %% 4, 200,
+                   '{}'::jsonb, jsonb_build_object('word_count', u.url_id %% 500),
+                   NOW() - u.url_id * INTERVAL '1 second'
+            FROM crawl_urls u
+            WHERE u.job_id = ANY(%s)
+        """, (job_ids,))
+
+        cursor.execute("""
+            INSERT INTO links (job_id, from_url_id, to_url_id, text_id)
+            SELECT cp.job_id, cp.url_id, cp.url_id - g, t.text_id
+            FROM crawled_pages cp, generate_series(1, %s) g, link_texts t
+            WHERE cp.job_id = ANY(%s) AND t.job_id = cp.job_id
+              AND t.text = 'link ' || ((cp.url_id + g) %% %s + 1)
+        """, (links, job_ids, pages))
+
+        for table in ('users', 'crawl_jobs', 'crawled_pages', 'links', 'crawl_urls', 'link_texts'):
+            cursor.execute(f"ANALYZE {table}")
+
+        job_id = job_ids[len(job_ids) // 2]
+        cursor.execute("""
+            SELECT cp.id, cp.url, cp.url_id, cj.user_id
+            FROM crawled_pages cp JOIN crawl_jobs cj ON cj.id = cp.job_id
+            WHERE cp.job_id = %s LIMIT 1
+        """, (job_id,))
+        page_id, url, url_id, user_id = cursor.fetchone()
+        return {'job_id': job_id, 'user_id': user_id, 'page_id': page_id, 'url': url, 'url_id': url_id}
+
     def _create_default_admin(self):
         """Создание администратора по умолчанию"""
         try:
@@ -179,10 +1039,20 @@ class DatabaseManager:
             logger.error(f"Ошибка проверки пользователя: {e}")
             return None
 
-    def get_user_by_id(self, user_id: int) -> Optional[Dict]:
-        """Получение пользователя по ID"""
+    def get_user_by_id(self, user_id: int, use_cache: bool = True) -> Optional[Dict]:
+        """
+        Получение пользователя по ID.
+        Записи кешируются в процессе на Config.USER_CACHE_TTL секунд; изменение роли и удаление
+        пользователя сбрасывают кеш, в остальных процессах запись устаревает не дольше TTL.
+        """
+        if use_cache:
+            with self._user_cache_lock:
+                cached = self._user_cache.get(user_id)
+            if cached and cached[0] > time.monotonic():
+                return dict(cached[1])
+
         try:
-            return self.fetch_one(
+            user = self.fetch_one(
                 "SELECT id, username, role, created_at FROM users WHERE id = %s",
                 (user_id,)
             )
@@ -190,46 +1060,123 @@ class DatabaseManager:
             logger.error(f"Ошибка получения пользователя: {e}")
             return None
 
-    def get_all_users(self) -> List[Dict]:
-        """Получение всех пользователей (для админа)"""
+        if user and Config.USER_CACHE_TTL > 0:
+            with self._user_cache_lock:
+                self._user_cache[user_id] = (time.monotonic() + Config.USER_CACHE_TTL, dict(user))
+        return user
+
+    def invalidate_user_cache(self, user_id: int = None):
+        """Сброс закешированной записи пользователя (или всего кеша)"""
+        with self._user_cache_lock:
+            if user_id is None:
+                self._user_cache.clear()
+            else:
+                self._user_cache.pop(user_id, None)
+
+    def get_all_users(self, cursor: str = None, limit: int = DEFAULT_PAGE_SIZE) -> Tuple[List[Dict], Optional[str]]:
+        """Получение страницы пользователей (для админа), от новых к старым.
+
+        Возвращает список пользователей и курсор следующей страницы (или None).
+        """
         try:
-            return self.fetch_all(
-                "SELECT id, username, role, created_at FROM users ORDER BY created_at DESC"
-            )
+            limit = clamp_page_size(limit)
+            after = decode_cursor(cursor)
+            if after:
+                users = self.fetch_all("""
+                    SELECT id, username, role, created_at FROM users
+                    WHERE (created_at, id) < (%s, %s)
+                    ORDER BY created_at DESC, id DESC
+                    LIMIT %s
+                """, (after[0], after[1], limit + 1))
+            else:
+                users = self.fetch_all("""
+                    SELECT id, username, role, created_at FROM users
+                    ORDER BY created_at DESC, id DESC
+                    LIMIT %s
+                """, (limit + 1,))
+
+            next_cursor = None
+            if len(users) > limit:
+                users = users[:limit]
+                next_cursor = encode_cursor((users[-1]['created_at'], users[-1]['id']))
+            return users, next_cursor
         except Exception as e:
             logger.error(f"Ошибка получения пользователей: {e}")
-            return []
+            return [], None
 
-    def delete_user(self, user_id: int) -> bool:
-        """Удаление пользователя"""
+    def get_user_role_counts(self) -> Dict[str, int]:
+        """Количество пользователей по ролям и общее количество"""
+        try:
+            rows = self.fetch_all("SELECT role, COUNT(*) AS count FROM users GROUP BY role")
+            counts = {row['role']: row['count'] for row in rows}
+            counts['total'] = sum(counts.values())
+            return counts
+        except Exception as e:
+            logger.error(f"Ошибка подсчета пользователей: {e}")
+            return {'total': 0}
+
+    def delete_user(self, user_id: int) -> Optional[List[int]]:
+        """
+        Удаление пользователя вместе с партициями его заданий.
+        Возвращает ID удаленных заданий (для удаления их архивов) или None, если пользователь не удален,
+        в том числе пока какое-то из его заданий выполняется.
+        """
         try:
             # Проверяем, что это не администратор
             user = self.fetch_one("SELECT role FROM users WHERE id = %s", (user_id,))
             if user and user['role'] == 'admin':
                 logger.warning("Попытка удалить администратора")
-                return False
+                return None
 
-            result = self.execute_query("DELETE FROM users WHERE id = %s", (user_id,))
-            return "DELETE 1" in result
+            with self.transaction() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    "SELECT id, status FROM crawl_jobs WHERE user_id = %s ORDER BY id FOR UPDATE", (user_id,)
+                )
+                jobs = cursor.fetchall()
+                running = [job_id for job_id, status in jobs if status == 'running']
+                if running:
+                    logger.warning(f"Пользователь {user_id} не удален: выполняются задания {running}")
+                    return None
+                job_ids = [job_id for job_id, _ in jobs]
+                self._drop_locked_jobs(cursor, job_ids)
+                cursor.execute("DELETE FROM users WHERE id = %s", (user_id,))
+                deleted = cursor.rowcount == 1
+            self.invalidate_user_cache(user_id)
+            return job_ids if deleted else None
         except Exception as e:
             logger.error(f"Ошибка удаления пользователя: {e}")
-            return False
+            return None
 
     # Методы для работы с заданиями краулера
     def create_job(self, user_id: int, job_name: str, start_url: str, max_pages: int,
-                   max_depth: int, delay: float, status: str = 'running') -> int:
-        """Создание нового задания на краулинг"""
+                   max_depth: int, delay: float, status: str = 'running', archive: bool = False,
+                   max_queued: int = None) -> Optional[int]:
+        """
+        Создание нового задания на краулинг (archive - сохранять исходные ответы в архив задания).
+        С max_queued задание добавляется, только если ожидающих заданий меньше max_queued, иначе
+        возвращается None. Проверка и вставка выполняются одним запросом под advisory-блокировкой,
+        поэтому одновременные запросы не превышают предел; подсчет идет по частичному индексу очереди.
+        """
         try:
-            with self.get_connection() as conn:
+            with self.transaction() as conn:
                 cursor = conn.cursor()
+                if max_queued is not None:
+                    cursor.execute("SELECT pg_advisory_xact_lock(%s)", (QUEUE_LOCK_KEY,))
                 cursor.execute("""
                     INSERT INTO crawl_jobs 
-                    (user_id, job_name, start_url, max_pages, max_depth, delay, status, started_at) 
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, NOW()) 
+                    (user_id, job_name, start_url, max_pages, max_depth, delay, status, started_at, archive) 
+                    SELECT %s, %s, %s, %s, %s, %s, %s, CASE WHEN %s = 'running' THEN NOW() END, %s
+                    WHERE %s::int IS NULL OR (SELECT count(*) FROM crawl_jobs WHERE status = 'queued') < %s
                     RETURNING id
-                """, (user_id, job_name, start_url, max_pages, max_depth, delay, status))
+                """, (user_id, job_name, start_url, max_pages, max_depth, delay, status, status, archive,
+                      max_queued, max_queued))
 
-                job_id = cursor.fetchone()[0]
+                row = cursor.fetchone()
+                if row is None:
+                    return None
+                job_id = row[0]
+                cursor.execute("SELECT create_job_partitions(%s)", (job_id,))
                 logger.info(f"Создано новое задание с ID: {job_id}")
                 return job_id
         except Exception as e:
@@ -237,170 +1184,916 @@ class DatabaseManager:
             raise
 
     def update_job_status(self, job_id: int, status: str):
-        """Обновление статуса задания"""
+        """
+        Обновление статуса задания. Остановленное задание (завершено, отменено, на паузе)
+        освобождает аренду воркера, а выполненная команда управления сбрасывается.
+        """
+        stopped = status != 'running'
         try:
             with self.get_connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute("""
                     UPDATE crawl_jobs SET status = %s, 
-                    finished_at = CASE WHEN %s IN ('completed', 'failed') THEN NOW() ELSE finished_at END
+                    started_at = CASE WHEN %s = 'running' THEN COALESCE(started_at, NOW()) ELSE started_at END,
+                    finished_at = CASE WHEN %s = ANY(%s) THEN NOW() ELSE finished_at END,
+                    lease_expires_at = CASE WHEN %s THEN NULL ELSE lease_expires_at END,
+                    control = CASE WHEN %s THEN NULL ELSE control END
                     WHERE id = %s
-                """, (status, status, job_id))
+                """, (status, status, status, list(FINISHED_JOB_STATUSES), stopped, stopped, job_id))
                 logger.info(f"Обновлен статус задания {job_id} на {status}")
         except Exception as e:
             logger.error(f"Ошибка обновления статуса задания: {e}")
 
-    def save_page(self, job_id: int, url: str, title: str, depth: int, status_code: int,
-                  metadata: dict, content: dict) -> int:
-        """Сохранение данных страницы в БД"""
+    def claim_jobs(self, worker_id: str, limit: int, lease_seconds: int) -> List[Dict]:
+        """
+        Захват до limit ожидающих заданий воркером: FOR UPDATE SKIP LOCKED, поэтому воркеры
+        не ждут друг друга и не получают одно задание дважды. Задания выбираются по очереди
+        между пользователями с весом администраторов (см. queued_jobs_order).
+        Задание, которое уже выполнялось, продолжается с контрольной точки; если ее нет (воркер умер
+        до первой), начинается заново: его страницы и счетчики очищаются. Повторное извлечение
+        из архива (kind = 'reextract') само заменяет страницы задания, его данные не очищаются.
+        """
+        if limit <= 0:
+            return []
+        try:
+            with self.transaction() as conn:
+                cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+                cursor.execute(f"""
+                    WITH claimed AS (
+                        SELECT cj.id
+                        FROM crawl_jobs cj
+                        JOIN ({queued_jobs_order()}) q ON q.id = cj.id
+                        WHERE cj.status = 'queued'
+                        ORDER BY q.turn, cj.created_at, cj.id
+                        LIMIT %s
+                        FOR UPDATE OF cj SKIP LOCKED
+                    )
+                    UPDATE crawl_jobs cj
+                    SET status = 'running', worker_id = %s, attempts = cj.attempts + 1,
+                        lease_expires_at = NOW() + make_interval(secs => %s),
+                        started_at = COALESCE(cj.started_at, NOW())
+                    FROM claimed, users u
+                    WHERE cj.id = claimed.id AND u.id = cj.user_id
+                    RETURNING cj.id, cj.user_id, cj.job_name, cj.start_url, cj.max_pages, cj.max_depth,
+                              cj.delay, cj.attempts, cj.archive, cj.kind, u.role
+                """, (limit, worker_id, lease_seconds))
+                jobs = [dict(row) for row in cursor.fetchall()]
+
+                retried = [job['id'] for job in jobs if job['attempts'] > 1 and job['kind'] == 'crawl']
+                if retried:
+                    cursor.execute("SELECT job_id FROM job_checkpoints WHERE job_id = ANY(%s)", (retried,))
+                    resumable = {row['job_id'] for row in cursor.fetchall()}
+                    retried = [job_id for job_id in retried if job_id not in resumable]
+                if retried:
+                    cursor.execute(f"""
+                        UPDATE crawl_jobs SET {', '.join(f'{column} = 0' for column in JOB_COUNTER_COLUMNS)}, timings = NULL
+                        WHERE id = ANY(%s)
+                    """, (retried,))
+
+            # Данные заданий, начинаемых заново, очищаются после фиксации захвата: TRUNCATE партиций
+            # не зависит от их объема и не держит блокировки строк crawl_jobs
+            for job_id in retried:
+                self.truncate_job_partitions(job_id)
+
+            for job in jobs:
+                job['delay'] = float(job['delay'])
+            if jobs:
+                logger.info(f"Воркер {worker_id} захватил задания: {[job['id'] for job in jobs]}")
+            return jobs
+        except Exception as e:
+            logger.error(f"Ошибка захвата заданий воркером {worker_id}: {e}")
+            return []
+
+    def truncate_job_partitions(self, job_id: int):
+        """Очистка страниц, ссылок и словарей задания (партиции остаются)"""
+        # Тот же порядок таблиц, что и в create_job_partitions, иначе возможна взаимоблокировка
+        partitions = ', '.join(f"{table}_j{int(job_id)}" for table in ('crawled_pages', 'links', 'crawl_urls', 'link_texts'))
+        try:
+            with self.transaction() as conn:
+                conn.cursor().execute(f"TRUNCATE {partitions}")
+        except Exception as e:
+            logger.error(f"Ошибка очистки данных задания {job_id}: {e}")
+
+    @staticmethod
+    def _detach_job_partitions(cursor, job_ids: List[int]):
+        """
+        Отсоединение партиций заданий перед удалением: DETACH PARTITION CONCURRENTLY берет на родительской
+        таблице только SHARE UPDATE EXCLUSIVE, тогда как DROP TABLE присоединенной партиции - ACCESS EXCLUSIVE,
+        и чтение и запись страниц всех заданий ждали бы удаления. Отсоединенные таблицы затем удаляет
+        drop_job_partitions. Выполняется вне транзакции (cursor соединения в режиме autocommit);
+        отсоединение, прерванное на середине, завершается через FINALIZE.
+        """
+        if not job_ids:
+            return
+        cursor.execute("""
+            SELECT parent.relname, child.relname, i.inhdetachpending
+            FROM unnest(%s::int[]) AS j(id)
+            CROSS JOIN unnest(ARRAY['links', 'link_texts', 'crawl_urls', 'crawled_pages']) WITH ORDINALITY AS t(name, n)
+            JOIN pg_class child ON child.oid = to_regclass(t.name || '_j' || j.id)
+            JOIN pg_inherits i ON i.inhrelid = child.oid
+            JOIN pg_class parent ON parent.oid = i.inhparent
+            ORDER BY j.id, t.n
+        """, (list(job_ids),))
+        for parent, child, pending in cursor.fetchall():
+            cursor.execute(f"ALTER TABLE {parent} DETACH PARTITION {child} {'FINALIZE' if pending else 'CONCURRENTLY'}")
+
+    def _drop_locked_jobs(self, cursor, job_ids: List[int]):
+        """
+        Удаление заданий, строки которых cursor уже заблокировал (SELECT ... FOR UPDATE) и которые
+        не выполняются. Пока транзакция cursor открыта, воркер не захватит задание (claim_jobs пропускает
+        заблокированные строки), а возобновление и повторное извлечение ждут ее, поэтому в партиции
+        задания никто не пишет. Партиции отсоединяются через отдельное соединение (DETACH CONCURRENTLY
+        нельзя выполнить в транзакции), затем удаляются вместе со строками заданий в транзакции cursor.
+        """
+        if not job_ids:
+            return
+        with self.get_connection() as conn:
+            self._detach_job_partitions(conn.cursor(), job_ids)
+        cursor.execute("SELECT drop_job_partitions(id) FROM unnest(%s::int[]) AS j(id)", (list(job_ids),))
+        cursor.execute("DELETE FROM crawl_jobs WHERE id = ANY(%s)", (list(job_ids),))
+
+    def renew_job_leases(self, worker_id: str, job_ids: List[int], lease_seconds: int) -> List[int]:
+        """Продление аренды выполняющихся заданий воркера; возвращает задания, которые все еще за ним"""
+        if not job_ids:
+            return []
         try:
             with self.get_connection() as conn:
                 cursor = conn.cursor()
+                # Только что завершенные задания тоже остаются за воркером, их аренда уже снята
                 cursor.execute("""
-                    INSERT INTO crawled_pages 
-                    (job_id, url, title, depth, status_code, metadata, content) 
-                    VALUES (%s, %s, %s, %s, %s, %s, %s) 
+                    UPDATE crawl_jobs
+                    SET lease_expires_at = CASE WHEN status = 'running'
+                                                THEN NOW() + make_interval(secs => %s) END
+                    WHERE id = ANY(%s) AND worker_id = %s
                     RETURNING id
-                """, (job_id, url, title, depth, status_code,
+                """, (lease_seconds, list(job_ids), worker_id))
+                return [row[0] for row in cursor.fetchall()]
+        except Exception as e:
+            logger.error(f"Ошибка продления аренды заданий воркера {worker_id}: {e}")
+            # Не удалось связаться с БД - не считаем задания потерянными
+            return list(job_ids)
+
+    def requeue_jobs(self, worker_id: str = None, job_ids: List[int] = None) -> List[Dict]:
+        """
+        Возврат выполняющихся заданий в очередь.
+        С worker_id - задания этого воркера (остановка воркера), без него - задания с истекшей арендой
+        (воркер умер или потерял связь с БД). Задание с невыполненной командой управления
+        сразу получает ее итоговый статус (на паузе или отменено). Возвращает [{'id', 'status'}].
+        """
+        if worker_id is not None:
+            condition = "worker_id = %s AND id = ANY(%s)"
+            params = (worker_id, list(job_ids or []))
+        else:
+            condition = "lease_expires_at < NOW()"
+            params = ()
+
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+                cursor.execute(f"""
+                    UPDATE crawl_jobs
+                    SET status = CASE control WHEN 'pause' THEN 'paused' WHEN 'cancel' THEN 'cancelled' ELSE 'queued' END,
+                        finished_at = CASE WHEN control = 'cancel' THEN NOW() ELSE finished_at END,
+                        control = NULL, worker_id = NULL, lease_expires_at = NULL
+                    WHERE status = 'running' AND {condition}
+                    RETURNING id, status
+                """, params)
+                requeued = [dict(row) for row in cursor.fetchall()]
+            if requeued:
+                logger.warning(f"Задания возвращены в очередь: {[job['id'] for job in requeued]}")
+            return requeued
+        except Exception as e:
+            logger.error(f"Ошибка возврата заданий в очередь: {e}")
+            return []
+
+    def request_job_control(self, job_id: int, action: str, user_id: int = None,
+                            is_admin: bool = False) -> Optional[str]:
+        """
+        Пауза, возобновление или отмена задания (см. JOB_CONTROL_ACTIONS).
+        Ожидающее или приостановленное задание меняет статус сразу, выполняющемуся (pause, cancel)
+        записывается команда для воркера. Возвращает новый статус, 'running' для отложенной команды
+        или None, если к заданию в его статусе команда неприменима.
+        """
+        immediate_from, new_status = JOB_CONTROL_ACTIONS[action]
+        try:
+            with self.transaction() as conn:
+                cursor = conn.cursor()
+                # Блокировка строки: воркер не захватит задание, пока меняется его статус
+                cursor.execute(
+                    "SELECT status FROM crawl_jobs WHERE id = %s AND (%s OR user_id = %s) FOR UPDATE",
+                    (job_id, is_admin, user_id)
+                )
+                row = cursor.fetchone()
+                if not row:
+                    return None
+                status = row[0]
+
+                if status in immediate_from:
+                    cursor.execute("""
+                        UPDATE crawl_jobs SET status = %s, control = NULL,
+                        finished_at = CASE WHEN %s = ANY(%s) THEN NOW() ELSE finished_at END
+                        WHERE id = %s
+                    """, (new_status, new_status, list(FINISHED_JOB_STATUSES), job_id))
+                    if new_status in FINISHED_JOB_STATUSES:
+                        cursor.execute("DELETE FROM job_checkpoints WHERE job_id = %s", (job_id,))
+                    result = new_status
+                elif status == 'running' and action != 'resume':
+                    cursor.execute("UPDATE crawl_jobs SET control = %s WHERE id = %s", (action, job_id))
+                    result = status
+                else:
+                    return None
+
+            logger.info(f"Команда {action} для задания {job_id} ({status} -> {result})")
+            return result
+        except Exception as e:
+            logger.error(f"Ошибка команды {action} для задания {job_id}: {e}")
+            return None
+
+    def request_job_reextract(self, job_id: int, user_id: int = None, is_admin: bool = False) -> bool:
+        """
+        Постановка завершенного задания в очередь на повторное извлечение из архива ответов.
+        Страницы задания остаются прежними, пока воркер не заменит их результатом.
+        False, если задание не найдено, еще выполняется или архив для него не велся.
+        """
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    UPDATE crawl_jobs
+                    SET status = 'queued', kind = 'reextract', attempts = 0, control = NULL,
+                        worker_id = NULL, finished_at = NULL
+                    WHERE id = %s AND (%s OR user_id = %s) AND archive AND status = ANY(%s)
+                """, (job_id, is_admin, user_id, list(FINISHED_JOB_STATUSES)))
+                queued = cursor.rowcount > 0
+            if queued:
+                logger.info(f"Задание {job_id} поставлено в очередь на повторное извлечение из архива")
+            return queued
+        except Exception as e:
+            logger.error(f"Ошибка постановки задания {job_id} на повторное извлечение: {e}")
+            return False
+
+    def replace_job_pages(self, job_id: int, pages: List[Dict], pages_failed: int = 0) -> Dict[str, int]:
+        """
+        Замена всех страниц и ссылок задания одной транзакцией (повторное извлечение из архива).
+        Строки задания удаляются через DELETE, а не TRUNCATE: TRUNCATE держал бы ACCESS EXCLUSIVE
+        на партициях до фиксации и блокировал чтение страниц задания. Затем словари URL и текстов ссылок,
+        страницы и ссылки вставляются пакетами; до фиксации читатели видят прежние данные задания.
+        Элемент pages: url, title, depth, status_code, crawled_at, metadata, content, links, link_texts,
+        size (байт тела ответа в архиве). Все счетчики задания (JOB_COUNTER_COLUMNS) переписываются:
+        страницы, слова и ссылки пересчитываются по новым партициям, pages_failed - записи архива,
+        которые не удалось разобрать, bytes_downloaded - объем тел страниц в архиве; счетчики кеша
+        обнуляются, так как страницы взяты из архива, а не из сети или кеша.
+        Возвращает новые значения счетчиков задания.
+        """
+        # Задания, созданные до партиционирования без данных, партиций не имеют
+        missing = self.fetch_val(
+            "SELECT bool_or(to_regclass(t || '_j' || %s) IS NULL) FROM unnest(%s::text[]) AS t",
+            (job_id, ['crawled_pages', 'links', 'crawl_urls', 'link_texts'])
+        )
+        if missing:
+            self.execute_query("SELECT create_job_partitions(%s)", (job_id,))
+
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            # Тот же порядок таблиц, что и в drop_job_partitions
+            for table in ('links', 'link_texts', 'crawl_urls', 'crawled_pages'):
+                cursor.execute(f"DELETE FROM {table} WHERE job_id = %s", (job_id,))
+
+            url_ids = self._resolve_dictionary_ids(
+                cursor, 'crawl_urls', job_id,
+                [page['url'] for page in pages] + [link for page in pages for link in page['links']]
+            )
+            text_ids = self._resolve_dictionary_ids(
+                cursor, 'link_texts', job_id, [text for page in pages for text in page['link_texts'].values()]
+            )
+
+            pages_data, links_data = [], []
+            for page in pages:
+                url_id = url_ids[page['url']]
+                pages_data.append((job_id, url_id, page['url'], page['title'], page['depth'], page['crawled_at'],
+                                   page['status_code'], json.dumps(page['metadata'], ensure_ascii=False),
+                                   json.dumps(page['content'], ensure_ascii=False), len(page['links'])))
+                links_data.extend((job_id, url_id, url_ids[link], text_ids.get(page['link_texts'].get(link)))
+                                  for link in page['links'])
+
+            psycopg2.extras.execute_values(cursor, """
+                INSERT INTO crawled_pages
+                (job_id, url_id, url, title, depth, crawled_at, status_code, metadata, content, links_count)
+                VALUES %s
+            """, pages_data, page_size=500)
+            psycopg2.extras.execute_values(cursor, """
+                INSERT INTO links (job_id, from_url_id, to_url_id, text_id)
+                VALUES %s
+            """, links_data, page_size=5000)
+
+            # Пересчет по данным задания, как RECOUNT_JOB_COUNTERS, но только для его партиций
+            cursor.execute(f"""
+                UPDATE crawl_jobs cj
+                SET pages_crawled = p.pages, total_words = p.words, links_found = l.links,
+                    pages_failed = %s, bytes_downloaded = %s,
+                    cache_hits = 0, cache_misses = 0, bytes_from_cache = 0
+                FROM (SELECT COUNT(*) AS pages, COALESCE(SUM(word_count), 0) AS words
+                      FROM crawled_pages WHERE job_id = %s) p,
+                     (SELECT COUNT(*) AS links FROM links WHERE job_id = %s) l
+                WHERE cj.id = %s
+                RETURNING {', '.join(f'cj.{column}' for column in JOB_COUNTER_COLUMNS)}
+            """, (pages_failed, sum(page.get('size', 0) for page in pages), job_id, job_id, job_id))
+            counters = dict(zip(JOB_COUNTER_COLUMNS, cursor.fetchone()))
+
+        logger.info(f"Страницы задания {job_id} заменены: {counters}")
+        return counters
+
+    def get_job_controls(self, job_ids: List[int]) -> Dict[int, Optional[str]]:
+        """Команды управления для заданий воркера; удаленные задания в ответ не попадают"""
+        if not job_ids:
+            return {}
+        try:
+            rows = self.fetch_all("SELECT id, control FROM crawl_jobs WHERE id = ANY(%s)", (list(job_ids),))
+            return {row['id']: row['control'] for row in rows}
+        except Exception as e:
+            logger.error(f"Ошибка получения команд управления заданиями: {e}")
+            # Без ответа БД не трогаем задания, как будто команд нет
+            return dict.fromkeys(job_ids)
+
+    def request_job_profile(self, job_id: int, user_id: int, duration: float) -> Optional[int]:
+        """Запрос профиля выполняющегося задания; None, если задание не выполняется"""
+        try:
+            return self.fetch_val("""
+                INSERT INTO job_profiles (job_id, requested_by, duration)
+                SELECT id, %s, %s FROM crawl_jobs WHERE id = %s AND status = 'running'
+                RETURNING id
+            """, (user_id, duration, job_id))
+        except Exception as e:
+            logger.error(f"Ошибка запроса профиля задания {job_id}: {e}")
+            return None
+
+    def claim_job_profiles(self, job_ids: List[int]) -> List[Dict]:
+        """Захват воркером запрошенных профилей его заданий"""
+        if not job_ids:
+            return []
+        try:
+            return self.fetch_all("""
+                UPDATE job_profiles SET status = 'running'
+                WHERE status = 'requested' AND job_id = ANY(%s)
+                RETURNING id, job_id, duration
+            """, (list(job_ids),))
+        except Exception as e:
+            logger.error(f"Ошибка захвата запросов профилирования: {e}")
+            return []
+
+    def finish_job_profile(self, profile_id: int, samples: int, data: Optional[str], error: str = None):
+        """Сохранение результата профиля (collapsed stacks) или причины неудачи"""
+        try:
+            self.execute_query("""
+                UPDATE job_profiles
+                SET status = %s, samples = %s, data = %s, error = %s, finished_at = NOW()
+                WHERE id = %s
+            """, ('failed' if error else 'done', samples, data, error, profile_id))
+        except Exception as e:
+            logger.error(f"Ошибка сохранения профиля {profile_id}: {e}")
+
+    def get_job_profiles(self, limit: int = 10) -> List[Dict]:
+        """
+        Последние профили без данных. Запрос к заданию, которое завершилось
+        раньше, чем воркер его принял, показывается как неудачный.
+        """
+        try:
+            return self.fetch_all("""
+                SELECT jp.id, jp.job_id, cj.job_name, jp.duration, jp.samples, jp.created_at, jp.finished_at,
+                       CASE WHEN jp.status = 'requested' AND cj.status <> 'running' THEN 'failed'
+                            ELSE jp.status END AS status,
+                       jp.error
+                FROM job_profiles jp
+                JOIN crawl_jobs cj ON cj.id = jp.job_id
+                ORDER BY jp.created_at DESC
+                LIMIT %s
+            """, (limit,))
+        except Exception as e:
+            logger.error(f"Ошибка получения профилей заданий: {e}")
+            return []
+
+    def get_job_profile(self, profile_id: int) -> Optional[Dict]:
+        """Профиль вместе с данными"""
+        try:
+            return self.fetch_one("SELECT * FROM job_profiles WHERE id = %s", (profile_id,))
+        except Exception as e:
+            logger.error(f"Ошибка получения профиля {profile_id}: {e}")
+            return None
+
+    def save_job_checkpoint(self, job_id: int, frontier: List, visited, stats: Dict):
+        """Сохранение контрольной точки обхода: очередь (url, глубина), отпечатки посещенных URL и статистика"""
+        try:
+            self.execute_query("""
+                INSERT INTO job_checkpoints (job_id, frontier, visited, stats, updated_at)
+                VALUES (%s, %s, %s, %s, NOW())
+                ON CONFLICT (job_id) DO UPDATE
+                SET frontier = EXCLUDED.frontier, visited = EXCLUDED.visited,
+                    stats = EXCLUDED.stats, updated_at = NOW()
+            """, (job_id, json.dumps(frontier, ensure_ascii=False),
+                  [psycopg2.Binary(fingerprint) for fingerprint in visited],
+                  json.dumps(stats, default=str)))
+        except Exception as e:
+            logger.error(f"Ошибка сохранения контрольной точки задания {job_id}: {e}")
+
+    def get_job_checkpoint(self, job_id: int) -> Optional[Dict]:
+        """Последняя контрольная точка задания: {'frontier', 'visited' (множество bytes), 'stats'}"""
+        try:
+            row = self.fetch_one(
+                "SELECT frontier, visited, stats, updated_at FROM job_checkpoints WHERE job_id = %s", (job_id,)
+            )
+            if row:
+                row['visited'] = {bytes(fingerprint) for fingerprint in row['visited']}
+            return row
+        except Exception as e:
+            logger.error(f"Ошибка получения контрольной точки задания {job_id}: {e}")
+            return None
+
+    def delete_job_checkpoint(self, job_id: int):
+        """Удаление контрольной точки задания"""
+        try:
+            self.execute_query("DELETE FROM job_checkpoints WHERE job_id = %s", (job_id,))
+        except Exception as e:
+            logger.error(f"Ошибка удаления контрольной точки задания {job_id}: {e}")
+
+    def save_job_timings(self, job_id: int, timings: Dict):
+        """Сохранение гистограмм длительностей этапов задания (см. metrics.StageTimings)"""
+        try:
+            self.execute_query("UPDATE crawl_jobs SET timings = %s WHERE id = %s", (json.dumps(timings), job_id))
+        except Exception as e:
+            logger.error(f"Ошибка сохранения замеров этапов задания {job_id}: {e}")
+
+    def get_job_timings(self, job_id: int) -> Dict:
+        """Сохраненные гистограммы длительностей этапов задания"""
+        try:
+            row = self.fetch_one("SELECT timings FROM crawl_jobs WHERE id = %s", (job_id,))
+            return (row or {}).get('timings') or {}
+        except Exception as e:
+            logger.error(f"Ошибка получения замеров этапов задания {job_id}: {e}")
+            return {}
+
+    def save_page(self, job_id: int, url: str, title: str, depth: int, status_code: int,
+                  metadata: dict, content: dict, bytes_downloaded: int = 0) -> Optional[int]:
+        """
+        Сохранение данных страницы в БД вместе с обновлением счетчиков задания.
+        Возвращает ID страницы или None, если страница с таким URL в задании уже есть.
+        """
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                url_id = self._resolve_dictionary_ids(cursor, 'crawl_urls', job_id, [url])[url]
+                cursor.execute("""
+                    WITH page AS (
+                        INSERT INTO crawled_pages 
+                        (job_id, url_id, url, title, depth, status_code, metadata, content) 
+                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s) 
+                        ON CONFLICT (job_id, url_id) DO NOTHING
+                        RETURNING id
+                    ), counters AS (
+                        UPDATE crawl_jobs
+                        SET pages_crawled = pages_crawled + 1,
+                            total_words = total_words + %s,
+                            bytes_downloaded = bytes_downloaded + %s
+                        WHERE id = %s AND EXISTS (SELECT 1 FROM page)
+                    )
+                    SELECT id FROM page
+                """, (job_id, url_id, url, title, depth, status_code,
                       json.dumps(metadata, ensure_ascii=False),
-                      json.dumps(content, ensure_ascii=False)))
+                      json.dumps(content, ensure_ascii=False),
+                      content.get('word_count', 0), bytes_downloaded, job_id))
 
-                page_id = cursor.fetchone()[0]
-                return page_id
+                row = cursor.fetchone()
+                if not row:
+                    logger.info(f"Страница {url} уже сохранена в задании {job_id}")
+                    return None
+                return row[0]
         except Exception as e:
             logger.error(f"Ошибка сохранения страницы {url}: {e}")
             raise
 
     def save_links(self, job_id: int, page_id: int, links: list, link_texts: dict = None):
-        """Сохранение ссылок со страницы в БД"""
+        """
+        Сохранение ссылок со страницы в БД вместе с обновлением счетчика задания.
+        URL и тексты ссылок заменяются ID из словарей задания, которые разрешаются одним запросом на словарь.
+        """
         if not links:
             return
 
+        link_texts = link_texts or {}
         try:
-            with self.get_connection() as conn:
+            with self.transaction() as conn:
                 cursor = conn.cursor()
 
-                # Подготавливаем данные для вставки
-                insert_data = []
-                for link in links:
-                    link_text = link_texts.get(link, "") if link_texts else ""
-                    insert_data.append((job_id, page_id, link, link_text))
+                cursor.execute(
+                    "UPDATE crawled_pages SET links_count = %s WHERE job_id = %s AND id = %s RETURNING url_id",
+                    (len(links), job_id, page_id)
+                )
+                row = cursor.fetchone()
+                if not row:
+                    logger.warning(f"Страница {page_id} задания {job_id} не найдена, ссылки не сохранены")
+                    return
+                from_url_id = row[0]
+
+                url_ids = self._resolve_dictionary_ids(cursor, 'crawl_urls', job_id, links)
+                text_ids = self._resolve_dictionary_ids(cursor, 'link_texts', job_id, link_texts.values())
 
                 # Выполняем массовую вставку
-                cursor.executemany("""
-                    INSERT INTO links (job_id, from_page_id, to_url, link_text)
-                    VALUES (%s, %s, %s, %s)
+                insert_data = [
+                    (job_id, from_url_id, url_ids[link], text_ids.get(link_texts.get(link)))
+                    for link in links
+                ]
+                psycopg2.extras.execute_values(cursor, """
+                    INSERT INTO links (job_id, from_url_id, to_url_id, text_id)
+                    VALUES %s
                 """, insert_data)
 
+                cursor.execute(
+                    "UPDATE crawl_jobs SET links_found = links_found + %s WHERE id = %s",
+                    (len(insert_data), job_id)
+                )
+
         except Exception as e:
             logger.error(f"Ошибка сохранения ссылок: {e}")
 
-    def get_user_jobs(self, user_id: int) -> List[Dict]:
-        """Получение заданий пользователя"""
+    @staticmethod
+    def _resolve_dictionary_ids(cursor, table: str, job_id: int, values) -> Dict[str, int]:
+        """
+        Получение ID значений из словаря задания (crawl_urls или link_texts) с добавлением недостающих.
+        Значения сортируются, чтобы параллельные вставки брали блокировки в одном порядке.
+        """
+        id_column, value_column = DICTIONARY_TABLES[table]
+        values = sorted({value for value in values if value})
+        if not values:
+            return {}
+
+        cursor.execute(f"""
+            INSERT INTO {table} (job_id, {value_column})
+            SELECT %s, v FROM unnest(%s::text[]) AS v
+            ON CONFLICT (job_id, fingerprint) DO NOTHING
+        """, (job_id, values))
+        cursor.execute(f"""
+            SELECT {value_column}, {id_column} FROM {table}
+            WHERE job_id = %s
+              AND fingerprint = ANY(ARRAY(SELECT decode(md5(v), 'hex') FROM unnest(%s::text[]) AS v))
+        """, (job_id, values))
+        return dict(cursor.fetchall())
+
+    def increment_job_counters(self, job_id: int, **deltas):
+        """Увеличение счетчиков задания (например, pages_failed) на заданные значения"""
+        deltas = {name: value for name, value in deltas.items() if value}
+        unknown = set(deltas) - set(JOB_COUNTER_COLUMNS)
+        if unknown:
+            raise ValueError(f"Неизвестные счетчики задания: {', '.join(sorted(unknown))}")
+        if not deltas:
+            return
+
+        assignments = ', '.join(f"{name} = {name} + %s" for name in deltas)
         try:
-            return self.fetch_all("""
-                SELECT id, job_name, start_url, max_pages, max_depth, delay, 
-                       status, created_at, started_at, finished_at
-                FROM crawl_jobs 
-                WHERE user_id = %s 
-                ORDER BY created_at DESC
-            """, (user_id,))
-        except Exception as e:
-            logger.error(f"Ошибка получения заданий пользователя: {e}")
-            return []
+            self.execute_query(
+                f"UPDATE crawl_jobs SET {assignments} WHERE id = %s",
+                (*deltas.values(), job_id)
+            )
+        except Exception as e:
+            logger.error(f"Ошибка обновления счетчиков задания {job_id}: {e}")
+
+    def get_jobs_page(self, user_id: int = None, cursor: str = None, limit: int = DEFAULT_PAGE_SIZE,
+                      status: str = None, sort: str = 'created_at', order: str = 'desc',
+                      created_from: str = None, created_to: str = None,
+                      max_depth: int = None) -> Tuple[List[Dict], Optional[str]]:
+        """
+        Получение страницы заданий с курсорной (keyset) пагинацией.
+
+        Args:
+            user_id: Владелец заданий (None - задания всех пользователей)
+            cursor: Курсор, полученный вместе с предыдущей страницей
+            limit: Размер страницы
+            status: Фильтр по статусу
+            sort: Ключ сортировки из JOB_SORT_COLUMNS
+            order: Направление сортировки ('asc' или 'desc')
+            created_from: Нижняя граница даты создания (включительно)
+            created_to: Верхняя граница даты создания (не включительно)
+            max_depth: Фильтр по максимальной глубине
+
+        Returns:
+            Список заданий и курсор следующей страницы (или None)
+        """
+        sort_column = JOB_SORT_COLUMNS.get(sort, JOB_SORT_COLUMNS['created_at'])
+        descending = order != 'asc'
+        limit = clamp_page_size(limit)
+
+        conditions = []
+        params = []
+        if user_id is not None:
+            conditions.append("cj.user_id = %s")
+            params.append(user_id)
+        if status:
+            conditions.append("cj.status = %s")
+            params.append(status)
+        if created_from:
+            conditions.append("cj.created_at >= %s")
+            params.append(created_from)
+        if created_to:
+            conditions.append("cj.created_at < %s")
+            params.append(created_to)
+        if max_depth is not None:
+            conditions.append("cj.max_depth = %s")
+            params.append(max_depth)
+
+        after = decode_cursor(cursor)
+        if after:
+            conditions.append(f"({sort_column}, cj.id) {'<' if descending else '>'} (%s, %s)")
+            params.extend(after)
+
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        direction = 'DESC' if descending else 'ASC'
 
-    def get_all_jobs(self) -> List[Dict]:
-        """Получение всех заданий (для админа)"""
         try:
-            return self.fetch_all("""
+            jobs = self.fetch_all(f"""
                 SELECT cj.id, cj.job_name, cj.start_url, cj.max_pages, cj.max_depth, 
                        cj.delay, cj.status, cj.created_at, cj.started_at, cj.finished_at,
-                       u.username
+                       cj.pages_crawled, cj.pages_failed, cj.links_found, cj.total_words,
+                       cj.bytes_downloaded, u.username
                 FROM crawl_jobs cj
                 JOIN users u ON cj.user_id = u.id
-                ORDER BY cj.created_at DESC
-            """)
+                {where}
+                ORDER BY {sort_column} {direction}, cj.id {direction}
+                LIMIT %s
+            """, (*params, limit + 1))
+
+            next_cursor = None
+            if len(jobs) > limit:
+                jobs = jobs[:limit]
+                sort_key = sort if sort in JOB_SORT_COLUMNS else 'created_at'
+                next_cursor = encode_cursor((jobs[-1][sort_key], jobs[-1]['id']))
+            return jobs, next_cursor
+        except Exception as e:
+            logger.error(f"Ошибка получения списка заданий: {e}")
+            return [], None
+
+    def get_user_jobs(self, user_id: int, **kwargs) -> Tuple[List[Dict], Optional[str]]:
+        """Получение страницы заданий пользователя (параметры - как у get_jobs_page)"""
+        return self.get_jobs_page(user_id=user_id, **kwargs)
+
+    def get_all_jobs(self, **kwargs) -> Tuple[List[Dict], Optional[str]]:
+        """Получение страницы всех заданий (для админа, параметры - как у get_jobs_page)"""
+        return self.get_jobs_page(user_id=None, **kwargs)
+
+    def get_job_status_counts(self, user_id: int = None) -> Dict[str, int]:
+        """Количество заданий по статусам и общее количество"""
+        try:
+            if user_id is not None:
+                rows = self.fetch_all(
+                    "SELECT status, COUNT(*) AS count FROM crawl_jobs WHERE user_id = %s GROUP BY status",
+                    (user_id,)
+                )
+            else:
+                rows = self.fetch_all("SELECT status, COUNT(*) AS count FROM crawl_jobs GROUP BY status")
+            counts = {row['status']: row['count'] for row in rows}
+            counts['total'] = sum(counts.values())
+            return counts
+        except Exception as e:
+            logger.error(f"Ошибка подсчета заданий: {e}")
+            return {'total': 0}
+
+    def get_top_users_by_jobs(self, limit: int = 5) -> List[Dict]:
+        """Пользователи с наибольшим количеством заданий"""
+        try:
+            return self.fetch_all("""
+                SELECT u.username, t.jobs_count
+                FROM (
+                    SELECT user_id, COUNT(*) AS jobs_count
+                    FROM crawl_jobs
+                    GROUP BY user_id
+                    ORDER BY jobs_count DESC
+                    LIMIT %s
+                ) t
+                JOIN users u ON u.id = t.user_id
+                ORDER BY t.jobs_count DESC
+            """, (limit,))
+        except Exception as e:
+            logger.error(f"Ошибка получения активных пользователей: {e}")
+            return []
+
+    # Прогресс выполнения заданий (общий для всех процессов)
+    def save_job_progress(self, job_id: int, snapshot: dict):
+        """
+        Сохранение последнего снимка прогресса задания. Версия растет с каждой записью независимо
+        от того, какой процесс пишет (воркер, веб-процесс), поэтому ожидающие потоки видят любой новый снимок.
+        """
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    INSERT INTO job_progress (job_id, version, snapshot, updated_at)
+                    VALUES (%s, 1, %s, NOW())
+                    ON CONFLICT (job_id) DO UPDATE
+                    SET version = job_progress.version + 1, snapshot = EXCLUDED.snapshot, updated_at = NOW()
+                """, (job_id, json.dumps(snapshot, ensure_ascii=False, default=str)))
+        except Exception as e:
+            logger.error(f"Ошибка сохранения прогресса задания {job_id}: {e}")
+
+    def publish_queue_positions(self) -> int:
+        """
+        Позиция каждого ожидающего задания в очереди (в порядке выдачи воркерам, как в claim_jobs)
+        в его снимке прогресса. Одним запросом; переписываются только снимки, в которых позиция
+        изменилась, поэтому повторные вызовы из разных воркеров ничего не пишут. Возвращает число снимков.
+        """
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(f"""
+                    WITH positions AS (
+                        SELECT cj.id, cj.kind, cj.created_at,
+                               row_number() OVER (ORDER BY q.turn, cj.created_at, cj.id) AS position
+                        FROM crawl_jobs cj
+                        JOIN ({queued_jobs_order()}) q ON q.id = cj.id
+                    )
+                    INSERT INTO job_progress (job_id, version, snapshot, updated_at)
+                    SELECT p.id, 1, jsonb_build_object(
+                        'active', true,
+                        'job_id', p.id,
+                        'status', 'queued',
+                        'progress', 0,
+                        'message', CASE WHEN p.kind = 'reextract'
+                                        THEN 'Задание в очереди на повторное извлечение, позиция '
+                                        ELSE 'Задание в очереди, позиция ' END || p.position,
+                        'updated_at', to_char(NOW(), 'HH24:MI:SS'),
+                        'queue_position', p.position,
+                        'queue_wait', floor(extract(epoch FROM NOW() - p.created_at))::int
+                    ), NOW()
+                    FROM positions p
+                    LEFT JOIN job_progress jp ON jp.job_id = p.id
+                    WHERE (jp.snapshot ->> 'queue_position')::bigint IS DISTINCT FROM p.position
+                    ON CONFLICT (job_id) DO UPDATE
+                    SET version = job_progress.version + 1, snapshot = EXCLUDED.snapshot, updated_at = NOW()
+                """)
+                return cursor.rowcount
+        except Exception as e:
+            logger.error(f"Ошибка публикации позиций в очереди: {e}")
+            return 0
+
+    def get_job_progress(self, job_id: int) -> Optional[Dict]:
+        """Последний снимок прогресса задания: {'version', 'snapshot'}"""
+        try:
+            return self.fetch_one(
+                "SELECT version, snapshot FROM job_progress WHERE job_id = %s", (job_id,)
+            )
+        except Exception as e:
+            logger.error(f"Ошибка получения прогресса задания {job_id}: {e}")
+            return None
+
+    def get_progress_snapshots(self, job_ids: List[int]) -> Optional[Dict[int, Dict]]:
+        """
+        Снимки прогресса нескольких заданий одним запросом: {job_id: {'version', 'snapshot'}}.
+        Задания без снимка в результат не попадают; None - ошибка запроса.
+        """
+        try:
+            rows = self.fetch_all(
+                "SELECT job_id, version, snapshot FROM job_progress WHERE job_id = ANY(%s)", (list(job_ids),)
+            )
+            return {row['job_id']: row for row in rows}
         except Exception as e:
-            logger.error(f"Ошибка получения всех заданий: {e}")
+            logger.error(f"Ошибка получения прогресса заданий: {e}")
+            return None
+
+    def get_jobs_progress(self, job_ids: List[int] = None, user_id: int = None) -> List[Dict]:
+        """
+        Статус, счетчики и последний снимок прогресса нескольких заданий одним запросом.
+        Без job_ids возвращаются все выполняющиеся задания (пользователя user_id или всех для None).
+        """
+        conditions = []
+        params = []
+        if job_ids is not None:
+            conditions.append("cj.id = ANY(%s)")
+            params.append(list(job_ids))
+        else:
+            conditions.append("cj.status IN ('running', 'queued')")
+        if user_id is not None:
+            conditions.append("cj.user_id = %s")
+            params.append(user_id)
+
+        try:
+            return self.fetch_all(f"""
+                SELECT cj.id, cj.status, cj.pages_crawled, jp.snapshot
+                FROM crawl_jobs cj
+                LEFT JOIN job_progress jp ON jp.job_id = cj.id
+                WHERE {' AND '.join(conditions)}
+                ORDER BY cj.id
+            """, tuple(params))
+        except Exception as e:
+            logger.error(f"Ошибка получения прогресса заданий: {e}")
             return []
 
+    def delete_job_progress(self, job_id: int):
+        """Удаление снимка прогресса задания"""
+        try:
+            self.execute_query("DELETE FROM job_progress WHERE job_id = %s", (job_id,))
+        except Exception as e:
+            logger.error(f"Ошибка удаления прогресса задания {job_id}: {e}")
+
     def get_job_details(self, job_id: int, user_id: int = None, is_admin: bool = False) -> Optional[Dict]:
-        """Получение деталей задания"""
+        """Получение деталей задания (счетчики берутся из crawl_jobs, без подсчета страниц)"""
         try:
             if is_admin:
                 return self.fetch_one("""
-                    SELECT cj.*, u.username,
-                           COUNT(cp.id) as pages_crawled
+                    SELECT cj.*, u.username
                     FROM crawl_jobs cj
                     JOIN users u ON cj.user_id = u.id
-                    LEFT JOIN crawled_pages cp ON cj.id = cp.job_id
                     WHERE cj.id = %s
-                    GROUP BY cj.id, u.username
                 """, (job_id,))
             else:
                 return self.fetch_one("""
-                    SELECT cj.*,
-                           COUNT(cp.id) as pages_crawled
+                    SELECT cj.*
                     FROM crawl_jobs cj
-                    LEFT JOIN crawled_pages cp ON cj.id = cp.job_id
                     WHERE cj.id = %s AND cj.user_id = %s
-                    GROUP BY cj.id
                 """, (job_id, user_id))
         except Exception as e:
             logger.error(f"Ошибка получения деталей задания: {e}")
             return None
 
-    def get_job_pages(self, job_id: int, user_id: int = None, is_admin: bool = False) -> List[Dict]:
-        """Получение страниц задания"""
+    def get_job_pages(self, job_id: int, user_id: int = None, is_admin: bool = False,
+                      cursor: str = None, limit: int = DEFAULT_PAGE_SIZE) -> Tuple[List[Dict], Optional[str]]:
+        """
+        Получение страницы собранных страниц задания (от новых к старым) и курсора следующей.
+        Выбираются только скалярные колонки; metadata и content загружаются через get_page_details.
+        """
         try:
             if not is_admin:
                 # Проверяем, что задание принадлежит пользователю
                 if not self.fetch_val("SELECT id FROM crawl_jobs WHERE id = %s AND user_id = %s", (job_id, user_id)):
-                    return []
+                    return [], None
+
+            limit = clamp_page_size(limit)
+            after = decode_cursor(cursor)
+            if after:
+                pages = self.fetch_all("""
+                    SELECT id, url, title, depth, status_code, crawled_at, word_count, links_count
+                    FROM crawled_pages 
+                    WHERE job_id = %s AND (crawled_at, id) < (%s, %s)
+                    ORDER BY crawled_at DESC, id DESC
+                    LIMIT %s
+                """, (job_id, after[0], after[1], limit + 1))
+            else:
+                pages = self.fetch_all("""
+                    SELECT id, url, title, depth, status_code, crawled_at, word_count, links_count
+                    FROM crawled_pages 
+                    WHERE job_id = %s 
+                    ORDER BY crawled_at DESC, id DESC
+                    LIMIT %s
+                """, (job_id, limit + 1))
 
-            pages = self.fetch_all("""
-                SELECT id, url, title, depth, status_code, crawled_at, metadata, content
-                FROM crawled_pages 
-                WHERE job_id = %s 
-                ORDER BY crawled_at DESC
-                LIMIT 100
-            """, (job_id,))
+            next_cursor = None
+            if len(pages) > limit:
+                pages = pages[:limit]
+                next_cursor = encode_cursor((pages[-1]['crawled_at'], pages[-1]['id']))
 
-            # Обрабатываем данные для отображения
-            processed_pages = []
-            for page in pages:
-                try:
-                    # Извлекаем word_count и links_count из content
-                    if isinstance(page['content'], str):
-                        content = json.loads(page['content']) if page['content'] else {}
-                    elif isinstance(page['content'], dict):
-                        content = page['content']
-                    else:
-                        content = {}
+            return pages, next_cursor
 
-                    # Подсчитываем количество ссылок для этой страницы
-                    links_count = self.fetch_val("""
-                        SELECT COUNT(*) FROM links WHERE job_id = %s AND from_page_id = %s
-                    """, (job_id, page['id'])) or 0
+        except Exception as e:
+            logger.error(f"Ошибка получения страниц задания: {e}")
+            return [], None
 
-                    processed_page = dict(page)
-                    processed_page['word_count'] = content.get('word_count', 0)
-                    processed_page['links_count'] = links_count
-                    processed_pages.append(processed_page)
+    def get_page_details(self, job_id: int, page_id: int, user_id: int = None, is_admin: bool = False,
+                         links_limit: int = 100) -> Optional[Dict]:
+        """Получение полного содержимого одной страницы задания (метаданные, контент, ссылки)"""
+        try:
+            if is_admin:
+                page = self.fetch_one("""
+                    SELECT id, url_id, url, title, depth, status_code, crawled_at, metadata, content, links_count
+                    FROM crawled_pages
+                    WHERE job_id = %s AND id = %s
+                """, (job_id, page_id))
+            else:
+                page = self.fetch_one("""
+                    SELECT cp.id, cp.url_id, cp.url, cp.title, cp.depth, cp.status_code, cp.crawled_at,
+                           cp.metadata, cp.content, cp.links_count
+                    FROM crawled_pages cp
+                    JOIN crawl_jobs cj ON cj.id = cp.job_id
+                    WHERE cp.job_id = %s AND cp.id = %s AND cj.user_id = %s
+                """, (job_id, page_id, user_id))
+
+            if not page:
+                return None
 
-                except (json.JSONDecodeError, TypeError) as e:
-                    logger.error(f"Ошибка обработки данных страницы {page['id']}: {e}")
-                    # Добавляем страницу с базовыми данными
-                    processed_page = dict(page)
-                    processed_page['word_count'] = 0
-                    processed_page['links_count'] = 0
-                    processed_pages.append(processed_page)
+            for field in ('metadata', 'content'):
+                if isinstance(page[field], str):
+                    page[field] = json.loads(page[field]) if page[field] else {}
+                elif not isinstance(page[field], dict):
+                    page[field] = {}
 
-            return processed_pages
+            page['links'] = self.fetch_all("""
+                SELECT u.url, COALESCE(t.text, '') AS text
+                FROM links l
+                JOIN crawl_urls u ON u.job_id = l.job_id AND u.url_id = l.to_url_id
+                LEFT JOIN link_texts t ON t.job_id = l.job_id AND t.text_id = l.text_id
+                WHERE l.job_id = %s AND l.from_url_id = %s
+                ORDER BY l.id
+                LIMIT %s
+            """, (job_id, page.pop('url_id'), links_limit))
+            return page
 
         except Exception as e:
-            logger.error(f"Ошибка получения страниц задания: {e}")
-            return []
+            logger.error(f"Ошибка получения страницы {page_id} задания {job_id}: {e}")
+            return None
 
     def get_job_export_data(self, job_id: int, user_id: int = None, is_admin: bool = False) -> Optional[Dict]:
         """Получение полных данных задания для экспорта"""
@@ -441,6 +2134,7 @@ class DatabaseManager:
             pages = self.fetch_all("""
                 SELECT 
                     id,
+                    url_id,
                     url,
                     title,
                     depth,
@@ -453,6 +2147,19 @@ class DatabaseManager:
                 ORDER BY crawled_at ASC
             """, (job_id,))
 
+            # Все ссылки задания одним запросом, сгруппированные по ID адреса страницы-источника
+            job_links = self.fetch_all("""
+                SELECT l.from_url_id, u.url AS to_url, COALESCE(t.text, '') AS link_text
+                FROM links l
+                JOIN crawl_urls u ON u.job_id = l.job_id AND u.url_id = l.to_url_id
+                LEFT JOIN link_texts t ON t.job_id = l.job_id AND t.text_id = l.text_id
+                WHERE l.job_id = %s
+                ORDER BY l.id
+            """, (job_id,))
+            links_by_page = {}
+            for link in job_links:
+                links_by_page.setdefault(link['from_url_id'], []).append(link)
+
             # Обрабатываем данные страниц
             processed_pages = []
             for page in pages:
@@ -472,13 +2179,7 @@ class DatabaseManager:
                     else:
                         content = {}
 
-                    # Получаем ссылки для этой страницы
-                    page_links = self.fetch_all("""
-                        SELECT to_url, link_text
-                        FROM links 
-                        WHERE job_id = %s AND from_page_id = %s
-                        ORDER BY id
-                    """, (job_id, page['id']))
+                    page_links = links_by_page.get(page['url_id'], [])
 
                     # Конвертируем datetime в строку
                     crawled_at_str = None
@@ -536,23 +2237,22 @@ class DatabaseManager:
                         "error": f"Ошибка обработки данных: {str(e)}"
                     })
 
-            # Получаем все ссылки задания (общий граф)
-            all_links = self.fetch_all("""
-                SELECT 
-                    cp.url as from_url,
-                    l.to_url,
-                    l.link_text,
-                    cp.depth as from_depth
-                FROM links l
-                JOIN crawled_pages cp ON l.from_page_id = cp.id
-                WHERE l.job_id = %s
-                ORDER BY cp.depth, cp.url, l.to_url
-            """, (job_id,))
+            # Общий граф ссылок задания: по глубине страницы-источника, затем в порядке обхода
+            all_links = [
+                {
+                    "from_url": page['url'],
+                    "to_url": link['to_url'],
+                    "link_text": link['link_text'],
+                    "from_depth": page['depth']
+                }
+                for page in sorted(pages, key=lambda p: p['depth'])
+                for link in links_by_page.get(page['url_id'], [])
+            ]
 
             return {
                 "job": job_data,  # Используем обработанные данные с конвертированными datetime
                 "pages": processed_pages,
-                "links": [dict(link) for link in all_links]
+                "links": all_links
             }
 
         except Exception as e:
@@ -574,6 +2274,7 @@ class DatabaseManager:
                     "UPDATE users SET role = %s WHERE id = %s",
                     (new_role, user_id)
                 )
+                self.invalidate_user_cache(user_id)
 
                 if cursor.rowcount > 0:
                     logger.info(f"Роль пользователя {user_id} изменена на {new_role}")
@@ -587,43 +2288,111 @@ class DatabaseManager:
             return False
 
     def delete_job(self, job_id: int, user_id: int = None, is_admin: bool = False) -> bool:
-        """Удаление задания и всех связанных данных"""
+        """
+        Удаление задания и всех связанных данных.
+        Страницы и ссылки удаляются сбросом партиций задания, поэтому время не зависит от их объема;
+        партиции сначала отсоединяются, не блокируя страницы других заданий.
+        Выполняющееся задание не удаляется (False): его нужно сначала отменить.
+        """
         try:
-            with self.get_connection() as conn:
+            with self.transaction() as conn:
                 cursor = conn.cursor()
+                cursor.execute("SELECT user_id, status FROM crawl_jobs WHERE id = %s FOR UPDATE", (job_id,))
+                job = cursor.fetchone()
+                if not job:
+                    logger.warning(f"Задание {job_id} не найдено для удаления")
+                    return False
 
                 # Проверяем права доступа
-                if not is_admin and user_id:
-                    cursor.execute("SELECT user_id FROM crawl_jobs WHERE id = %s", (job_id,))
-                    job_owner = cursor.fetchone()
-                    if not job_owner or job_owner[0] != user_id:
-                        logger.warning(f"Попытка удаления чужого задания {job_id} пользователем {user_id}")
-                        return False
-
-                # Удаляем связанные данные в правильном порядке (из-за внешних ключей)
+                if not is_admin and user_id and job[0] != user_id:
+                    logger.warning(f"Попытка удаления чужого задания {job_id} пользователем {user_id}")
+                    return False
 
-                # 1. Удаляем ссылки
-                cursor.execute("DELETE FROM links WHERE job_id = %s", (job_id,))
-                links_deleted = cursor.rowcount
+                if job[1] == 'running':
+                    logger.warning(f"Задание {job_id} выполняется, удаление отклонено")
+                    return False
 
-                # 2. Удаляем страницы
-                cursor.execute("DELETE FROM crawled_pages WHERE job_id = %s", (job_id,))
-                pages_deleted = cursor.rowcount
+                self._drop_locked_jobs(cursor, [job_id])
 
-                # 3. Удаляем само задание
-                cursor.execute("DELETE FROM crawl_jobs WHERE id = %s", (job_id,))
-                job_deleted = cursor.rowcount
-
-                if job_deleted > 0:
-                    logger.info(f"Удалено задание {job_id}: {pages_deleted} страниц, {links_deleted} ссылок")
-                    return True
-                else:
-                    logger.warning(f"Задание {job_id} не найдено для удаления")
-                    return False
+            logger.info(f"Удалено задание {job_id}")
+            return True
 
         except Exception as e:
             logger.error(f"Ошибка удаления задания {job_id}: {e}")
             return False
 
+    def expire_old_jobs(self, retention_days: int, batch_size: int = 50) -> List[int]:
+        """
+        Удаление заданий, завершенных раньше чем retention_days дней назад.
+        Выполняется под advisory-блокировкой, чтобы воркеры разных процессов не делали это одновременно.
+        Возвращает ID удаленных заданий.
+        """
+        if retention_days <= 0:
+            return []
+
+        expired = []
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT pg_try_advisory_lock(%s)", (RETENTION_LOCK_KEY,))
+                if not cursor.fetchone()[0]:
+                    return []
+                try:
+                    cursor.execute("""
+                        SELECT id FROM crawl_jobs
+                        WHERE status = ANY(%s)
+                          AND finished_at < NOW() - make_interval(days => %s)
+                        ORDER BY finished_at
+                        LIMIT %s
+                    """, (list(FINISHED_JOB_STATUSES), retention_days, batch_size))
+                    job_ids = [row[0] for row in cursor.fetchall()]
+
+                    for job_id in job_ids:
+                        try:
+                            with self.transaction() as job_conn:
+                                job_cursor = job_conn.cursor()
+                                # Задание могли успеть поставить на повторное извлечение
+                                job_cursor.execute(
+                                    "SELECT 1 FROM crawl_jobs WHERE id = %s AND status = ANY(%s) FOR UPDATE SKIP LOCKED",
+                                    (job_id, list(FINISHED_JOB_STATUSES))
+                                )
+                                if not job_cursor.fetchone():
+                                    continue
+                                self._drop_locked_jobs(job_cursor, [job_id])
+                            expired.append(job_id)
+                        except Exception as e:
+                            logger.error(f"Ошибка удаления устаревшего задания {job_id}: {e}")
+                finally:
+                    cursor.execute("SELECT pg_advisory_unlock(%s)", (RETENTION_LOCK_KEY,))
+        except Exception as e:
+            logger.error(f"Ошибка очистки устаревших заданий: {e}")
+
+        if expired:
+            logger.info(f"Удалены устаревшие задания: {expired}")
+        return expired
+
 # Глобальный экземпляр менеджера базы данных
-db_manager = DatabaseManager()
\ No newline at end of file
+db_manager = DatabaseManager()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Управление схемой базы данных краулера")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("migrate", help="Применить недостающие миграции схемы")
+    check_parser = subparsers.add_parser("check-plans", help="Проверить планы горячих запросов через EXPLAIN")
+    check_parser.add_argument("--no-seed", action="store_true",
+                              help="Проверять на текущих данных без временного наполнения базы")
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        applied = db_manager.migrate()
+        print(f"Версия схемы: {db_manager.get_schema_version()}"
+              + (f", применены миграции: {applied}" if applied else ", изменений нет"))
+    else:
+        failed = False
+        for result in db_manager.check_query_plans(seed=not args.no_seed):
+            failed = failed or not result['ok']
+            print(f"[{'OK' if result['ok'] else 'SEQ SCAN'}] {result['query']}: {' -> '.join(result['nodes'])}")
+        raise SystemExit(1 if failed else 0)
\ No newline at end of file
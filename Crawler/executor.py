@@ -0,0 +1,330 @@
+import asyncio
+import inspect
+import logging
+import threading
+import time
+import traceback
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Callable, Dict, List, Optional
+
+from http_client import JOB_HTTP_COUNTERS, SharedHttpClient
+from loop_watchdog import LoopWatchdog
+from metrics import REGISTRY
+from profiler import SamplingProfiler
+
+logger = logging.getLogger(__name__)
+
+
+class WeightedRoundRobin:
+    """
+    Очереди элементов по ключам (пользователям), из которых элементы выбираются
+    по взвешенному round-robin: ключ с весом w отдает до w элементов подряд, затем ход переходит дальше.
+    """
+
+    def __init__(self):
+        self._queues: OrderedDict = OrderedDict()
+        self._weights: Dict = {}
+        self._credit: Dict = {}
+
+    def __len__(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def push(self, key, item, weight: int = 1):
+        """Добавление элемента в очередь ключа"""
+        self._weights[key] = max(1, weight)
+        self._queues.setdefault(key, deque()).append(item)
+
+    def pop(self):
+        """Следующий элемент по очереди ключей; IndexError, если очереди пусты"""
+        if not self._queues:
+            raise IndexError('pop from empty WeightedRoundRobin')
+        key, queue = next(iter(self._queues.items()))
+        item = queue.popleft()
+        credit = self._credit.get(key, self._weights[key]) - 1
+
+        if not queue:
+            del self._queues[key]
+            self._credit.pop(key, None)
+        elif credit <= 0:
+            self._queues.move_to_end(key)
+            self._credit.pop(key, None)
+        else:
+            self._credit[key] = credit
+        return item
+
+    def remove(self, item) -> bool:
+        """Удаление элемента из очереди его ключа"""
+        for key, queue in self._queues.items():
+            if item in queue:
+                queue.remove(item)
+                if not queue:
+                    del self._queues[key]
+                    self._credit.pop(key, None)
+                return True
+        return False
+
+
+class FairFetchScheduler:
+    """
+    Ограничение числа одновременных загрузок страниц в одном цикле событий.
+    Освободившиеся слоты раздаются по взвешенному round-robin между пользователями,
+    поэтому большое задание одного пользователя не вытесняет задания остальных.
+    """
+
+    def __init__(self, slots: int):
+        self.slots = slots
+        self.in_use = 0
+        self._waiters = WeightedRoundRobin()
+
+    async def acquire(self, user_id: int, weight: int = 1):
+        if self.in_use < self.slots and not len(self._waiters):
+            self.in_use += 1
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.push(user_id, waiter, weight)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Слот успели выдать - возвращаем его
+                self.release()
+            else:
+                self._waiters.remove(waiter)
+            raise
+
+    def release(self):
+        self.in_use -= 1
+        while self.in_use < self.slots and len(self._waiters):
+            waiter = self._waiters.pop()
+            if not waiter.done():
+                self.in_use += 1
+                waiter.set_result(None)
+
+    @asynccontextmanager
+    async def slot(self, user_id: int, weight: int = 1):
+        await self.acquire(user_id, weight)
+        try:
+            yield
+        finally:
+            self.release()
+
+
+class CrawlExecutor:
+    """
+    Общий исполнитель заданий краулинга: несколько долгоживущих циклов событий в своих потоках,
+    ограниченная очередь ожидающих заданий и предел одновременно выполняемых.
+    Ожидающие задания запускаются по взвешенному round-robin между пользователями
+    (воркер захватывает не больше заданий, чем свободных мест, так что очередь здесь обычно пуста;
+    позиции в общей очереди crawl_jobs публикует DatabaseManager.publish_queue_positions).
+    Задания одного цикла используют общую HTTP-сессию (пул соединений и кеш DNS), см. SharedHttpClient;
+    задержку каждого цикла замеряет LoopWatchdog.
+    """
+
+    def __init__(self, progress, max_concurrent_jobs: int = 4, queue_size: int = 100,
+                 loops: int = 1, fetch_slots: int = 10, http_options: Dict = None,
+                 lag_interval: float = 0.1, stall_threshold: float = 0.5):
+        self.progress = progress
+        self.max_concurrent_jobs = max_concurrent_jobs
+        self.queue_size = queue_size
+        self.loop_count = max(1, loops)
+        self.fetch_slots = fetch_slots
+        self.http_options = http_options or {}
+        self.lag_interval = lag_interval
+        self.stall_threshold = stall_threshold
+
+        self._lock = threading.Lock()
+        self._pending = WeightedRoundRobin()
+        self._entries: Dict[int, Dict] = {}
+        self._running: Dict[int, int] = {}
+        self._futures: Dict[int, object] = {}
+        self._loops: List[Dict] = []
+
+    def start(self):
+        """Запуск потоков с циклами событий"""
+        for index in range(self.loop_count):
+            ready = threading.Event()
+            slot = {'loop': None, 'thread_id': None, 'scheduler': None, 'http': None, 'watchdog': None, 'jobs': 0}
+
+            def run(slot=slot, ready=ready, name=f"CrawlLoop-{index}"):
+                loop = asyncio.new_event_loop()
+                asyncio.set_event_loop(loop)
+                slot['loop'] = loop
+                slot['thread_id'] = threading.get_ident()
+                slot['scheduler'] = FairFetchScheduler(self.fetch_slots)
+                slot['http'] = loop.run_until_complete(self._create_http_client())
+                slot['watchdog'] = LoopWatchdog(name, self.lag_interval, self.stall_threshold)
+                slot['watchdog'].start(loop)
+                ready.set()
+                loop.run_forever()
+
+            thread = threading.Thread(target=run, name=f"CrawlLoop-{index}", daemon=True)
+            thread.start()
+            ready.wait()
+            self._loops.append(slot)
+        REGISTRY.describe('crawler_executor_jobs', 'gauge', 'Задания исполнителя: выполняющиеся и ожидающие')
+        for counter in JOB_HTTP_COUNTERS:
+            REGISTRY.describe(f'crawler_http_{counter}_total', 'counter', f'HTTP-клиент исполнителя: {counter}')
+        REGISTRY.add_collector(self.collect_metrics)
+        logger.info(f"Исполнитель заданий запущен: циклов {self.loop_count}, "
+                    f"одновременных заданий {self.max_concurrent_jobs}, очередь {self.queue_size}")
+
+    async def _create_http_client(self) -> SharedHttpClient:
+        # aiohttp требует создавать сессию внутри цикла событий, которому она принадлежит
+        return SharedHttpClient(**self.http_options)
+
+    def submit(self, crawler, weight: int = 1) -> bool:
+        """Постановка задания в очередь; False, если очередь заполнена"""
+        with self._lock:
+            if len(self._pending) >= self.queue_size:
+                logger.warning(f"Очередь заданий заполнена, задание {crawler.job_id} отклонено")
+                return False
+            self._entries[crawler.job_id] = {
+                'crawler': crawler,
+                'weight': weight,
+                'enqueued_at': time.time()
+            }
+            self._pending.push(crawler.user_id, crawler.job_id, weight)
+
+        self._dispatch()
+        return True
+
+    def stats(self) -> Dict:
+        """Текущая загрузка исполнителя"""
+        with self._lock:
+            return {
+                'running': len(self._running),
+                'queued': len(self._pending),
+                'max_concurrent_jobs': self.max_concurrent_jobs,
+                'queue_size': self.queue_size,
+                'http': [dict(slot['http'].totals) for slot in self._loops],
+                'loop_lag_ms': [slot['watchdog'].summary() for slot in self._loops]
+            }
+
+    def collect_metrics(self) -> List:
+        """Сборщик метрик исполнителя для REGISTRY"""
+        stats = self.stats()
+        samples = [
+            ('crawler_executor_jobs', {'state': 'running'}, stats['running']),
+            ('crawler_executor_jobs', {'state': 'queued'}, stats['queued']),
+        ]
+        for counter in JOB_HTTP_COUNTERS:
+            samples.append((f'crawler_http_{counter}_total', {}, sum(totals[counter] for totals in stats['http'])))
+        return samples
+
+    def free_slots(self) -> int:
+        """Сколько еще заданий можно принять, не ставя их в очередь ожидания"""
+        with self._lock:
+            return max(0, self.max_concurrent_jobs - len(self._running) - len(self._pending))
+
+    def active_jobs(self) -> List[int]:
+        """ID выполняющихся и ожидающих заданий"""
+        with self._lock:
+            return list(self._entries)
+
+    def cancel(self, job_id: int) -> bool:
+        """Отмена задания: ожидающее удаляется из очереди, у выполняющегося отменяется корутина"""
+        with self._lock:
+            if self._pending.remove(job_id):
+                self._entries.pop(job_id, None)
+                return True
+            future = self._futures.get(job_id)
+        if future is None:
+            return False
+        future.cancel()
+        return True
+
+    def request_stop(self, job_id: int, action: str, reason: str = None) -> bool:
+        """
+        Кооперативная остановка выполняющегося задания ('pause' или 'cancel').
+        Ожидающее задание просто снимается с очереди; False, если задание не выполняется.
+        """
+        with self._lock:
+            index = self._running.get(job_id)
+            if index is None:
+                if self._pending.remove(job_id):
+                    self._entries.pop(job_id, None)
+                return False
+            crawler = self._entries[job_id]['crawler']
+            loop = self._loops[index]['loop']
+        loop.call_soon_threadsafe(crawler.request_stop, action, reason)
+        return True
+
+    def largest_job(self) -> Optional[int]:
+        """Выполняющееся задание с наибольшей оценкой памяти (WebCrawler.memory_usage)"""
+        with self._lock:
+            crawlers = [self._entries[job_id]['crawler'] for job_id in self._running if job_id in self._entries]
+        crawlers = [crawler for crawler in crawlers if not crawler.stop_action]
+        if not crawlers:
+            return None
+        return max(crawlers, key=lambda crawler: crawler.memory_usage()['total']).job_id
+
+    def profile_job(self, job_id: int, duration: float, interval: float, on_finish: Callable) -> bool:
+        """
+        Семплирующий профиль потока цикла, в котором выполняется задание; стеки с методами
+        его краулера помечаются как стеки задания. False, если задание не выполняется.
+        """
+        with self._lock:
+            index = self._running.get(job_id)
+            if index is None:
+                return False
+            crawler = self._entries[job_id]['crawler']
+            thread_id = self._loops[index]['thread_id']
+
+        source = inspect.getsourcefile(type(crawler))
+        profiler = SamplingProfiler(
+            thread_id, duration, interval, label=f"job-{job_id}",
+            owns=lambda frame: frame.f_code.co_filename == source and frame.f_locals.get('self') is crawler
+        )
+        profiler.start(on_finish)
+        logger.info(f"Профилирование задания {job_id} на {duration} с")
+        return True
+
+    def _dispatch(self):
+        """Запуск ожидающих заданий, пока есть свободные места"""
+        started = []
+        with self._lock:
+            while len(self._running) < self.max_concurrent_jobs and len(self._pending):
+                job_id = self._pending.pop()
+                index = min(range(len(self._loops)), key=lambda i: self._loops[i]['jobs'])
+                self._loops[index]['jobs'] += 1
+                self._running[job_id] = index
+                started.append((job_id, self._loops[index]))
+
+        for job_id, slot in started:
+            future = asyncio.run_coroutine_threadsafe(self._run_job(job_id, slot), slot['loop'])
+            with self._lock:
+                if job_id in self._running:
+                    self._futures[job_id] = future
+
+    async def _run_job(self, job_id: int, slot: Dict):
+        entry = self._entries[job_id]
+        crawler = entry['crawler']
+        crawler.fetch_scheduler = slot['scheduler']
+        crawler.http_client = slot['http']
+        crawler.loop_watchdog = slot['watchdog']
+        crawler.fetch_weight = entry['weight']
+        logger.info(f"Запуск задания {job_id} после {time.time() - entry['enqueued_at']:.1f} с в очереди")
+
+        try:
+            result = await crawler.crawl()
+            logger.info(f"Краулер завершен успешно, результат: {result}")
+            self.progress.update(job_id, active=False)
+        except asyncio.CancelledError:
+            logger.warning(f"Задание {job_id} отменено")
+        except Exception as e:
+            logger.error(f"Ошибка в краулере: {e}")
+            logger.error(f"Traceback: {traceback.format_exc()}")
+            try:
+                await asyncio.to_thread(crawler.db_manager.update_job_status, job_id, 'failed')
+            except Exception as update_error:
+                logger.error(f"Ошибка обновления статуса: {update_error}")
+            self.progress.update(job_id, active=False, status='failed', message=f'Ошибка: {str(e)}')
+        finally:
+            with self._lock:
+                index = self._running.pop(job_id)
+                self._loops[index]['jobs'] -= 1
+                self._entries.pop(job_id, None)
+                self._futures.pop(job_id, None)
+            self._dispatch()
@@ -0,0 +1,127 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Callable, Dict
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+# Счетчики, которые ведутся по каждому заданию
+JOB_HTTP_COUNTERS = ('requests', 'connections_created', 'connections_reused', 'dns_cache_hits', 'dns_cache_misses')
+
+
+class SharedHttpClient:
+    """
+    Общая для всех заданий цикла событий HTTP-сессия: один пул соединений и один кеш DNS,
+    поэтому keep-alive соединения и разрешенные имена переиспользуются между заданиями
+    на одних и тех же сайтах. Создается внутри цикла событий, которому принадлежит.
+    Трассировка запросов ведет счетчики соединений и замеряет этапы: DNS, соединение, время до первого байта.
+    """
+
+    def __init__(self, limit: int = 100, limit_per_host: int = 10, dns_ttl: int = 300, job_limit: int = 5):
+        self.job_limit = job_limit
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(self._on_request_start)
+        trace_config.on_request_end.append(self._on_request_end)
+        trace_config.on_connection_create_start.append(self._on_connection_create_start)
+        trace_config.on_connection_create_end.append(self._on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(self._count('connections_reused'))
+        trace_config.on_dns_resolvehost_start.append(self._on_dns_start)
+        trace_config.on_dns_resolvehost_end.append(self._on_dns_end)
+        trace_config.on_dns_cache_hit.append(self._count('dns_cache_hits'))
+        trace_config.on_dns_cache_miss.append(self._count('dns_cache_misses'))
+        self.trace_config = trace_config
+
+        self.connector = aiohttp.TCPConnector(
+            limit=limit,
+            limit_per_host=limit_per_host,
+            ttl_dns_cache=dns_ttl,
+            use_dns_cache=True
+        )
+        self.session = aiohttp.ClientSession(connector=self.connector, trace_configs=[trace_config])
+        self.totals: Dict[str, int] = dict.fromkeys(JOB_HTTP_COUNTERS, 0)
+
+    def _increment(self, trace_config_ctx, counter: str):
+        self.totals[counter] += 1
+        job = trace_config_ctx.trace_request_ctx
+        if job is not None:
+            job.stats[counter] += 1
+
+    def _count(self, counter: str):
+        """Обработчик трассировки, увеличивающий счетчик задания и общий счетчик"""
+
+        async def handler(session, trace_config_ctx, params):
+            self._increment(trace_config_ctx, counter)
+
+        return handler
+
+    @staticmethod
+    def _observe(trace_config_ctx, stage: str, seconds: float):
+        job = trace_config_ctx.trace_request_ctx
+        if job is not None and job.observe is not None:
+            job.observe(stage, seconds)
+
+    async def _on_request_start(self, session, trace_config_ctx, params):
+        self._increment(trace_config_ctx, 'requests')
+        trace_config_ctx.request_start = time.perf_counter()
+        trace_config_ctx.dns_time = 0.0
+
+    async def _on_request_end(self, session, trace_config_ctx, params):
+        # on_request_end приходит после получения заголовков ответа - это время до первого байта
+        self._observe(trace_config_ctx, 'ttfb', time.perf_counter() - trace_config_ctx.request_start)
+
+    async def _on_dns_start(self, session, trace_config_ctx, params):
+        trace_config_ctx.dns_start = time.perf_counter()
+
+    async def _on_dns_end(self, session, trace_config_ctx, params):
+        trace_config_ctx.dns_time = time.perf_counter() - trace_config_ctx.dns_start
+        self._observe(trace_config_ctx, 'dns', trace_config_ctx.dns_time)
+
+    async def _on_connection_create_start(self, session, trace_config_ctx, params):
+        trace_config_ctx.connect_start = time.perf_counter()
+
+    async def _on_connection_create_end(self, session, trace_config_ctx, params):
+        self._increment(trace_config_ctx, 'connections_created')
+        # Разрешение имени происходит внутри создания соединения; TLS-рукопожатие входит в connect
+        connect_time = time.perf_counter() - trace_config_ctx.connect_start - trace_config_ctx.dns_time
+        self._observe(trace_config_ctx, 'connect', max(0.0, connect_time))
+
+    def for_job(self, job_id: int, observe: Callable = None) -> 'JobHttpSession':
+        """Представление сессии для одного задания со своим лимитом, счетчиками и замером этапов"""
+        return JobHttpSession(self, job_id, self.job_limit, observe)
+
+    async def close(self):
+        await self.session.close()
+
+
+class JobHttpSession:
+    """
+    Сессия задания поверх общей: не более limit одновременных запросов задания,
+    счетчики запросов, соединений и обращений к кешу DNS, длительности этапов передаются в observe(этап, сек.).
+    Закрытие не затрагивает общую сессию.
+    """
+
+    def __init__(self, client: SharedHttpClient, job_id: int, limit: int, observe: Callable = None):
+        self.client = client
+        self.job_id = job_id
+        self.observe = observe
+        self.stats: Dict[str, int] = dict.fromkeys(JOB_HTTP_COUNTERS, 0)
+        self._semaphore = asyncio.Semaphore(limit)
+
+    @asynccontextmanager
+    async def get(self, url: str, **kwargs):
+        async with self._semaphore:
+            async with self.client.session.get(url, trace_request_ctx=self, **kwargs) as response:
+                yield response
+
+    async def close(self):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        logger.info(f"HTTP-статистика задания {self.job_id}: {self.stats}")
@@ -0,0 +1,110 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+REGISTRY.describe('crawler_loop_lag_seconds', 'histogram',
+                  'Задержка цикла событий краулера: насколько позже срока просыпается таймер')
+REGISTRY.describe('crawler_loop_stalls_total', 'counter',
+                  'Остановки цикла событий краулера дольше порога (блокирующий вызов внутри корутины)')
+
+
+class LoopWatchdog:
+    """
+    Сторож цикла событий. Корутина-таймер внутри цикла засыпает на interval и замеряет,
+    насколько позже она проснулась - это задержка цикла (lag). Отдельный поток следит за тем,
+    как давно таймер просыпался: если дольше stall_threshold, цикл занят синхронным вызовом,
+    и поток снимает стек потока цикла в этот момент - он и показывает виновника остановки.
+    """
+
+    def __init__(self, name: str, interval: float = 0.1, stall_threshold: float = 0.5,
+                 window: int = 600, max_stalls: int = 20):
+        self.name = name
+        self.interval = interval
+        self.stall_threshold = stall_threshold
+        # Последние задержки для перцентилей в прогрессе (window * interval секунд)
+        self.lags = deque(maxlen=window)
+        # Последние зафиксированные остановки со стеками
+        self.stalls = deque(maxlen=max_stalls)
+        self.stall_count = 0
+
+        self._thread_id: Optional[int] = None
+        self._last_beat = time.perf_counter()
+        self._current_stall: Optional[Dict] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stop = threading.Event()
+
+    def start(self, loop: asyncio.AbstractEventLoop = None):
+        """Запуск таймера в цикле (вызывается из потока цикла) и потока-наблюдателя"""
+        loop = loop or asyncio.get_running_loop()
+        self._thread_id = threading.get_ident()
+        self._last_beat = time.perf_counter()
+        self._task = loop.create_task(self._tick())
+        threading.Thread(target=self._monitor, name=f"{self.name}-watchdog", daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _tick(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            now = time.perf_counter()
+            lag = max(0.0, now - started - self.interval)
+            self._last_beat = now
+            self.lags.append(lag)
+            REGISTRY.observe('crawler_loop_lag_seconds', lag, loop=self.name)
+
+            stall = self._current_stall
+            if stall is not None:
+                # Цикл снова свободен: фиксируем полную длительность остановки
+                stall['duration_ms'] = round(lag * 1000 + self.interval * 1000, 1)
+                self._current_stall = None
+                logger.warning(f"Цикл {self.name} был заблокирован {stall['duration_ms']} мс")
+
+    def _monitor(self):
+        while not self._stop.wait(self.interval):
+            blocked = time.perf_counter() - self._last_beat
+            if blocked < self.stall_threshold or self._current_stall is not None:
+                continue
+            frame = sys._current_frames().get(self._thread_id)
+            stack = ''.join(traceback.format_stack(frame)) if frame is not None else ''
+            stall = {
+                'at': datetime.now().strftime('%H:%M:%S'),
+                'duration_ms': round(blocked * 1000, 1),
+                'stack': stack
+            }
+            self._current_stall = stall
+            self.stalls.append(stall)
+            self.stall_count += 1
+            REGISTRY.inc('crawler_loop_stalls_total', loop=self.name)
+            logger.warning(f"Цикл {self.name} заблокирован дольше {self.stall_threshold} с, стек:\n{stack}")
+
+    def summary(self) -> Dict:
+        """Перцентили задержки цикла за последнее окно в миллисекундах и число остановок"""
+        lags = sorted(self.lags)
+        if not lags:
+            return {'stalls': self.stall_count}
+        percentile = lambda q: round(lags[min(len(lags) - 1, int(q * len(lags)))] * 1000, 1)
+        return {
+            'p50': percentile(0.5),
+            'p95': percentile(0.95),
+            'p99': percentile(0.99),
+            'max': round(lags[-1] * 1000, 1),
+            'stalls': self.stall_count
+        }
+
+    def recent_stalls(self) -> List[Dict]:
+        return list(self.stalls)
@@ -0,0 +1,258 @@
+import bisect
+import ipaddress
+import os
+import resource
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Границы корзин гистограмм длительностей, сек. (последняя корзина +Inf подразумевается)
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Границы корзин гистограмм количеств (например, SQL-запросов на веб-запрос)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+# Этапы обработки страницы, по которым ведутся гистограммы задания
+CRAWL_STAGES = ('queue_wait', 'dns', 'connect', 'ttfb', 'body', 'archive', 'parse', 'save_page', 'save_links')
+
+
+class Histogram:
+    """
+    Гистограмма с фиксированными корзинами: observe() - поиск корзины и два сложения,
+    поэтому ее можно обновлять на каждом запросе. Квантили оцениваются по корзинам.
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = DURATION_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Оценка квантиля линейной интерполяцией внутри корзины"""
+        with self._lock:
+            counts, total = list(self.counts), self.count
+        if not total:
+            return None
+        rank = q * total
+        seen = 0
+        for index, count in enumerate(counts):
+            if seen + count >= rank and count:
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                upper = self.buckets[index] if index < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            return {'counts': list(self.counts), 'sum': self.sum, 'count': self.count}
+
+    def load(self, data: Dict):
+        """Продолжение счета с сохраненного состояния (те же корзины)"""
+        with self._lock:
+            if len(data.get('counts', ())) == len(self.counts):
+                self.counts = list(data['counts'])
+                self.sum = data['sum']
+                self.count = data['count']
+
+    def summary(self) -> Dict:
+        """Число наблюдений, среднее и квантили в миллисекундах"""
+        if not self.count:
+            return {'count': 0}
+        to_ms = lambda value: round(value * 1000, 1)
+        return {
+            'count': self.count,
+            'avg_ms': to_ms(self.sum / self.count),
+            'p50_ms': to_ms(self.quantile(0.5)),
+            'p95_ms': to_ms(self.quantile(0.95)),
+            'total_ms': to_ms(self.sum)
+        }
+
+
+class StageTimings:
+    """Гистограммы длительностей этапов одного задания; каждое наблюдение попадает и в метрики процесса"""
+
+    def __init__(self, registry: 'MetricsRegistry' = None):
+        self.registry = registry
+        self.histograms: Dict[str, Histogram] = {stage: Histogram() for stage in CRAWL_STAGES}
+
+    def observe(self, stage: str, seconds: float):
+        self.histograms[stage].observe(seconds)
+        if self.registry is not None:
+            self.registry.observe('crawler_stage_seconds', seconds, stage=stage)
+
+    def to_dict(self) -> Dict:
+        return {stage: histogram.to_dict() for stage, histogram in self.histograms.items() if histogram.count}
+
+    def load(self, data: Dict):
+        for stage, state in (data or {}).items():
+            if stage in self.histograms:
+                self.histograms[stage].load(state)
+
+
+def summarize_timings(data: Dict) -> Dict[str, Dict]:
+    """Сводка по сохраненным гистограммам задания (crawl_jobs.timings) в порядке этапов"""
+    summary = {}
+    for stage in CRAWL_STAGES:
+        if stage in (data or {}):
+            histogram = Histogram()
+            histogram.load(data[stage])
+            summary[stage] = histogram.summary()
+    return summary
+
+
+class MetricsRegistry:
+    """
+    Метрики процесса в текстовом формате Prometheus: гистограммы, счетчики
+    и значения, которые вычисляются функциями-сборщиками в момент запроса /metrics.
+    """
+
+    def __init__(self):
+        self._histograms: Dict[Tuple, Histogram] = {}
+        self._counters: Dict[Tuple, float] = {}
+        self._help: Dict[str, Tuple[str, str]] = {}
+        self._buckets: Dict[str, Tuple[float, ...]] = {}
+        self._collectors: List[Callable] = []
+        self._lock = threading.Lock()
+
+    def describe(self, name: str, kind: str, text: str, buckets: Tuple[float, ...] = None):
+        """Описание метрики; для гистограмм можно задать свои корзины (по умолчанию DURATION_BUCKETS)"""
+        self._help[name] = (kind, text)
+        if buckets is not None:
+            self._buckets[name] = buckets
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(key, Histogram(self._buckets.get(name, DURATION_BUCKETS)))
+        histogram.observe(value)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def add_collector(self, collector: Callable):
+        """Сборщик возвращает [(имя, {метки}, значение)] для метрик, описанных через describe()"""
+        self._collectors.append(collector)
+
+    def histogram(self, name: str, **labels) -> Optional[Histogram]:
+        return self._histograms.get((name, tuple(sorted(labels.items()))))
+
+    def render(self) -> str:
+        samples: Dict[str, List[str]] = {}
+
+        with self._lock:
+            histograms = list(self._histograms.items())
+            counters = list(self._counters.items())
+
+        for (name, labels), histogram in histograms:
+            state = histogram.to_dict()
+            lines = samples.setdefault(name, [])
+            cumulative = 0
+            for bound, count in zip(list(histogram.buckets) + ['+Inf'], state['counts']):
+                cumulative += count
+                lines.append(f"{name}_bucket{_labels(labels + (('le', str(bound)),))} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labels)} {state['sum']}")
+            lines.append(f"{name}_count{_labels(labels)} {state['count']}")
+
+        for (name, labels), value in counters:
+            samples.setdefault(name, []).append(f"{name}{_labels(labels)} {value}")
+
+        for collector in self._collectors:
+            for name, labels, value in collector():
+                samples.setdefault(name, []).append(f"{name}{_labels(tuple(sorted(labels.items())))} {value}")
+
+        output = []
+        for name in sorted(samples):
+            if name in self._help:
+                kind, text = self._help[name]
+                output.append(f"# HELP {name} {text}")
+                output.append(f"# TYPE {name} {kind}")
+            output.extend(samples[name])
+        return '\n'.join(output) + '\n'
+
+
+def _labels(labels: Tuple) -> str:
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"') for _, value in labels)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + '}'
+
+
+def process_rss_bytes() -> int:
+    """Текущий RSS процесса (Linux - /proc/self/statm, иначе пиковый RSS из getrusage)"""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Метрики текущего процесса
+REGISTRY = MetricsRegistry()
+REGISTRY.describe('crawler_stage_seconds', 'histogram',
+                  'Длительность этапов обработки страницы: сеть (dns, connect, ttfb, body), parse, сохранение в БД')
+REGISTRY.describe('process_resident_memory_bytes', 'gauge', 'RSS процесса')
+REGISTRY.add_collector(lambda: [('process_resident_memory_bytes', {}, process_rss_bytes())])
+
+
+def metrics_authorized(authorization: Optional[str], remote_addr: Optional[str], token: str) -> bool:
+    """
+    Проверка доступа к /metrics: с непустым token нужен заголовок Authorization: Bearer <token>,
+    без токена метрики отдаются только локальным клиентам (адрес loopback), а не всем.
+    """
+    if token:
+        return authorization == f'Bearer {token}'
+    try:
+        return ipaddress.ip_address(remote_addr or '').is_loopback
+    except ValueError:
+        return False
+
+
+def start_metrics_server(port: int, host: str = '127.0.0.1', token: str = '',
+                         registry: MetricsRegistry = REGISTRY) -> ThreadingHTTPServer:
+    """
+    HTTP-сервер метрик процесса без веб-приложения (для воркеров): GET /metrics в фоновом потоке.
+    Доступ проверяется так же, как у /metrics веб-приложения (см. metrics_authorized).
+    """
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            if not metrics_authorized(self.headers.get('Authorization'), self.client_address[0], token):
+                body = b'Unauthorized\n'
+                self.send_response(401)
+                self.send_header('Content-Type', 'text/plain')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                return
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', PROMETHEUS_CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="MetricsServer", daemon=True).start()
+    return server
@@ -0,0 +1,190 @@
+import base64
+import hashlib
+import json
+import logging
+import os
+import threading
+import uuid
+import zlib
+from datetime import datetime, timezone
+from http import HTTPStatus
+from typing import Dict, List, Mapping, Optional, Tuple
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Заголовки ответа, которые не записываются в архив: тело хранится уже распакованным aiohttp
+# и без chunked-кодирования, а Content-Length пересчитывается по телу
+SKIPPED_HEADERS = {'content-encoding', 'transfer-encoding', 'content-length'}
+
+# Уровень сжатия записей gzip
+COMPRESS_LEVEL = 6
+
+
+def archive_paths(job_id: int, directory: str = None) -> Tuple[str, str]:
+    """Файл WARC задания и его индекс"""
+    base = os.path.join(directory or Config.CRAWL_ARCHIVE_DIR, f"job-{job_id}")
+    return base + '.warc.gz', base + '.idx'
+
+
+def archive_exists(job_id: int) -> bool:
+    if not Config.CRAWL_ARCHIVE_DIR:
+        return False
+    return all(os.path.exists(path) for path in archive_paths(job_id))
+
+
+def remove_archive(job_id: int):
+    """Удаление архива задания вместе с индексом (вызывается при удалении задания)"""
+    if not Config.CRAWL_ARCHIVE_DIR:
+        return
+    for path in archive_paths(job_id):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.error(f"Ошибка удаления архива {path}: {e}")
+
+
+def _warc_date(moment: datetime) -> str:
+    return moment.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def _warc_record(warc_type: str, block: bytes, fields: Dict[str, str], content_type: str) -> bytes:
+    """Запись WARC/1.1: заголовки, блок и завершающие две пустые строки"""
+    header = {
+        'WARC-Type': warc_type,
+        'WARC-Record-ID': f"<urn:uuid:{uuid.uuid4()}>",
+        **fields,
+        'Content-Type': content_type,
+        'Content-Length': str(len(block)),
+    }
+    head = 'WARC/1.1\r\n' + ''.join(f"{name}: {value}\r\n" for name, value in header.items()) + '\r\n'
+    return head.encode('utf-8') + block + b'\r\n\r\n'
+
+
+def _gzip_member(data: bytes) -> bytes:
+    """Отдельный член gzip на запись: запись читается по смещению без распаковки предыдущих"""
+    compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+
+class ArchiveWriter:
+    """
+    Архив исходных ответов задания: файл WARC (каждая запись - отдельный член gzip, как в .warc.gz
+    веб-архивов) и индекс в формате JSON Lines со смещением, длиной и параметрами каждой записи.
+    Оба файла только дописываются: сначала запись, затем строка индекса, поэтому оборванная при сбое
+    запись в индекс не попадает. Запись потокобезопасна (вызывается из asyncio.to_thread).
+    """
+
+    def __init__(self, job_id: int, append: bool = False, directory: str = None):
+        self.job_id = job_id
+        self.warc_path, self.index_path = archive_paths(job_id, directory)
+        os.makedirs(os.path.dirname(self.warc_path), exist_ok=True)
+        mode = 'ab' if append and os.path.exists(self.warc_path) else 'wb'
+        self._warc = open(self.warc_path, mode)
+        self._index = open(self.index_path, mode.replace('b', ''), encoding='utf-8')
+        self._lock = threading.Lock()
+        self.records = 0
+        self.bytes_written = 0
+        if mode == 'wb':
+            self._write_warcinfo()
+
+    def _write_warcinfo(self):
+        fields = f"software: WebCrawler\r\nformat: WARC File Format 1.1\r\njob-id: {self.job_id}\r\n"
+        record = _warc_record('warcinfo', fields.encode('utf-8'), {
+            'WARC-Date': _warc_date(datetime.now(timezone.utc)),
+            'WARC-Filename': os.path.basename(self.warc_path),
+        }, 'application/warc-fields')
+        with self._lock:
+            self._warc.write(_gzip_member(record))
+            self._warc.flush()
+
+    def write(self, url: str, status: int, headers: Mapping[str, str], body: bytes,
+              depth: int, encoding: Optional[str]):
+        """Запись ответа (record типа response) и его строки в индексе"""
+        moment = datetime.now(timezone.utc)
+        lines = [f"HTTP/1.1 {status} {self._reason(status)}"]
+        lines.extend(f"{name}: {value}" for name, value in headers.items() if name.lower() not in SKIPPED_HEADERS)
+        lines.append(f"Content-Length: {len(body)}")
+        http_head = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1', errors='replace')
+        digest = base64.b32encode(hashlib.sha1(body).digest()).decode('ascii')
+        member = _gzip_member(_warc_record('response', http_head + body, {
+            'WARC-Date': _warc_date(moment),
+            'WARC-Target-URI': url,
+            'WARC-Payload-Digest': f"sha1:{digest}",
+        }, 'application/http; msgtype=response'))
+
+        with self._lock:
+            offset = self._warc.tell()
+            self._warc.write(member)
+            self._warc.flush()
+            self._index.write(json.dumps({
+                'url': url,
+                'offset': offset,
+                'length': len(member),
+                'status': status,
+                'depth': depth,
+                'encoding': encoding,
+                'date': moment.isoformat(),
+                'size': len(body)
+            }, ensure_ascii=False) + '\n')
+            self._index.flush()
+            self.records += 1
+            self.bytes_written += len(member)
+
+    @staticmethod
+    def _reason(status: int) -> str:
+        try:
+            return HTTPStatus(status).phrase
+        except ValueError:
+            return ''
+
+    def close(self):
+        with self._lock:
+            self._warc.close()
+            self._index.close()
+        logger.info(f"Архив задания {self.job_id}: {self.records} записей, "
+                    f"{self.bytes_written / 1048576:.1f} МБ ({self.warc_path})")
+
+
+def read_index(index_path: str) -> List[Dict]:
+    """
+    Записи индекса архива. Поврежденные строки (оборванная при сбое последняя) пропускаются;
+    для URL, загруженного повторно (после возобновления без контрольной точки), берется последняя запись.
+    """
+    entries: Dict[str, Dict] = {}
+    with open(index_path, encoding='utf-8') as file:
+        for number, line in enumerate(file, 1):
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                logger.warning(f"Поврежденная строка {number} индекса {index_path} пропущена")
+                continue
+            entries.pop(entry['url'], None)
+            entries[entry['url']] = entry
+    return list(entries.values())
+
+
+def read_record(warc_path: str, offset: int, length: int) -> Tuple[Dict[str, str], int, Dict[str, str], bytes]:
+    """Запись response по смещению из индекса: заголовки WARC, код ответа, заголовки HTTP и тело"""
+    with open(warc_path, 'rb') as file:
+        file.seek(offset)
+        data = zlib.decompress(file.read(length), 31)
+
+    warc_head, _, rest = data.partition(b'\r\n\r\n')
+    warc_headers = _parse_headers(warc_head.decode('utf-8').split('\r\n')[1:])
+    block = rest[:int(warc_headers['Content-Length'])]
+    http_head, _, body = block.partition(b'\r\n\r\n')
+    status_line, *header_lines = http_head.decode('latin-1').split('\r\n')
+    return warc_headers, int(status_line.split(' ', 2)[1]), _parse_headers(header_lines), body
+
+
+def _parse_headers(lines: List[str]) -> Dict[str, str]:
+    headers = {}
+    for line in lines:
+        name, _, value = line.partition(':')
+        if name:
+            headers[name.strip()] = value.strip()
+    return headers
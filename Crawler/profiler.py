@@ -0,0 +1,75 @@
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class SamplingProfiler:
+    """
+    Семплирующий профилировщик одного потока: фоновый поток каждые interval секунд снимает
+    стек целевого потока через sys._current_frames() в течение duration секунд.
+    Целевой поток при этом не трассируется, поэтому накладные расходы есть только на время профиля.
+    Стеки агрегируются в формат collapsed stacks (flamegraph.pl, speedscope): "кадр;кадр;... число".
+    Стеки, в которых выполняется код задания (owns(кадр) истинно хотя бы для одного кадра),
+    начинаются с кадра label, остальные работы цикла - с кадра "other".
+    """
+
+    def __init__(self, thread_id: int, duration: float, interval: float = 0.005,
+                 label: str = 'job', owns: Callable = None):
+        self.thread_id = thread_id
+        self.duration = duration
+        self.interval = interval
+        self.label = label
+        self.owns = owns
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.error: Optional[str] = None
+
+    def start(self, on_finish: Callable = None) -> threading.Thread:
+        """Запуск профиля в фоновом потоке; по окончании вызывается on_finish(profiler)"""
+
+        def run():
+            try:
+                self._sample()
+            except Exception as e:
+                logger.error(f"Ошибка профилирования потока {self.thread_id}: {e}")
+                self.error = str(e)
+            if on_finish is not None:
+                on_finish(self)
+
+        thread = threading.Thread(target=run, name=f"Profiler-{self.label}", daemon=True)
+        thread.start()
+        return thread
+
+    def _sample(self):
+        deadline = time.monotonic() + self.duration
+        while time.monotonic() < deadline:
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                self.error = 'Поток завершился во время профилирования'
+                return
+            self.stacks[self._collapse(frame)] += 1
+            self.samples += 1
+            del frame
+            time.sleep(self.interval)
+
+    def _collapse(self, frame) -> str:
+        names = []
+        owned = False
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+            if not owned and self.owns is not None and self.owns(frame):
+                owned = True
+            frame = frame.f_back
+        names.append(self.label if owned else 'other')
+        return ';'.join(reversed(names))
+
+    def collapsed(self) -> str:
+        """Профиль в формате collapsed stacks, самые частые стеки первыми"""
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
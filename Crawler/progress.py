@@ -0,0 +1,288 @@
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def queued_snapshot(job_id: int, message: str = 'Задание в очереди', **fields) -> dict:
+    """Снимок прогресса задания, ожидающего выполнения"""
+    return {
+        'active': True,
+        'job_id': job_id,
+        'status': 'queued',
+        'progress': 0,
+        'message': message,
+        'updated_at': datetime.now().strftime('%H:%M:%S'),
+        **fields
+    }
+
+
+def stopped_snapshot(job_id: int, status: str, message: str = None) -> dict:
+    """Снимок прогресса задания, остановленного без участия краулера (на паузе или отменено)"""
+    messages = {'paused': 'Задание приостановлено', 'cancelled': 'Задание отменено'}
+    return {
+        'active': False,
+        'job_id': job_id,
+        'status': status,
+        'message': message or messages.get(status, f'Задание {status}'),
+        'updated_at': datetime.now().strftime('%H:%M:%S')
+    }
+
+
+class MemoryProgressStore:
+    """
+    Последние снимки прогресса заданий с возможностью дождаться изменения.
+    Каждая публикация увеличивает версию снимка; потоки SSE ждут смены версии
+    и всегда получают только последний снимок, промежуточные схлопываются.
+    Видит только задания, выполняющиеся в текущем процессе.
+    """
+
+    def __init__(self):
+        self._snapshots: Dict[int, dict] = {}
+        self._versions: Dict[int, int] = {}
+        self._condition = threading.Condition()
+
+    def publish(self, job_id: int, snapshot: dict, force: bool = False):
+        """Замена снимка прогресса задания; force - сохранить без ограничения частоты (для внешних хранилищ)"""
+        with self._condition:
+            self._snapshots[job_id] = snapshot
+            self._versions[job_id] = self._versions.get(job_id, 0) + 1
+            self._condition.notify_all()
+
+    def update(self, job_id: int, **fields):
+        """Изменение отдельных полей существующего снимка"""
+        with self._condition:
+            if job_id not in self._snapshots:
+                return
+            self._snapshots[job_id] = {**self._snapshots[job_id], **fields}
+            self._versions[job_id] += 1
+            self._condition.notify_all()
+
+    def discard(self, job_id: int):
+        """Удаление снимка задания; ожидающие потоки просыпаются и видят его отсутствие"""
+        with self._condition:
+            if self._snapshots.pop(job_id, None) is not None:
+                self._versions[job_id] += 1
+                self._condition.notify_all()
+
+    def flush(self):
+        """Запись отложенных снимков во внешнее хранилище (в памяти писать нечего)"""
+
+    def get(self, job_id: int) -> Optional[dict]:
+        """Копия последнего снимка или None, если задание в этом процессе не выполнялось"""
+        with self._condition:
+            snapshot = self._snapshots.get(job_id)
+            return dict(snapshot) if snapshot is not None else None
+
+    def get_local(self, job_id: int) -> Optional[dict]:
+        """Снимок задания, выполняющегося в этом процессе, без обращения к внешнему хранилищу"""
+        return MemoryProgressStore.get(self, job_id)
+
+    def is_local(self, job_id: int) -> bool:
+        """Публикуется ли прогресс задания в этом процессе"""
+        with self._condition:
+            return job_id in self._versions
+
+    def wait_for_update(self, job_id: int, version: int, timeout: float) -> Tuple[int, Optional[dict]]:
+        """
+        Ожидание снимка новее версии version не дольше timeout секунд.
+        Возвращает (текущая версия, снимок); если версия не изменилась, снимок не копируется.
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._versions.get(job_id, 0) != version, timeout)
+            current = self._versions.get(job_id, 0)
+            if current == version:
+                return current, None
+            snapshot = self._snapshots.get(job_id)
+            return current, dict(snapshot) if snapshot is not None else None
+
+
+class DatabaseProgressStore(MemoryProgressStore):
+    """
+    Прогресс, общий для всех процессов: снимки дополнительно пишутся в таблицу job_progress.
+    Запись в БД не чаще write_interval секунд на задание (неактивный снимок пишется сразу),
+    версия снимка в таблице растет с каждой записью. Пишет снимки отдельный поток: publish вызывается
+    из циклов событий краулеров, и запрос к БД в нем останавливал бы все задания цикла. Задания своего процесса по-прежнему
+    обслуживаются из памяти, чужие - из таблицы, в том числе после перезапуска процесса:
+    один поток процесса раз в poll_interval секунд читает снимки всех ожидаемых заданий
+    одним запросом и будит ожидающие потоки SSE, так что запросы к БД не зависят от числа вкладок.
+    """
+
+    # Сколько секунд задание остается в опросе после ухода последнего ожидающего потока
+    # (поток SSE ждет обновлений серией вызовов wait_for_update)
+    WATCH_GRACE = 10.0
+
+    def __init__(self, db_manager, write_interval: float = 1.0, poll_interval: float = 1.0):
+        super().__init__()
+        self.db_manager = db_manager
+        self.write_interval = write_interval
+        self.poll_interval = poll_interval
+        self._last_write: Dict[int, float] = {}
+        self._write_lock = threading.Lock()
+        # Снимки, ожидающие записи (промежуточные схлопываются); _db_lock упорядочивает запись и удаление
+        self._pending: Dict[int, dict] = {}
+        self._pending_ready = threading.Event()
+        self._db_lock = threading.Lock()
+        self._writer_pid = None
+        # Опрос чужих заданий: число ожидающих потоков, время ухода последнего из них
+        # и последние прочитанные (версия, снимок); 0 - снимка в таблице нет
+        self._watchers: Dict[int, int] = {}
+        self._unwatched_at: Dict[int, float] = {}
+        self._remote: Dict[int, Tuple[int, Optional[dict]]] = {}
+        self._poll_now = threading.Event()
+        self._poller_pid = None
+
+    def publish(self, job_id: int, snapshot: dict, force: bool = False):
+        super().publish(job_id, snapshot)
+        self._write(job_id, force=force or not snapshot.get('active', True))
+
+    def update(self, job_id: int, **fields):
+        super().update(job_id, **fields)
+        self._write(job_id, force=True)
+
+    def discard(self, job_id: int):
+        super().discard(job_id)
+        # Отложенный снимок не должен записаться после удаления
+        with self._db_lock:
+            with self._write_lock:
+                self._last_write.pop(job_id, None)
+                self._pending.pop(job_id, None)
+            self.db_manager.delete_job_progress(job_id)
+
+    def _write(self, job_id: int, force: bool = False):
+        """Постановка текущего снимка в очередь записи в БД с ограничением частоты"""
+        now = time.monotonic()
+        with self._write_lock:
+            if not force and now - self._last_write.get(job_id, 0) < self.write_interval:
+                return
+            self._last_write[job_id] = now
+
+        with self._condition:
+            snapshot = self._snapshots.get(job_id)
+        if snapshot is None:
+            return
+        with self._write_lock:
+            self._pending[job_id] = snapshot
+            self._ensure_writer()
+        self._pending_ready.set()
+
+    def flush(self):
+        """Запись отложенных снимков в вызывающем потоке (перед остановкой процесса)"""
+        with self._db_lock:
+            with self._write_lock:
+                pending, self._pending = self._pending, {}
+            for job_id, snapshot in pending.items():
+                self.db_manager.save_job_progress(job_id, snapshot)
+
+    def _ensure_writer(self):
+        """Поток записи запускается при первом снимке (и заново в процессе, созданном через fork)"""
+        pid = os.getpid()
+        if self._writer_pid == pid:
+            return
+        self._writer_pid = pid
+        threading.Thread(target=self._write_loop, name="ProgressWriter", daemon=True).start()
+
+    def _write_loop(self):
+        while True:
+            self._pending_ready.wait()
+            self._pending_ready.clear()
+            self.flush()
+
+    def get(self, job_id: int) -> Optional[dict]:
+        snapshot = super().get(job_id)
+        if snapshot is not None:
+            return snapshot
+        row = self.db_manager.get_job_progress(job_id)
+        return row['snapshot'] if row else None
+
+    def wait_for_update(self, job_id: int, version: int, timeout: float) -> Tuple[int, Optional[dict]]:
+        if self.is_local(job_id):
+            return super().wait_for_update(job_id, version, timeout)
+
+        # Задание выполняется в другом процессе: ждем, пока общий опрос таблицы не принесет новую версию
+        self._watch(job_id)
+        try:
+            with self._condition:
+                self._condition.wait_for(
+                    lambda: job_id in self._versions or self._remote.get(job_id, (version,))[0] != version,
+                    timeout
+                )
+                if job_id in self._versions:
+                    # Задание начало выполняться в этом процессе: дальше ждем в памяти
+                    return version, None
+                current, snapshot = self._remote.get(job_id, (version, None))
+                if current == version:
+                    return version, None
+                return current, dict(snapshot) if snapshot is not None else None
+        finally:
+            self._unwatch(job_id)
+
+    def _watch(self, job_id: int):
+        with self._condition:
+            self._watchers[job_id] = self._watchers.get(job_id, 0) + 1
+            self._unwatched_at.pop(job_id, None)
+            if job_id not in self._remote:
+                # Новое задание в опросе: первый снимок читаем сразу, не дожидаясь очередного круга
+                self._poll_now.set()
+            self._ensure_poller()
+            self._condition.notify_all()
+
+    def _unwatch(self, job_id: int):
+        with self._condition:
+            self._watchers[job_id] -= 1
+            if not self._watchers[job_id]:
+                self._unwatched_at[job_id] = time.monotonic()
+
+    def _ensure_poller(self):
+        """Поток опроса запускается при первом ожидании (и заново в процессе, созданном через fork)"""
+        pid = os.getpid()
+        if self._poller_pid == pid:
+            return
+        self._poller_pid = pid
+        threading.Thread(target=self._poll_loop, name="ProgressPoller", daemon=True).start()
+
+    def _poll_loop(self):
+        while True:
+            with self._condition:
+                now = time.monotonic()
+                for job_id, since in list(self._unwatched_at.items()):
+                    if now - since >= self.WATCH_GRACE:
+                        del self._unwatched_at[job_id], self._watchers[job_id]
+                        self._remote.pop(job_id, None)
+                self._condition.wait_for(lambda: self._watchers)
+                job_ids = [job_id for job_id in self._watchers if job_id not in self._versions]
+
+            rows = self.db_manager.get_progress_snapshots(job_ids) if job_ids else None
+            if rows is not None:
+                with self._condition:
+                    changed = False
+                    for job_id in job_ids:
+                        if job_id not in self._watchers:
+                            continue
+                        row = rows.get(job_id)
+                        entry = (row['version'], row['snapshot']) if row else (0, None)
+                        if self._remote.get(job_id, (None,))[0] != entry[0]:
+                            self._remote[job_id] = entry
+                            changed = True
+                    if changed:
+                        self._condition.notify_all()
+
+            self._poll_now.wait(self.poll_interval)
+            self._poll_now.clear()
+
+
+def create_progress_store(backend: str, db_manager=None, **options) -> MemoryProgressStore:
+    """
+    Хранилище прогресса по имени бэкенда из конфигурации:
+    'memory' - только текущий процесс (один воркер), 'database' - общая таблица job_progress.
+    Параметры options (write_interval, poll_interval) относятся только к 'database'.
+    """
+    if backend == 'memory':
+        return MemoryProgressStore()
+    if backend != 'database':
+        logger.warning(f"Неизвестный бэкенд прогресса '{backend}', используется 'database'")
+    return DatabaseProgressStore(db_manager, **options)
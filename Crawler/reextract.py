@@ -0,0 +1,157 @@
+import asyncio
+import logging
+import multiprocessing
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from config import Config
+from crawler import WebCrawler
+from page_archive import archive_paths, read_index, read_record
+
+logger = logging.getLogger(__name__)
+
+# Сколько записей архива на процесс разбора может ждать в очереди пула
+RECORDS_PER_PROCESS = 4
+
+# Разборщик процесса пула (создается инициализатором пула)
+_parser: Optional['ArchiveReExtractor'] = None
+
+
+def _init_parser(start_url: str):
+    global _parser
+    _parser = ArchiveReExtractor(job_name='reextract', start_url=start_url)
+
+
+def extract_record(warc_path: str, entry: Dict) -> Optional[Dict]:
+    """
+    Разбор одной записи архива в процессе пула: тело читается по смещению из индекса
+    и проходит через тот же parse_page, что и при обходе. None - страницу разобрать не удалось.
+    """
+    _, _, _, body = read_record(warc_path, entry['offset'], entry['length'])
+    html = body.decode(entry.get('encoding') or 'utf-8', errors='replace')
+    parsed = _parser.parse_page(html, entry['url'])
+    if not parsed:
+        return None
+
+    page_data, metadata, headings, content, links, link_texts = parsed
+    return {
+        'url': page_data['url'],
+        'title': page_data['title'],
+        'depth': entry['depth'],
+        'status_code': entry['status'],
+        # Время загрузки из архива (UTC) в локальном времени, как crawled_at при обходе
+        'crawled_at': datetime.fromisoformat(entry['date']).astimezone().replace(tzinfo=None),
+        'metadata': {**metadata, 'headings': headings},
+        'content': content,
+        'links': links,
+        'link_texts': link_texts,
+        'size': entry.get('size', 0)
+    }
+
+
+class ArchiveReExtractor(WebCrawler):
+    """
+    Повторное извлечение данных задания из архива его ответов (page_archive) без обращения к сети.
+    Записи архива разбираются параллельно в пуле процессов (разбор упирается в процессор, потоки
+    из-за GIL не ускоряют его), затем страницы и ссылки задания заменяются одной транзакцией
+    (DatabaseManager.replace_job_pages). Пауза или отмена до замены оставляют данные задания прежними.
+    Выполняется исполнителем заданий так же, как обход: интерфейс WebCrawler.
+    """
+
+    def __init__(self, *args, processes: int = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.processes = max(1, processes or Config.CRAWL_REEXTRACT_PROCESSES)
+        self.response_cache = None
+
+    async def crawl(self):
+        """Повторное извлечение: разбор архива и замена страниц задания"""
+        warc_path, index_path = archive_paths(self.job_id)
+        try:
+            self.stats['start_time'] = datetime.now()
+            await self.update_job_status('running')
+
+            entries = await asyncio.to_thread(read_index, index_path)
+            self.progress.max_pages = len(entries)
+            self.progress.report(status='running', message=f'Повторное извлечение из архива: {len(entries)} страниц',
+                                 force=True)
+
+            pages = await self.extract_pages(warc_path, entries)
+
+            if self.stop_action:
+                status = 'paused' if self.stop_action == 'pause' else 'cancelled'
+                await self.update_job_status(status)
+                self.progress.report(status=status, message='Повторное извлечение остановлено, данные задания не изменены',
+                                     force=True)
+                return self.job_id
+
+            self.progress.report(status='running', message=f'Замена страниц задания: {len(pages)}', force=True)
+            counters = await asyncio.to_thread(self.db_manager.replace_job_pages, self.job_id, pages,
+                                               self.stats['pages_failed'])
+            self.stats['links_found'] = counters['links_found']
+            await self.update_job_status('completed')
+
+            self.stats['end_time'] = datetime.now()
+            logger.info(f"Повторное извлечение задания {self.job_id} завершено за "
+                        f"{self.stats['end_time'] - self.stats['start_time']}: страниц {counters['pages_crawled']}, "
+                        f"ссылок {counters['links_found']}, ошибок разбора {self.stats['pages_failed']}")
+            self.progress.report(
+                status='completed',
+                message=f'Повторное извлечение завершено! Страниц: {counters["pages_crawled"]}',
+                force=True
+            )
+            return self.job_id
+
+        except Exception as e:
+            logger.error(f"Ошибка повторного извлечения задания {self.job_id}: {str(e)}")
+            logger.error(f"Traceback: {traceback.format_exc()}")
+            await self.update_job_status('failed')
+            self.progress.report(status='failed', message=f'Ошибка повторного извлечения: {str(e)}', force=True)
+            raise
+
+        finally:
+            self.progress.flush()
+
+    async def extract_pages(self, warc_path: str, entries: List[Dict]) -> List[Dict]:
+        """
+        Разбор записей архива в пуле процессов; в работе не больше RECORDS_PER_PROCESS записей на процесс.
+        Процессы запускаются через spawn: fork процесса воркера с потоками циклов событий небезопасен.
+        """
+        loop = asyncio.get_running_loop()
+        pool = ProcessPoolExecutor(self.processes, mp_context=multiprocessing.get_context('spawn'),
+                                   initializer=_init_parser, initargs=(self.start_url,))
+        pages: Dict[str, Dict] = {}
+        pending = set()
+        try:
+            for entry in entries:
+                if self.stop_action:
+                    break
+                pending.add(loop.run_in_executor(pool, extract_record, warc_path, entry))
+                if len(pending) >= self.processes * RECORDS_PER_PROCESS:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    self.collect(done, pages)
+            if pending:
+                done, pending = await asyncio.wait(pending)
+                self.collect(done, pages)
+        finally:
+            for future in pending:
+                future.cancel()
+            await asyncio.to_thread(pool.shutdown, True, cancel_futures=True)
+        return list(pages.values())
+
+    def collect(self, done, pages: Dict[str, Dict]):
+        """Учет разобранных записей; страница с уже встречавшимся URL не добавляется повторно"""
+        for future in done:
+            self.stats['pages_processed'] += 1
+            try:
+                page = future.result()
+            except Exception as e:
+                logger.error(f"Ошибка разбора записи архива задания {self.job_id}: {str(e)}")
+                page = None
+            if page is None:
+                self.stats['pages_failed'] += 1
+            elif page['url'] not in pages:
+                pages[page['url']] = page
+                self.stats['pages_successful'] += 1
+        self.progress.report()
@@ -0,0 +1,321 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from email.utils import parsedate_to_datetime
+from typing import Dict, Mapping, Optional
+from urllib.parse import urlsplit, urlunsplit
+
+from config import Config
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# Порты по умолчанию, которые убираются из канонического URL
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+# Суммарный размер кеша пересчитывается по базе раз в столько записей (его меняют и другие процессы)
+SIZE_CHECK_EVERY = 100
+
+# Вытеснение освобождает место до этой доли от максимального размера
+EVICT_TARGET = 0.9
+
+REGISTRY.describe('crawler_http_cache_requests_total', 'counter',
+                  'Обращения к кешу HTTP-ответов: hit, revalidated (304), miss')
+REGISTRY.describe('crawler_http_cache_evictions_total', 'counter', 'Записи, вытесненные из кеша HTTP-ответов')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    status INTEGER NOT NULL,
+    encoding TEXT,
+    etag TEXT,
+    last_modified TEXT,
+    expires_at REAL NOT NULL,
+    stored_at REAL NOT NULL,
+    accessed_at REAL NOT NULL,
+    body_size INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    body BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses (accessed_at);
+"""
+
+
+def canonical_url(url: str) -> str:
+    """Ключ кеша: схема и хост в нижнем регистре, без порта по умолчанию и фрагмента, пустой путь - '/'"""
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{parts.port}"
+    return urlunsplit((scheme, host, parts.path or '/', parts.query, ''))
+
+
+def parse_cache_control(value: Optional[str]) -> Dict[str, Optional[str]]:
+    """Директивы Cache-Control: имя в нижнем регистре -> значение (None у директив без значения)"""
+    directives = {}
+    for item in (value or '').split(','):
+        name, _, argument = item.strip().partition('=')
+        if name:
+            directives[name.lower()] = argument.strip('"') if argument else None
+    return directives
+
+
+def _seconds(value: Optional[str]) -> Optional[int]:
+    try:
+        return max(0, int(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def _http_date(value: Optional[str]) -> Optional[float]:
+    try:
+        return parsedate_to_datetime(value).timestamp() if value else None
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def freshness_lifetime(headers: Mapping[str, str], default_ttl: float, force_ttl: bool = False) -> Optional[float]:
+    """
+    Срок свежести ответа для общего кеша в секундах (по RFC 9111, упрощенно) или None, если ответ
+    хранить нельзя: no-store, private, Vary: *. Порядок: s-maxage, max-age, Expires - Date, затем default_ttl;
+    no-cache дает срок 0 (ответ хранится, но перед использованием перепроверяется).
+    С force_ttl заголовки свежести игнорируются и срок всегда default_ttl (запрет хранения соблюдается).
+    Возраст ответа из заголовка Age вычитается.
+    """
+    directives = parse_cache_control(headers.get('Cache-Control'))
+    if 'no-store' in directives or headers.get('Vary', '').strip() == '*':
+        return None
+    if force_ttl:
+        return default_ttl
+    if 'private' in directives:
+        return None
+
+    age = _seconds(headers.get('Age')) or 0
+    if 'no-cache' in directives:
+        return 0.0
+    for directive in ('s-maxage', 'max-age'):
+        if directive in directives:
+            lifetime = _seconds(directives[directive])
+            if lifetime is not None:
+                return max(0.0, lifetime - age)
+    expires = headers.get('Expires')
+    if expires is not None:
+        expires_at = _http_date(expires)
+        # Некорректный Expires (например, "0") означает, что ответ уже устарел
+        if expires_at is None:
+            return 0.0
+        date = _http_date(headers.get('Date')) or time.time()
+        return max(0.0, expires_at - date - age)
+    return default_ttl
+
+
+class ResponseCache:
+    """
+    Общий для заданий и процессов кеш HTTP-ответов на диске: база SQLite в WAL-режиме,
+    тела ответов сжаты zlib и хранятся вместе с валидаторами (ETag, Last-Modified) и сроком свежести.
+    Свежий ответ отдается без обращения к сети; устаревший с валидаторами перепроверяется
+    условным запросом (304 продлевает запись). Размер ограничен max_bytes: при превышении
+    вытесняются записи, которые дольше всего не читались (LRU).
+    Методы синхронные и потокобезопасные (соединение SQLite у каждого потока свое);
+    из цикла событий их вызывают через asyncio.to_thread.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, default_ttl: float = 3600, force_ttl: bool = False,
+                 compress_level: int = 6):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, 'responses.sqlite3')
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.force_ttl = force_ttl
+        self.compress_level = compress_level
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._stores_since_check = SIZE_CHECK_EVERY
+        self._size = 0
+        self.totals = {'hit': 0, 'revalidated': 0, 'miss': 0, 'stored': 0, 'evicted': 0}
+
+        connection = self._connection()
+        # auto_vacuum действует только для новой базы: освобожденные вытеснением страницы возвращаются на диск
+        connection.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        connection.executescript(SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute("PRAGMA synchronous = NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def lookup(self, url: str) -> Optional[Dict]:
+        """
+        Запись кеша для URL: тело (распакованное), кодировка, валидаторы и признак свежести.
+        Чтение свежей записи обновляет ее время доступа для LRU. None - записи нет.
+        """
+        try:
+            row = self._connection().execute(
+                "SELECT status, encoding, etag, last_modified, expires_at, body_size, body FROM responses WHERE key = ?",
+                (canonical_url(url),)
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка чтения кеша HTTP-ответов для {url}: {e}")
+            return None
+        if row is None:
+            return None
+
+        status, encoding, etag, last_modified, expires_at, body_size, body = row
+        fresh = expires_at > time.time()
+        if not fresh and not (etag or last_modified):
+            # Устаревшую запись без валидаторов нельзя перепроверить, ее заменит новый ответ
+            return None
+        if fresh:
+            self._touch(url)
+        return {
+            'status': status,
+            'encoding': encoding,
+            'etag': etag,
+            'last_modified': last_modified,
+            'fresh': fresh,
+            'body_size': body_size,
+            'body': zlib.decompress(body)
+        }
+
+    def validators(self, entry: Dict) -> Dict[str, str]:
+        """Заголовки условного запроса для устаревшей записи"""
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def _touch(self, url: str):
+        try:
+            self._connection().execute("UPDATE responses SET accessed_at = ? WHERE key = ?",
+                                       (time.time(), canonical_url(url)))
+        except sqlite3.Error as e:
+            logger.debug(f"Не удалось обновить время доступа записи кеша {url}: {e}")
+
+    def store(self, url: str, status: int, headers: Mapping[str, str], body: bytes,
+              encoding: Optional[str]) -> bool:
+        """Сохранение ответа, если заголовки это разрешают; False - ответ не кешируется"""
+        lifetime = freshness_lifetime(headers, self.default_ttl, self.force_ttl)
+        etag, last_modified = headers.get('ETag'), headers.get('Last-Modified')
+        # Ответ без срока свежести и без валидаторов использовать нельзя
+        if lifetime is None or (lifetime <= 0 and not (etag or last_modified)):
+            return False
+
+        compressed = zlib.compress(body, self.compress_level)
+        now = time.time()
+        try:
+            self._connection().execute("""
+                INSERT OR REPLACE INTO responses
+                (key, status, encoding, etag, last_modified, expires_at, stored_at, accessed_at, body_size, size, body)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (canonical_url(url), status, encoding, etag, last_modified, now + lifetime, now, now,
+                  len(body), len(compressed), compressed))
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка записи в кеш HTTP-ответов для {url}: {e}")
+            return False
+
+        with self._lock:
+            self.totals['stored'] += 1
+            self._size += len(compressed)
+            self._stores_since_check += 1
+            check = self._stores_since_check >= SIZE_CHECK_EVERY or self._size > self.max_bytes
+            if check:
+                self._stores_since_check = 0
+        if check:
+            self._enforce_size()
+        return True
+
+    def refresh(self, url: str, headers: Mapping[str, str]) -> bool:
+        """Продление записи после ответа 304: новый срок свежести и валидаторы из заголовков"""
+        lifetime = freshness_lifetime(headers, self.default_ttl, self.force_ttl)
+        if lifetime is None:
+            self.delete(url)
+            return False
+        now = time.time()
+        try:
+            self._connection().execute("""
+                UPDATE responses
+                SET expires_at = ?, accessed_at = ?,
+                    etag = COALESCE(?, etag), last_modified = COALESCE(?, last_modified)
+                WHERE key = ?
+            """, (now + lifetime, now, headers.get('ETag'), headers.get('Last-Modified'), canonical_url(url)))
+            return True
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка обновления записи кеша HTTP-ответов для {url}: {e}")
+            return False
+
+    def delete(self, url: str):
+        try:
+            self._connection().execute("DELETE FROM responses WHERE key = ?", (canonical_url(url),))
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка удаления записи кеша HTTP-ответов для {url}: {e}")
+
+    def size(self) -> int:
+        """Суммарный размер сжатых тел в кеше, байт"""
+        return self._connection().execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def _enforce_size(self):
+        """Вытеснение давно не читавшихся записей, пока размер не станет меньше EVICT_TARGET от max_bytes"""
+        connection = self._connection()
+        try:
+            size = self.size()
+            evicted = 0
+            if size > self.max_bytes:
+                excess = size - int(self.max_bytes * EVICT_TARGET)
+                keys, freed = [], 0
+                for key, entry_size in connection.execute("SELECT key, size FROM responses ORDER BY accessed_at"):
+                    keys.append((key,))
+                    freed += entry_size
+                    if freed >= excess:
+                        break
+                connection.executemany("DELETE FROM responses WHERE key = ?", keys)
+                connection.execute("PRAGMA incremental_vacuum")
+                evicted, size = len(keys), size - freed
+                logger.info(f"Из кеша HTTP-ответов вытеснено {evicted} записей ({freed / 1048576:.1f} МБ)")
+            with self._lock:
+                self._size = size
+                self.totals['evicted'] += evicted
+            if evicted:
+                REGISTRY.inc('crawler_http_cache_evictions_total', evicted)
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка вытеснения из кеша HTTP-ответов: {e}")
+
+    def record(self, outcome: str):
+        """Учет обращения к кешу: 'hit', 'revalidated' или 'miss'"""
+        with self._lock:
+            self.totals[outcome] += 1
+        REGISTRY.inc('crawler_http_cache_requests_total', outcome=outcome)
+
+
+_default_cache: Optional[ResponseCache] = None
+_default_cache_lock = threading.Lock()
+
+
+def default_response_cache() -> Optional[ResponseCache]:
+    """Кеш HTTP-ответов процесса из конфигурации (CRAWL_HTTP_CACHE_DIR); None - кеш выключен"""
+    global _default_cache
+    if not Config.CRAWL_HTTP_CACHE_DIR:
+        return None
+    with _default_cache_lock:
+        if _default_cache is None:
+            try:
+                _default_cache = ResponseCache(
+                    Config.CRAWL_HTTP_CACHE_DIR,
+                    max_bytes=Config.CRAWL_HTTP_CACHE_MAX_MB * 1048576,
+                    default_ttl=Config.CRAWL_HTTP_CACHE_TTL,
+                    force_ttl=Config.CRAWL_HTTP_CACHE_FORCE_TTL
+                )
+                logger.info(f"Кеш HTTP-ответов: {_default_cache.path}, до {Config.CRAWL_HTTP_CACHE_MAX_MB} МБ")
+            except (OSError, sqlite3.Error) as e:
+                logger.error(f"Кеш HTTP-ответов недоступен ({Config.CRAWL_HTTP_CACHE_DIR}): {e}")
+                return None
+        return _default_cache
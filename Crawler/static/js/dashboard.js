@@ -2,14 +2,15 @@ class DashboardProgressTracker {
     constructor() {
         this.activeJobs = new Set();
         this.updateInterval = null;
+        this.etag = null;
         this.init();
     }
 
     init() {
         // Находим все активные задания
         document.querySelectorAll('tr[data-job-id]').forEach(row => {
-            const statusBadge = row.querySelector('.badge');
-            if (statusBadge && statusBadge.textContent.trim() === 'running') {
+            const status = row.getAttribute('data-job-status');
+            if (status === 'running' || status === 'queued') {
                 const jobId = row.getAttribute('data-job-id');
                 this.activeJobs.add(parseInt(jobId));
             }
@@ -26,7 +27,7 @@ class DashboardProgressTracker {
         if (alert && text) {
             const count = this.activeJobs.size;
             text.textContent = `У вас ${count} активных заданий. Прогресс обновляется автоматически.`;
-            alert.style.display = 'block';
+            alert.classList.remove('d-none');
         }
     }
 
@@ -36,25 +37,38 @@ class DashboardProgressTracker {
     }
 
     updateProgress() {
-        this.activeJobs.forEach(jobId => {
-            fetch(`/api/job/${jobId}/progress`)
-                .then(response => response.json())
-                .then(data => {
-                    if (data.active) {
-                        this.updateJobRow(jobId, data);
+        // Прогресс всех активных заданий одним запросом; неизменившееся состояние приходит как 304
+        const ids = Array.from(this.activeJobs).join(',');
+        const headers = this.etag ? {'If-None-Match': this.etag} : {};
+        fetch(`/api/jobs/progress?ids=${ids}`, {headers})
+            .then(response => {
+                if (response.status === 304) {
+                    return null;
+                }
+                this.etag = response.headers.get('ETag');
+                return response.json();
+            })
+            .then(data => {
+                if (!data || !data.jobs) {
+                    return;
+                }
+                Array.from(this.activeJobs).forEach(jobId => {
+                    const jobData = data.jobs[jobId];
+                    if (jobData && jobData.active) {
+                        this.updateJobRow(jobId, jobData);
                     } else {
                         // Задание больше не активно
                         this.activeJobs.delete(jobId);
-                        if (this.activeJobs.size === 0) {
-                            this.stopTracking();
-                            location.reload(); // Обновляем страницу
-                        }
                     }
-                })
-                .catch(error => {
-                    console.error(`Ошибка получения прогресса для задания ${jobId}:`, error);
                 });
-        });
+                if (this.activeJobs.size === 0) {
+                    this.stopTracking();
+                    location.reload(); // Обновляем страницу
+                }
+            })
+            .catch(error => {
+                console.error('Ошибка получения прогресса заданий:', error);
+            });
     }
 
     updateJobRow(jobId, data) {
@@ -63,7 +77,7 @@ class DashboardProgressTracker {
         // Обновляем прогресс-бар
         const progressBar = document.getElementById(`progress-${jobId}`);
         if (progressBar) {
-            const progress = Math.min(100, Math.max(0, data.progress));
+            const progress = Math.min(100, Math.max(0, data.progress || 0));
             progressBar.style.width = progress + '%';
             progressBar.innerHTML = `<small>${progress}%</small>`;
         }
@@ -82,7 +96,11 @@ class DashboardProgressTracker {
         // Скрываем alert
         const alert = document.getElementById('active-jobs-alert');
         if (alert) {
-            alert.style.display = 'none';
+            alert.classList.add('d-none');
         }
     }
-}
\ No newline at end of file
+}
+
+document.addEventListener('DOMContentLoaded', function() {
+    new DashboardProgressTracker();
+});
@@ -39,12 +39,53 @@ class JobProgressTracker {
 
     startTracking() {
         this.startTime = new Date();
+        // Обновляем время выполнения каждую секунду
+        this.timeInterval = setInterval(() => this.updateExecutionTime(), 1000);
+        // Прогресс приходит через Server-Sent Events, опрос - только запасной вариант
+        if (window.EventSource) {
+            this.startStream();
+        } else {
+            this.startPolling();
+        }
+    }
+
+    startStream() {
+        this.streamErrors = 0;
+        this.eventSource = new EventSource(`/api/job/${this.jobId}/progress/stream`);
+        this.eventSource.onopen = () => {
+            this.streamErrors = 0;
+        };
+        this.eventSource.onmessage = (event) => {
+            this.handleProgressData(JSON.parse(event.data));
+        };
+        this.eventSource.addEventListener('end', () => this.closeStream());
+        this.eventSource.onerror = () => {
+            // EventSource переподключается сам; после нескольких неудач подряд переходим на опрос
+            this.streamErrors += 1;
+            if (this.eventSource.readyState === EventSource.CLOSED || this.streamErrors >= 3) {
+                this.closeStream();
+                this.startPolling();
+            }
+        };
+    }
+
+    closeStream() {
+        if (this.eventSource) {
+            this.eventSource.close();
+            this.eventSource = null;
+        }
+    }
+
+    startPolling() {
+        if (this.progressInterval) {
+            return;
+        }
         this.updateProgress();
         this.progressInterval = setInterval(() => this.updateProgress(), 2000);
-        this.timeInterval = setInterval(() => this.updateExecutionTime(), 1000);
     }
 
     stopTracking() {
+        this.closeStream();
         if (this.progressInterval) {
             clearInterval(this.progressInterval);
             this.progressInterval = null;
@@ -71,25 +112,26 @@ class JobProgressTracker {
     updateProgress() {
         fetch(`/api/job/${this.jobId}/progress`)
             .then(response => response.json())
-            .then(data => {
-                if (data.error) {
-                    console.error('Ошибка получения прогресса:', data.error);
-                    this.handleError('Ошибка получения прогресса: ' + data.error);
-                    return;
-                }
-
-                if (data.active) {
-                    this.updateActiveJob(data);
-                } else {
-                    this.updateInactiveJob(data);
-                }
-            })
+            .then(data => this.handleProgressData(data))
             .catch(error => {
                 console.error('Ошибка запроса прогресса:', error);
                 this.handleError('Ошибка соединения с сервером');
             });
     }
 
+    handleProgressData(data) {
+        if (data.error) {
+            console.error('Ошибка получения прогресса:', data.error);
+            this.handleError('Ошибка получения прогресса: ' + data.error);
+            return;
+        }
+        if (data.active) {
+            this.updateActiveJob(data);
+        } else {
+            this.updateInactiveJob(data);
+        }
+    }
+
     updateActiveJob(data) {
         if (this.elements.progressCard) {
             this.elements.progressCard.classList.remove('d-none');
@@ -204,33 +246,42 @@ class JobProgressTracker {
 
     getStatusText(status) {
         const statusMap = {
+            'queued': 'В очереди',
             'starting': 'Запуск',
             'running': 'Выполняется',
             'processing': 'Обработка',
             'completed': 'Завершено',
-            'failed': 'Ошибка'
+            'failed': 'Ошибка',
+            'paused': 'Приостановлено',
+            'cancelled': 'Отменено'
         };
         return statusMap[status] || status || 'Неизвестно';
     }
 
     getStatusBadgeClass(status) {
         const classMap = {
+            'queued': 'bg-secondary',
             'starting': 'bg-info',
             'running': 'bg-warning',
             'processing': 'bg-primary',
             'completed': 'bg-success',
-            'failed': 'bg-danger'
+            'failed': 'bg-danger',
+            'paused': 'bg-secondary',
+            'cancelled': 'bg-secondary'
         };
         return classMap[status] || 'bg-secondary';
     }
 
     getAlertClass(status) {
         const classMap = {
+            'queued': 'alert-secondary',
             'starting': 'alert-info',
             'running': 'alert-warning',
             'processing': 'alert-primary',
             'completed': 'alert-success',
-            'failed': 'alert-danger'
+            'failed': 'alert-danger',
+            'paused': 'alert-secondary',
+            'cancelled': 'alert-secondary'
         };
         return classMap[status] || 'alert-info';
     }
@@ -24,6 +24,10 @@ class JobProgressTracker {
             pagesProcessed: document.getElementById('pages-processed'),
             totalPages: document.getElementById('total-pages'),
             lastUpdate: document.getElementById('last-update'),
+            crawlRate: document.getElementById('crawl-rate'),
+            crawlEta: document.getElementById('crawl-eta'),
+            loopLag: document.getElementById('loop-lag'),
+            jobMemory: document.getElementById('job-memory'),
             progressMessage: document.getElementById('progress-message'),
             executionTime: document.getElementById('execution-time'),
             jobStatus: document.getElementById('job-status'),
@@ -36,13 +40,53 @@ class JobProgressTracker {
 
     startTracking() {
         this.startTime = new Date();
-        this.updateProgress(); // Первый вызов сразу
-        this.progressInterval = setInterval(() => this.updateProgress(), 2000);
         // Обновляем время выполнения каждую секунду
         this.timeInterval = setInterval(() => this.updateExecutionTime(), 1000);
+        // Прогресс приходит через Server-Sent Events, опрос - только запасной вариант
+        if (window.EventSource) {
+            this.startStream();
+        } else {
+            this.startPolling();
+        }
+    }
+
+    startStream() {
+        this.streamErrors = 0;
+        this.eventSource = new EventSource(`/api/job/${this.jobId}/progress/stream`);
+        this.eventSource.onopen = () => {
+            this.streamErrors = 0;
+        };
+        this.eventSource.onmessage = (event) => {
+            this.handleProgressData(JSON.parse(event.data));
+        };
+        this.eventSource.addEventListener('end', () => this.closeStream());
+        this.eventSource.onerror = () => {
+            // EventSource переподключается сам; после нескольких неудач подряд переходим на опрос
+            this.streamErrors += 1;
+            if (this.eventSource.readyState === EventSource.CLOSED || this.streamErrors >= 3) {
+                this.closeStream();
+                this.startPolling();
+            }
+        };
+    }
+
+    closeStream() {
+        if (this.eventSource) {
+            this.eventSource.close();
+            this.eventSource = null;
+        }
+    }
+
+    startPolling() {
+        if (this.progressInterval) {
+            return;
+        }
+        this.updateProgress(); // Первый вызов сразу
+        this.progressInterval = setInterval(() => this.updateProgress(), 2000);
     }
 
     stopTracking() {
+        this.closeStream();
         if (this.progressInterval) {
             clearInterval(this.progressInterval);
             this.progressInterval = null;
@@ -68,24 +112,26 @@ class JobProgressTracker {
     updateProgress() {
         fetch(`/api/job/${this.jobId}/progress`)
             .then(response => response.json())
-            .then(data => {
-                if (data.error) {
-                    console.error('Ошибка получения прогресса:', data.error);
-                    this.handleError('Ошибка получения прогресса: ' + data.error);
-                    return;
-                }
-                if (data.active) {
-                    this.updateActiveJob(data);
-                } else {
-                    this.updateInactiveJob(data);
-                }
-            })
+            .then(data => this.handleProgressData(data))
             .catch(error => {
                 console.error('Ошибка запроса прогресса:', error);
                 this.handleError('Ошибка соединения с сервером');
             });
     }
 
+    handleProgressData(data) {
+        if (data.error) {
+            console.error('Ошибка получения прогресса:', data.error);
+            this.handleError('Ошибка получения прогресса: ' + data.error);
+            return;
+        }
+        if (data.active) {
+            this.updateActiveJob(data);
+        } else {
+            this.updateInactiveJob(data);
+        }
+    }
+
     updateActiveJob(data) {
         // Показываем карточку прогресса
         if (this.elements.progressCard) {
@@ -122,6 +168,24 @@ class JobProgressTracker {
         if (this.elements.lastUpdate) {
             this.elements.lastUpdate.textContent = data.updated_at || 'Только что';
         }
+        if (this.elements.crawlRate && data.pages_per_sec !== undefined) {
+            const kbPerSec = ((data.bytes_per_sec || 0) / 1024).toFixed(1);
+            this.elements.crawlRate.textContent = `${data.pages_per_sec} стр/с, ${kbPerSec} КБ/с`;
+        }
+        if (this.elements.crawlEta) {
+            this.elements.crawlEta.textContent = data.eta_seconds != null ? `~${data.eta_seconds} с` : '-';
+        }
+        if (this.elements.loopLag && data.loop_lag_ms && data.loop_lag_ms.p50 !== undefined) {
+            const lag = data.loop_lag_ms;
+            const stalls = lag.stalls ? `, блокировок: ${lag.stalls}` : '';
+            this.elements.loopLag.textContent = `p50 ${lag.p50} мс, p99 ${lag.p99} мс${stalls}`;
+        }
+        if (this.elements.jobMemory && data.memory) {
+            const memory = data.memory;
+            const shedding = memory.shedding ? ', бюджет превышен: новые ссылки не добавляются' : '';
+            this.elements.jobMemory.textContent = `задание ~${memory.total} МБ, процесс ${memory.rss} МБ${shedding}`;
+            this.elements.jobMemory.className = memory.shedding ? 'text-danger' : 'text-muted';
+        }
         if (this.elements.progressMessage) {
             this.elements.progressMessage.textContent = data.message || 'Выполнение задания...';
         }
@@ -195,33 +259,42 @@ class JobProgressTracker {
 
     getStatusText(status) {
         const statusMap = {
+            'queued': 'В очереди',
             'starting': 'Запуск',
             'running': 'Выполняется',
             'processing': 'Обработка',
             'completed': 'Завершено',
-            'failed': 'Ошибка'
+            'failed': 'Ошибка',
+            'paused': 'Приостановлено',
+            'cancelled': 'Отменено'
         };
         return statusMap[status] || status || 'Неизвестно';
     }
 
     getStatusBadgeClass(status) {
         const classMap = {
+            'queued': 'bg-secondary',
             'starting': 'bg-info',
             'running': 'bg-warning',
             'processing': 'bg-primary',
             'completed': 'bg-success',
-            'failed': 'bg-danger'
+            'failed': 'bg-danger',
+            'paused': 'bg-secondary',
+            'cancelled': 'bg-secondary'
         };
         return classMap[status] || 'bg-secondary';
     }
 
     getAlertClass(status) {
         const classMap = {
+            'queued': 'alert-secondary',
             'starting': 'alert-info',
             'running': 'alert-warning',
             'processing': 'alert-primary',
             'completed': 'alert-success',
-            'failed': 'alert-danger'
+            'failed': 'alert-danger',
+            'paused': 'alert-secondary',
+            'cancelled': 'alert-secondary'
         };
         return classMap[status] || 'alert-info';
     }
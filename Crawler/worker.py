@@ -0,0 +1,257 @@
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Dict, List
+
+from config import Config
+from crawler import WebCrawler
+from database import db_manager
+from executor import CrawlExecutor
+from metrics import process_rss_bytes, start_metrics_server
+from progress import create_progress_store, queued_snapshot, stopped_snapshot
+from reextract import ArchiveReExtractor
+
+logger = logging.getLogger(__name__)
+
+
+def create_crawl_executor(progress, max_concurrent_jobs: int = None) -> CrawlExecutor:
+    """Запущенный исполнитель заданий с параметрами из конфигурации"""
+    executor = CrawlExecutor(
+        progress,
+        max_concurrent_jobs=max_concurrent_jobs or Config.CRAWL_MAX_CONCURRENT_JOBS,
+        queue_size=Config.CRAWL_QUEUE_SIZE,
+        loops=Config.CRAWL_EXECUTOR_LOOPS,
+        fetch_slots=Config.CRAWL_FETCH_SLOTS,
+        http_options={
+            'limit': Config.CRAWL_HTTP_LIMIT,
+            'limit_per_host': Config.CRAWL_HTTP_LIMIT_PER_HOST,
+            'dns_ttl': Config.CRAWL_DNS_TTL,
+            'job_limit': Config.CRAWL_JOB_CONNECTIONS
+        },
+        lag_interval=Config.CRAWL_LOOP_LAG_INTERVAL,
+        stall_threshold=Config.CRAWL_LOOP_STALL_THRESHOLD
+    )
+    executor.start()
+    return executor
+
+
+class CrawlWorker:
+    """
+    Воркер краулинга: забирает ожидающие задания из crawl_jobs и выполняет их на CrawlExecutor.
+    Заданий захватывается не больше, чем у исполнителя свободных мест, каждое - в аренду на
+    lease_seconds, которая продлевается каждые heartbeat_interval секунд. Задания умершего воркера
+    возвращаются в очередь, как только истечет их аренда; при штатной остановке воркер возвращает их сам.
+    Если RSS процесса превышает memory_limit_mb, воркер не берет новые задания и приостанавливает
+    самое большое по памяти (не чаще раза в heartbeat_interval, пока память не освободится).
+    """
+
+    def __init__(self, db_manager, executor: CrawlExecutor, progress, worker_id: str = None,
+                 lease_seconds: int = 60, heartbeat_interval: float = 15, poll_interval: float = 2,
+                 memory_limit_mb: int = 0):
+        self.db_manager = db_manager
+        self.executor = executor
+        self.progress = progress
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.lease_seconds = lease_seconds
+        self.heartbeat_interval = heartbeat_interval
+        self.poll_interval = poll_interval
+        self.memory_limit = memory_limit_mb * 1048576
+        self._last_memory_pause = 0.0
+        self._stop = threading.Event()
+
+    def run(self):
+        """Основной цикл: продление аренды, возврат брошенных заданий и захват новых до вызова stop()"""
+        logger.info(f"Воркер {self.worker_id} запущен: заданий одновременно {self.executor.max_concurrent_jobs}, "
+                    f"аренда {self.lease_seconds} с")
+        last_heartbeat = 0.0
+        while not self._stop.is_set():
+            if time.monotonic() - last_heartbeat >= self.heartbeat_interval:
+                self.heartbeat()
+                self._hand_back(self.db_manager.requeue_jobs(), 'Воркер задания не отвечает, задание возвращено в очередь')
+                last_heartbeat = time.monotonic()
+
+            self.apply_controls()
+            if not self.check_memory():
+                self.claim()
+            self.db_manager.publish_queue_positions()
+            self._stop.wait(self.poll_interval)
+
+        self.release()
+        logger.info(f"Воркер {self.worker_id} остановлен")
+
+    def stop(self):
+        self._stop.set()
+
+    def claim(self) -> List[int]:
+        """Захват ожидающих заданий на свободные места исполнителя"""
+        jobs = self.db_manager.claim_jobs(self.worker_id, self.executor.free_slots(), self.lease_seconds)
+        for job in jobs:
+            self._start(job)
+        return [job['id'] for job in jobs]
+
+    def check_memory(self) -> bool:
+        """True, если RSS процесса выше лимита; тогда самое большое по памяти задание приостанавливается"""
+        if not self.memory_limit:
+            return False
+        rss = process_rss_bytes()
+        if rss <= self.memory_limit:
+            return False
+        if time.monotonic() - self._last_memory_pause >= self.heartbeat_interval:
+            job_id = self.executor.largest_job()
+            if job_id is not None and self.executor.request_stop(job_id, 'pause', 'превышен лимит памяти воркера'):
+                logger.warning(f"RSS воркера {rss // 1048576} МБ выше лимита, задание {job_id} приостанавливается")
+            self._last_memory_pause = time.monotonic()
+        return True
+
+    def apply_controls(self):
+        """
+        Передача краулерам команд паузы и отмены (удаленные задания отменяются сразу)
+        и запуск запрошенных администратором профилей
+        """
+        job_ids = self.executor.active_jobs()
+        if not job_ids:
+            return
+        controls = self.db_manager.get_job_controls(job_ids)
+        for job_id in job_ids:
+            if job_id not in controls:
+                logger.warning(f"Задание {job_id} удалено, выполнение прерывается")
+                self.executor.cancel(job_id)
+            elif controls[job_id] and not self.executor.request_stop(job_id, controls[job_id]):
+                # Задание еще не начало выполняться: команда применяется сразу в БД
+                self._hand_back(self.db_manager.requeue_jobs(self.worker_id, [job_id]), 'Задание в очереди')
+
+        for profile in self.db_manager.claim_job_profiles(job_ids):
+            self._start_profile(profile)
+
+    def _start_profile(self, profile: Dict):
+        """Профилирование задания; результат сохраняется в job_profiles по окончании"""
+        profile_id = profile['id']
+
+        def on_finish(profiler):
+            self.db_manager.finish_job_profile(profile_id, profiler.samples, profiler.collapsed(),
+                                               profiler.error if not profiler.samples else None)
+
+        duration = min(profile['duration'], Config.CRAWL_PROFILE_MAX_DURATION)
+        if not self.executor.profile_job(profile['job_id'], duration, Config.CRAWL_PROFILE_INTERVAL, on_finish):
+            self.db_manager.finish_job_profile(profile_id, 0, None, 'Задание не выполняется этим воркером')
+
+    def heartbeat(self):
+        """Продление аренды своих заданий; задания, ушедшие другому воркеру, отменяются"""
+        job_ids = self.executor.active_jobs()
+        if not job_ids:
+            return
+        owned = set(self.db_manager.renew_job_leases(self.worker_id, job_ids, self.lease_seconds))
+        for job_id in job_ids:
+            if job_id not in owned:
+                logger.warning(f"Воркер {self.worker_id} потерял аренду задания {job_id}, задание отменяется")
+                self.executor.cancel(job_id)
+
+    def release(self, timeout: float = 10):
+        """Отмена выполняющихся заданий и возврат их в очередь другим воркерам"""
+        job_ids = self.executor.active_jobs()
+        if not job_ids:
+            return
+        for job_id in job_ids:
+            self.executor.cancel(job_id)
+
+        # Ждем, пока задания перестанут писать в БД, прежде чем отдавать их другим воркерам
+        deadline = time.monotonic() + timeout
+        while self.executor.active_jobs() and time.monotonic() < deadline:
+            time.sleep(0.1)
+        self._hand_back(self.db_manager.requeue_jobs(self.worker_id, job_ids),
+                        'Воркер остановлен, задание возвращено в очередь')
+
+    def _hand_back(self, jobs: List[Dict], message: str):
+        """Снимок прогресса возвращенных заданий, видимый всем процессам"""
+        for job in jobs:
+            job_id = job['id']
+            self.progress.discard(job_id)
+            if job['status'] == 'queued':
+                snapshot = queued_snapshot(job_id, message)
+            else:
+                snapshot = stopped_snapshot(job_id, job['status'])
+            self.db_manager.save_job_progress(job_id, snapshot)
+
+    def _start(self, job: Dict):
+        """
+        Создание краулера для захваченного задания и передача его исполнителю
+        (для повторного извлечения из архива - ArchiveReExtractor)
+        """
+        job_id = job['id']
+        crawler_class = ArchiveReExtractor if job['kind'] == 'reextract' else WebCrawler
+        crawler = crawler_class(
+            job_name=job['job_name'],
+            start_url=job['start_url'],
+            user_id=job['user_id'],
+            max_pages=job['max_pages'],
+            delay=job['delay'],
+            max_depth=job['max_depth']
+        )
+        crawler.job_id = job_id
+        crawler.archive_pages = job['archive']
+        crawler.set_db_manager(self.db_manager)
+
+        def progress_callback(**kwargs):
+            self.progress.publish(job_id, {
+                'active': True,
+                'job_id': job_id,
+                'updated_at': datetime.now().strftime('%H:%M:%S'),
+                **kwargs
+            })
+
+        crawler.progress_callback = progress_callback
+
+        # Вес администратора учитывается и при захвате (claim_jobs), и в раздаче слотов загрузки исполнителя
+        weight = Config.CRAWL_ADMIN_WEIGHT if job['role'] == 'admin' else 1
+        if not self.executor.submit(crawler, weight=weight):
+            self._hand_back(self.db_manager.requeue_jobs(self.worker_id, [job_id]), 'Задание в очереди')
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Воркер краулинга: выполняет задания из очереди crawl_jobs")
+    parser.add_argument("--jobs", type=int, default=Config.CRAWL_MAX_CONCURRENT_JOBS,
+                        help="Сколько заданий выполнять одновременно")
+    parser.add_argument("--worker-id", default=None,
+                        help="Имя воркера в crawl_jobs.worker_id (по умолчанию хост-pid-суффикс)")
+    parser.add_argument("--metrics-port", type=int, default=Config.CRAWL_WORKER_METRICS_PORT,
+                        help="Порт HTTP-сервера /metrics (0 - не запускать)")
+    parser.add_argument("--metrics-host", default=Config.CRAWL_WORKER_METRICS_HOST,
+                        help="Адрес HTTP-сервера /metrics (0.0.0.0 - все интерфейсы)")
+    args = parser.parse_args()
+
+    if Config.PROGRESS_BACKEND == 'memory':
+        logger.warning("PROGRESS_BACKEND=memory: прогресс заданий воркера не будет виден веб-серверу")
+
+    progress = create_progress_store(
+        Config.PROGRESS_BACKEND, db_manager,
+        write_interval=Config.PROGRESS_WRITE_INTERVAL,
+        poll_interval=Config.PROGRESS_POLL_INTERVAL
+    )
+    worker = CrawlWorker(
+        db_manager, create_crawl_executor(progress, args.jobs), progress,
+        worker_id=args.worker_id,
+        lease_seconds=Config.CRAWL_WORKER_LEASE,
+        heartbeat_interval=Config.CRAWL_WORKER_HEARTBEAT,
+        poll_interval=Config.CRAWL_WORKER_POLL_INTERVAL,
+        memory_limit_mb=Config.CRAWL_PROCESS_MEMORY_MB
+    )
+
+    if args.metrics_port:
+        start_metrics_server(args.metrics_port, args.metrics_host, Config.METRICS_TOKEN)
+        logger.info(f"Метрики воркера доступны на {args.metrics_host}:{args.metrics_port}: /metrics")
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: worker.stop())
+    signal.signal(signal.SIGINT, lambda signum, frame: worker.stop())
+    worker.run()
+    progress.flush()
+
+
+if __name__ == "__main__":
+    main()